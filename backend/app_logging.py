@@ -0,0 +1,86 @@
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from decouple import config
+from metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_FORMAT = config("LOG_FORMAT", default="json")  # json or text
+# share of DEBUG records kept, the per request ones would flood the log otherwise
+LOG_DEBUG_SAMPLE_RATE = config("LOG_DEBUG_SAMPLE_RATE", default=0.01, cast=float)
+LOG_QUEUE_SIZE = config("LOG_QUEUE_SIZE", default=10000, cast=int)
+
+ROOT_LOGGER = "crypto_portfolio"
+
+_listener = None
+
+
+def get_logger(name: str):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        # structured fields passed as extra={"fields": {...}}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, debug_rate: float):
+        super().__init__()
+        self.debug_rate = debug_rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.debug_rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener thread, a full queue drops the record instead of blocking the caller."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging():
+    # the event loop only formats and enqueues, the listener thread does the writing
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(
+        JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(LOG_LEVEL.upper())
+    logger.handlers = [handler]
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    # flushes whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
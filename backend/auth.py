@@ -1,21 +1,58 @@
-from typing import Optional
-from fastapi import Depends, Request
+import time
+from collections import OrderedDict
+from typing import Optional, NamedTuple
+import jwt
+from fastapi import Depends, HTTPException, Request
 from fastapi_users import BaseUserManager, IntegerIDMixin, FastAPIUsers
 from fastapi_users.authentication import AuthenticationBackend, BearerTransport, JWTStrategy
+from fastapi_users.jwt import generate_jwt, decode_jwt
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from sqlalchemy.orm import Session
 from models import User
 from database import get_db
+from services import redis_client
+from app_logging import get_logger
 from decouple import config
 
+log = get_logger("auth")
+
 JWT_SIGNING_KEY = config("JWT_SIGNING_KEY")
+JWT_LIFETIME_SECONDS = 3600
+# how long a worker trusts its last revocation lookup for a user
+REVOCATION_CACHE_TTL = config("REVOCATION_CACHE_TTL", default=5, cast=int)
+# while redis is down a lookup up to this old still answers, past it (or without one) requests get a 503
+REVOCATION_MAX_STALE = config("REVOCATION_MAX_STALE", default=60, cast=int)
+REVOCATION_CACHE_MAX_ENTRIES = config("REVOCATION_CACHE_MAX_ENTRIES", default=10000, cast=int)
+
+# user_id -> (revoked_at or None, checked_at), least recently used first
+_revocations = OrderedDict()
+
+
+def revoked_key(user_id: int):
+    return f"crypto_portfolio:revoked_user:{user_id}"
+
+async def revoke_user_tokens(user_id: int):
+    # every token issued before now stops working, kept only as long as such a token could live
+    await redis_client.set(revoked_key(user_id), time.time(), ex=JWT_LIFETIME_SECONDS)
+    _revocations.pop(user_id, None)
 
 class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     reset_password_token_secret = JWT_SIGNING_KEY
     verification_token_secret = JWT_SIGNING_KEY
 
     async def on_after_register(self, user: User, request: Optional[Request] = None):
-        print(f"User registered: {user.email}")
+        log.info(f"User registered: {user.email}")
+
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        # tokens carry these as claims, so old tokens must not outlive the change
+        if {"password", "is_active", "is_verified"} & update_dict.keys():
+            await revoke_user_tokens(user.id)
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        await revoke_user_tokens(user.id)
+
+    async def on_before_delete(self, user: User, request: Optional[Request] = None):
+        await revoke_user_tokens(user.id)
 
 async def get_user_db(session: Session = Depends(get_db)):
     yield SQLAlchemyUserDatabase(session, User)
@@ -25,8 +62,21 @@ async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db
 
 bearer_transport = BearerTransport(tokenUrl="auth/login")
 
+class ClaimsJWTStrategy(JWTStrategy):
+    """JWTStrategy whose tokens also carry what the portfolio routes check, so they can skip the user table."""
+
+    async def write_token(self, user: User) -> str:
+        data = {
+            "sub": str(user.id),
+            "aud": self.token_audience,
+            "iat": time.time(),
+            "active": user.is_active,
+            "verified": user.is_verified,
+        }
+        return generate_jwt(data, self.encode_key, self.lifetime_seconds, algorithm=self.algorithm)
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=JWT_SIGNING_KEY, lifetime_seconds=3600)
+    return ClaimsJWTStrategy(secret=JWT_SIGNING_KEY, lifetime_seconds=JWT_LIFETIME_SECONDS)
 
 auth_backend = AuthenticationBackend(
     name="jwt",
@@ -34,4 +84,67 @@ auth_backend = AuthenticationBackend(
     get_strategy=get_jwt_strategy,
 )
 
-fastapi_users = FastAPIUsers[User, int](get_user_manager, [auth_backend])
\ No newline at end of file
+fastapi_users = FastAPIUsers[User, int](get_user_manager, [auth_backend])
+
+# full user row, for routes that need more than the id
+current_user = fastapi_users.current_user()
+
+
+class TokenUser(NamedTuple):
+    id: int
+    is_active: bool
+    is_verified: bool
+    # unix seconds from the token, expires_at is None for a token without exp
+    issued_at: float = 0.0
+    expires_at: float | None = None
+
+def _remember_revocation(user_id: int, revoked_at: float | None, checked_at: float):
+    _revocations[user_id] = (revoked_at, checked_at)
+    _revocations.move_to_end(user_id)
+    while len(_revocations) > REVOCATION_CACHE_MAX_ENTRIES:
+        _revocations.popitem(last=False)
+
+async def _revoked_at(user_id: int):
+    cached = _revocations.get(user_id)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] >= REVOCATION_MAX_STALE:
+        del _revocations[user_id]
+        cached = None
+    if cached is not None and now - cached[1] < REVOCATION_CACHE_TTL:
+        _revocations.move_to_end(user_id)
+        return cached[0]
+    try:
+        raw = await redis_client.get(revoked_key(user_id))
+    except Exception as e:
+        log.warning(f"Revocation lookup failed: {e}")
+        # a recent answer rides out a short redis blip, otherwise fail closed:
+        # a revoked token must not get through just because redis is down
+        if cached is not None:
+            return cached[0]
+        raise HTTPException(status_code=503, detail="Authentication is temporarily unavailable")
+    revoked_at = float(raw) if raw else None
+    _remember_revocation(user_id, revoked_at, now)
+    return revoked_at
+
+async def current_token_user(token: Optional[str] = Depends(bearer_transport.scheme)) -> TokenUser:
+    # verifies the signed claims instead of loading the user, one cached redis check for revocation
+    if token is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        data = decode_jwt(token, JWT_SIGNING_KEY, ["fastapi-users:auth"])
+        expires_at = data.get("exp")
+        user = TokenUser(
+            int(data["sub"]), data["active"], data["verified"], float(data["iat"]),
+            float(expires_at) if expires_at is not None else None
+        )
+    except (jwt.PyJWTError, KeyError, ValueError):
+        # tokens issued before the claims were added fail here too, the client logs in again
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not user.is_active or await is_revoked(user):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user
+
+async def is_revoked(user: TokenUser):
+    # tokens issued at or before the user's last revocation, raises 503 like _revoked_at when it can't tell
+    revoked_at = await _revoked_at(user.id)
+    return revoked_at is not None and user.issued_at <= revoked_at
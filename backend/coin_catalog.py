@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import json
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from sqlalchemy import select, delete, insert, func
+from decouple import config
+from database import async_session_maker, DATABASE_DIR
+from models import Coin
+from services import get_http_client, coin_throttler, HTTP_TIMEOUT
+from app_logging import get_logger, setup_logging, shutdown_logging
+
+log = get_logger("coin_catalog")
+
+CATALOG_REFRESH_INTERVAL = config("CATALOG_REFRESH_INTERVAL", default=86400, cast=int)  # daily
+CATALOG_RETRY_INTERVAL = config("CATALOG_RETRY_INTERVAL", default=600, cast=int)
+# 250 coins per page, 60 pages covers the whole ~15k coin list
+CATALOG_MAX_PAGES = config("CATALOG_MAX_PAGES", default=60, cast=int)
+CATALOG_PAGE_SIZE = 250
+# written after every successful online refresh so an offline start still has the full list
+COIN_SNAPSHOT_PATH = config("COIN_SNAPSHOT_PATH", default=os.path.join(DATABASE_DIR, "coins_snapshot.json"))
+# small snapshot shipped with the code, used until the first online refresh
+BUNDLED_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coins_snapshot.json")
+
+
+def to_catalog_row(market_coin: dict):
+    # /coins/markets rows and snapshot rows share this shape
+    icon_url = market_coin.get("image")
+    return {
+        "id": market_coin["id"],
+        "symbol": (market_coin.get("symbol") or "").lower(),
+        "name": market_coin.get("name") or market_coin["id"],
+        "icon_url": icon_url,
+        "thumb_url": icon_url.replace("/large/", "/thumb/") if icon_url and "/large/" in icon_url else icon_url,
+        "market_cap_rank": market_coin.get("market_cap_rank"),
+    }
+
+
+async def fetch_market_pages(max_pages: int = CATALOG_MAX_PAGES):
+    coins = []
+    for page in range(1, max_pages + 1):
+        await coin_throttler.acquire()
+        response = await get_http_client().get(
+            "/coins/markets",
+            params={
+                "vs_currency": "usd",
+                "order": "market_cap_desc",
+                "per_page": CATALOG_PAGE_SIZE,
+                "page": page,
+            },
+            timeout=HTTP_TIMEOUT
+        )
+        if response.status_code != 200:
+            # a partial list would drop coins from the catalog, keep the old one and retry later
+            raise RuntimeError(f"/coins/markets page {page} returned {response.status_code}")
+        page_coins = response.json()
+        coins.extend(page_coins)
+        if len(page_coins) < CATALOG_PAGE_SIZE:
+            break
+    return coins
+
+
+def snapshot_path():
+    for path in (COIN_SNAPSHOT_PATH, BUNDLED_SNAPSHOT_PATH):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_snapshot():
+    path = snapshot_path()
+    if path is None:
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def last_refresh_age():
+    # the snapshot is only written by a successful online refresh, so its mtime is our refresh clock
+    if not os.path.exists(COIN_SNAPSHOT_PATH):
+        return None
+    return time.time() - os.path.getmtime(COIN_SNAPSHOT_PATH)
+
+
+def write_snapshot(market_coins: list):
+    tmp_path = f"{COIN_SNAPSHOT_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(market_coins, f)
+    os.replace(tmp_path, COIN_SNAPSHOT_PATH)
+
+
+class CoinSearchIndex:
+    """
+    In memory prefix search over coin id, symbol and name, best market cap first.
+    - coins are kept in market cap rank order, so a coin's position is also its rank
+    - one sorted list of lowercased keys with a parallel array of coin positions, bisect finds a prefix's range
+    - one and two letter prefixes match thousands of keys, their top results are kept once computed
+    """
+
+    SHORT_PREFIX = 2
+    SHORT_PREFIX_RESULTS = 50
+
+    def __init__(self):
+        self.coins = []
+        self._positions = {}
+        self._keys = []
+        self._owners = array("I")
+        self._short = {}
+        # built from a full online snapshot, the bundled one only has the top coins
+        self.complete = False
+        self.source_mtime = None
+
+    def build(self, market_coins: list, complete: bool = False, source_mtime: float | None = None):
+        coins = list({row["id"]: row for row in map(to_catalog_row, market_coins)}.values())
+        coins.sort(key=lambda row: (row["market_cap_rank"] is None, row["market_cap_rank"] or 0))
+        entries = set()
+        for position, row in enumerate(coins):
+            name = row["name"].lower()
+            # every word of the name too, so "bitcoin" also finds "Wrapped Bitcoin"
+            for key in (row["id"], row["symbol"], name, *name.split()[1:]):
+                if key:
+                    entries.add((key, position))
+        entries = sorted(entries)
+        # swapped in one go, searches running meanwhile see the old or the new index
+        self._keys, self._owners, self._short, self.coins, self._positions, self.complete, self.source_mtime = (
+            [key for key, _ in entries],
+            array("I", (position for _, position in entries)),
+            {},
+            coins,
+            {row["id"]: position for position, row in enumerate(coins)},
+            complete,
+            source_mtime,
+        )
+
+    def search(self, query: str, limit: int):
+        prefix = query.strip().lower()
+        if not prefix:
+            return self.coins[:limit]
+        coins = self.coins
+        if len(prefix) <= self.SHORT_PREFIX and limit <= self.SHORT_PREFIX_RESULTS:
+            short = self._short
+            positions = short.get(prefix)
+            if positions is None:
+                positions = short[prefix] = self._top(prefix, self.SHORT_PREFIX_RESULTS)
+            return [coins[position] for position in positions[:limit]]
+        return [coins[position] for position in self._top(prefix, limit)]
+
+    def _top(self, prefix: str, limit: int):
+        keys = self._keys
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + "\uffff", start)
+        return heapq.nsmallest(limit, set(self._owners[start:end]))
+
+    def get(self, coin_id: str):
+        position = self._positions.get(coin_id)
+        return self.coins[position] if position is not None else None
+
+    def __contains__(self, coin_id: str):
+        return coin_id in self._positions
+
+    def __len__(self):
+        return len(self.coins)
+
+
+coin_index = CoinSearchIndex()
+
+
+def load_coin_index():
+    # rebuilds the search index when the snapshot changed, a refresh in another worker included
+    path = snapshot_path()
+    if path is None:
+        return len(coin_index)
+    mtime = os.path.getmtime(path)
+    if mtime != coin_index.source_mtime:
+        with open(path) as f:
+            market_coins = json.load(f)
+        coin_index.build(market_coins, complete=path == COIN_SNAPSHOT_PATH, source_mtime=mtime)
+        log.info(f"Coin search index built: {len(coin_index)} coins")
+    return len(coin_index)
+
+
+async def replace_catalog(market_coins: list):
+    # one transaction, readers see either the old or the new catalog
+    rows = list({row["id"]: row for row in map(to_catalog_row, market_coins)}.values())
+    async with async_session_maker() as session:
+        async with session.begin():
+            await session.execute(delete(Coin))
+            if rows:
+                await session.execute(insert(Coin), rows)
+    return len(rows)
+
+
+async def catalog_size():
+    async with async_session_maker() as session:
+        return await session.scalar(select(func.count()).select_from(Coin))
+
+
+async def refresh_catalog():
+    market_coins = await fetch_market_pages()
+    if not market_coins:
+        log.warning("Coin catalog refresh got no coins, keeping the current catalog")
+        return 0
+    loaded = await replace_catalog(market_coins)
+    await asyncio.to_thread(write_snapshot, market_coins)
+    await asyncio.to_thread(load_coin_index)
+    log.info(f"Coin catalog refreshed: {loaded} coins")
+    return loaded
+
+
+async def load_catalog_from_snapshot():
+    market_coins = await asyncio.to_thread(read_snapshot)
+    loaded = await replace_catalog(market_coins)
+    log.info(f"Coin catalog loaded from snapshot: {loaded} coins")
+    return loaded
+
+
+async def ensure_catalog():
+    # an empty coins table is filled from the snapshot, the failover price provider maps symbols through it
+    try:
+        if not await catalog_size():
+            await load_catalog_from_snapshot()
+    except Exception as e:
+        # another worker starting at the same time may have filled it
+        log.warning(f"Coin catalog load from snapshot failed: {e}")
+
+
+class CatalogRefresher:
+    """Loads the coin catalog from the local snapshot at startup, then refreshes it from CoinGecko daily."""
+
+    def __init__(self, interval: int = CATALOG_REFRESH_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def follow_snapshot(self):
+        # api workers without the refresher only pick up the snapshot the refresher process writes
+        while True:
+            await asyncio.sleep(CATALOG_RETRY_INTERVAL)
+            try:
+                await asyncio.to_thread(load_coin_index)
+            except Exception as e:
+                log.warning(f"Coin search index reload failed: {e}")
+
+    async def run_forever(self):
+        await ensure_catalog()
+        while True:
+            age = last_refresh_age()
+            if age is not None and age < self.interval:
+                # wakes up now and then to pick up a snapshot another worker refreshed
+                await asyncio.sleep(min(self.interval - age, CATALOG_RETRY_INTERVAL))
+                await asyncio.to_thread(load_coin_index)
+                continue
+            try:
+                if not await refresh_catalog():
+                    await asyncio.sleep(CATALOG_RETRY_INTERVAL)
+            except Exception as e:
+                log.warning(f"Coin catalog refresh failed: {e}")
+                await asyncio.sleep(CATALOG_RETRY_INTERVAL)
+
+    def start(self, refresh: bool = True):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever() if refresh else self.follow_snapshot())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+catalog_refresher = CatalogRefresher()
+
+
+if __name__ == "__main__":
+    # run as its own process: python coin_catalog.py, or a one off refresh: python coin_catalog.py once
+    setup_logging()
+    asyncio.run(refresh_catalog() if sys.argv[1:] == ["once"] else catalog_refresher.run_forever())
+    shutdown_logging()
@@ -1,28 +1,91 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import codecs
+import csv
+import json
+import re
+import time
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, insert
+from collections import deque
 from contextlib import asynccontextmanager
-from database import engine, Base, DATABASE_PATH, get_db
-from auth import fastapi_users, auth_backend
+from datetime import datetime, timezone
+from database import engine, Base, get_db, async_session_maker
+from auth import fastapi_users, auth_backend, current_user, current_token_user, is_revoked, TokenUser
 from schemas import UserCreate, UserRead, UserUpdate  
-from models import User, Holding
-from portfolio_schemas import HoldingCreate, HoldingResponse, PortfolioStats
-from services import CoinGeckoService
-from services import CoinGeckoService
+from models import User, Holding, Coin, holdings_user_index
+from portfolio_schemas import HoldingCreate, HoldingResponse, PortfolioStats, PortfolioHistory, HistoryPoint, ImportSummary, ImportRowError, CoinSearchResult
+from services import CoinGeckoService, get_http_client, close_http_client, redis_client, bump_holdings_version, get_versions, holdings_version_key, PRICE_VERSION_KEY, DeadlineMiddleware, set_deadline
+from price_refresher import price_refresher
+from coin_catalog import catalog_refresher, coin_index, ensure_catalog, load_coin_index
+from portfolio_valuation import begin_holdings_write, apply_holding_deltas, get_valuation, read_rebuild_stamp, store_valuation
+from price_stream import price_broadcaster, publish_holdings_changed, STREAM_KEEPALIVE
+from price_history import get_value_series, HISTORY_RANGES
 from test.test_endpoints import test_router
+from app_logging import get_logger, setup_logging, shutdown_logging
+from metrics import RequestMetricsMiddleware, instrument_engine, render_metrics
 from decouple import config
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from typing import Optional
+
+setup_logging()
+log = get_logger("main")
+# sql timings per endpoint for /metrics
+instrument_engine(engine)
+
+# run the price refresher inside the api process, disable when it runs as its own process
+PRICE_REFRESHER_ENABLED = config("PRICE_REFRESHER_ENABLED", default=True, cast=bool)
+# the coin catalog refresher pages through the whole coingecko list, one runner is enough:
+# enable it in a single api worker or run python coin_catalog.py, the others reload its snapshot
+CATALOG_REFRESHER_ENABLED = config("CATALOG_REFRESHER_ENABLED", default=False, cast=bool)
+
+# opt in: the holdings list is built as plain dicts from column rows and encoded with orjson,
+# skipping the HoldingResponse models and the second validation against response_model
+FAST_JSON_RESPONSES = config("FAST_JSON_RESPONSES", default=False, cast=bool)
+HOLDING_COLUMNS = (
+    Holding.id, Holding.coin, Holding.coin_symbol, Holding.icon_url, Holding.quantity,
+    Holding.buy_price, Holding.currency, Holding.notes, Holding.created_at
+)
+
+PORTFOLIO_PAGE_MAX = 500
+COIN_SEARCH_LIMIT = 10
+COIN_SEARCH_MAX = 50
+PORTFOLIO_STREAM_CHUNK = 500
+IMPORT_MAX_ROWS = config("IMPORT_MAX_ROWS", default=5000, cast=int)
+IMPORT_MAX_BYTES = 5 * 1024 * 1024
+PORTFOLIO_CACHE_CONTROL = "private, no-cache"
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    print("Database initialized successfully!")
-    print(f"Database location: {DATABASE_PATH}")
+        # create_all skips indexes on tables that already exist, add it to older databases too
+        await conn.run_sync(lambda sync_conn: holdings_user_index.create(sync_conn, checkfirst=True))
+    log.info("Database initialized successfully!")
+    log.info(f"Database location: {engine.url.render_as_string(hide_password=True)}")
+    # shared pooled coingecko client for the whole process
+    get_http_client()
+    # coin search and HoldingCreate.coin validation, from the local snapshot so startup never waits on coingecko
+    await asyncio.to_thread(load_coin_index)
+    # with or without the catalog refresher, the price failover needs the coins table before the first fetch
+    await ensure_catalog()
+    if PRICE_REFRESHER_ENABLED:
+        price_refresher.start()
+    catalog_refresher.start(refresh=CATALOG_REFRESHER_ENABLED)
+    # one pub/sub subscription per process for every open /portfolio/stream
+    price_broadcaster.start()
     yield
+    await price_broadcaster.stop()
+    await catalog_refresher.stop()
+    await price_refresher.stop()
+    await close_http_client()
+    await redis_client.aclose()
     await engine.dispose()
-    print("Database connection closed.")
+    log.info("Database connection closed.")
+    shutdown_logging()
 
 app = FastAPI(
     title="Crypto Portfolio Tracker API",
@@ -39,7 +102,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After", "ETag"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
 
 app.include_router(
     fastapi_users.get_auth_router(auth_backend),
@@ -66,7 +132,7 @@ class UserDashboardResponse(BaseModel):
 
 @app.get("/users/me/dashboard", response_model=UserDashboardResponse, tags=["users"])
 async def get_current_user_for_dashboard(
-    user: User = Depends(fastapi_users.current_user())
+    user: User = Depends(current_user)
     ):
 
     return UserDashboardResponse(
@@ -81,27 +147,67 @@ ENABLE_TEST_ENDPOINTS = config("ENABLE_TEST_ENDPOINTS", default=False, cast=bool
 
 if ENABLE_TEST_ENDPOINTS:
     app.include_router(test_router)
-    print("Test endpoints ENABLED - for development only")
+    log.info("Test endpoints ENABLED - for development only")
 else:
-    print("Test endpoints DISABLED - production mode")
+    log.info("Test endpoints DISABLED - production mode")
 
 
 # APP ENDPOINTS DEFAULT====================
+async def holdings_changed(user_id: int):
+    # invalidates the user's ETags and reloads their open streams
+    await bump_holdings_version(user_id)
+    await publish_holdings_changed(user_id)
+
+async def portfolio_etag(request: Request, user_id: int):
+    # holdings version x price version, read before the data so a racing write only costs a 200
+    # weak because price_age_seconds keeps moving while the prices themselves don't
+    try:
+        holdings_version, price_version = await get_versions([holdings_version_key(user_id), PRICE_VERSION_KEY])
+    except Exception as e:
+        log.warning(f"Version lookup failed, skipping ETag: {e}")
+        return None
+    query = f"-{request.url.query}" if request.url.query else ""
+    return f'W/"{user_id}-{holdings_version}-{price_version}{query}"'
+
+def not_modified(request: Request, etag: str | None):
+    if etag is None:
+        return None
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PORTFOLIO_CACHE_CONTROL})
+    return None
+
+def set_etag(response: Response, etag: str | None):
+    if etag is not None:
+        response.headers["ETag"] = etag
+        # the browser keeps the body and revalidates every poll, so axios sees a 200 either way
+        response.headers["Cache-Control"] = PORTFOLIO_CACHE_CONTROL
+
 @app.post("/portfolio/", response_model=HoldingResponse)
 async def add_holding(
     holding_data: HoldingCreate,
-    user: User = Depends(fastapi_users.current_user()),
+    user: TokenUser = Depends(current_token_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # get current price from coingecko in the specified currency
-    current_price = await CoinGeckoService.get_current_price(holding_data.coin, holding_data.currency)
+    # icon comes from the local coin catalog, or the search index until the catalog table is loaded,
+    # only coins neither knows cost an upstream call
+    catalog_coin = await db.get(Coin, holding_data.coin)
+    indexed_coin = coin_index.get(holding_data.coin)
+    icon_url = (catalog_coin and catalog_coin.icon_url) or (indexed_coin and indexed_coin["icon_url"])
+    if icon_url:
+        current_price = await CoinGeckoService.get_current_price(holding_data.coin, holding_data.currency)
+    else:
+        # get current price from coingecko in the specified currency, icon lookup runs alongside it
+        current_price, icon_url = await asyncio.gather(
+            CoinGeckoService.get_current_price(holding_data.coin, holding_data.currency),
+            CoinGeckoService.get_coin_icon_url(holding_data.coin),
+        )
 
     if current_price is None:
         raise HTTPException(
             status_code=503,
             detail="CoinGecko API is currently unavailable. Please try again later."
         )
-    icon_url = await CoinGeckoService.get_coin_icon_url(holding_data.coin)
     holding = Holding(
         user_id=user.id,
         coin=holding_data.coin,
@@ -114,8 +220,13 @@ async def add_holding(
     )
     
     db.add(holding)
+    await begin_holdings_write(user.id)
     await db.commit()
     await db.refresh(holding)
+    await apply_holding_deltas(user.id, [(
+        holding.coin, holding.currency, holding.quantity, holding.quantity * holding.buy_price, 1, current_price
+    )])
+    await holdings_changed(user.id)
     
     # calculate profit/loss for response
     total_invested = holding.quantity * holding.buy_price
@@ -140,97 +251,519 @@ async def add_holding(
         created_at=holding.created_at
     )
 
+async def read_import_body(request: Request):
+    # the upload as decoded text pieces, 413 as soon as it goes over IMPORT_MAX_BYTES
+    # so an oversized file is never held in memory
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Import file is too large")
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > IMPORT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Import file is too large")
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+class _PendingLines:
+    # csv.reader input fed one complete record at a time
+    def __init__(self):
+        self.queue = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.queue:
+            raise StopIteration
+        return self.queue.popleft()
+
+def _csv_record(header: list, row: list):
+    # missing trailing fields are None, extra ones are dropped
+    row = row + [None] * (len(header) - len(row))
+    return {k: v.strip() if v else None for k, v in zip(header, row) if k}
+
+async def iter_csv_rows(pieces):
+    # a dict per record under the header row, like csv.DictReader
+    # a quoted field may span lines, a record is complete once its quotes are balanced
+    lines = _PendingLines()
+    reader = csv.reader(lines)
+    header = None
+    record = []
+    quotes = 0
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        *complete, buffer = buffer.split("\n")
+        for line in complete:
+            record.append(line + "\n")
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            lines.queue.append("".join(record))
+            record, quotes = [], 0
+            row = next(reader)
+            if not row:
+                continue
+            if header is None:
+                header = [name.strip() for name in row]
+                continue
+            yield _csv_record(header, row)
+    if buffer or record:
+        lines.queue.append("".join(record) + buffer)
+        row = next(reader, None)
+        if row and header is not None:
+            yield _csv_record(header, row)
+
+JSON_SPACE = re.compile(r"[ \t\n\r]*")
+
+async def iter_json_rows(pieces):
+    # the elements of a json list, each decoded as soon as it has fully arrived
+    decoder = json.JSONDecoder()
+    buffer = ""
+    state = "start"  # start -> first -> (value -> separator)* -> done
+    async for piece in pieces:
+        buffer += piece
+        pos = 0
+        while True:
+            pos = JSON_SPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if state == "done":
+                raise ValueError("extra data after the JSON list")
+            if state == "start":
+                if char != "[":
+                    raise ValueError("expected a JSON list of holdings")
+                state = "first"
+                pos += 1
+            elif state == "separator" or (state == "first" and char == "]"):
+                if char == "]":
+                    state = "done"
+                elif char == "," and state == "separator":
+                    state = "value"
+                else:
+                    raise ValueError(f"expected ',' or ']' in the JSON list, got {char!r}")
+                pos += 1
+            else:
+                try:
+                    row, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # the rest of this element hasn't arrived yet
+                if end == len(buffer):
+                    break  # a number may go on in the next piece
+                yield row
+                state = "separator"
+                pos = end
+        buffer = buffer[pos:]
+    if state != "done":
+        if buffer.strip():
+            decoder.raw_decode(buffer.strip())  # raises the decoder's own error for a malformed element
+        raise ValueError("incomplete JSON list")
+
+async def parse_import_rows(request: Request, content_type: str):
+    # yields (row_number, raw row) from a csv (with a header row) or a json list upload, as it streams in
+    pieces = read_import_body(request)
+    rows = iter_csv_rows(pieces) if content_type.startswith("text/csv") else iter_json_rows(pieces)
+    row_number = 0
+    async for raw in rows:
+        row_number += 1
+        yield row_number, raw
+
+@app.post("/portfolio/import", response_model=ImportSummary)
+async def import_holdings(
+    request: Request,
+    user: TokenUser = Depends(current_token_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # bulk import from an exchange export, csv (Content-Type: text/csv) or a json list
+    # one batched price call for every imported coin, one executemany insert in one transaction
+    # rows are validated as the upload streams in, a file over the row or byte limit stops being read
+    valid = []
+    errors = []
+    try:
+        async for row_number, raw in parse_import_rows(request, request.headers.get("content-type", "")):
+            if row_number > IMPORT_MAX_ROWS:
+                raise HTTPException(status_code=413, detail=f"Import is limited to {IMPORT_MAX_ROWS} rows")
+            try:
+                valid.append((row_number, HoldingCreate.model_validate(raw)))
+            except ValidationError as e:
+                errors.append(ImportRowError(row=row_number, error="; ".join(
+                    f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+                )))
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse import file: {e}")
+    
+    # every (coin, currency) in the file, priced from the cache and one upstream matrix call for the rest
+    pairs = list(dict.fromkeys((h.coin, h.currency) for _, h in valid))
+    quotes = await CoinGeckoService.get_pair_quotes(pairs)
+    prices = {pair: quote.price for pair, quote in quotes.items() if quote}
+    missing = [pair for pair in pairs if pair not in prices]
+    if missing:
+        fresh = await CoinGeckoService.refresh_pairs(missing, blocking=False)
+        prices.update({pair: price for pair, price in fresh.items() if price is not None})
+    
+    # icons from the local coin catalog in one query
+    coins = list({h.coin for _, h in valid})
+    result = await db.execute(select(Coin.id, Coin.icon_url).where(Coin.id.in_(coins)))
+    icons = dict(result.all())
+    
+    rows = []
+    total_invested = 0
+    total_current_value = 0
+    for row_number, holding_data in valid:
+        current_price = prices.get((holding_data.coin, holding_data.currency))
+        if current_price is None:
+            # same rule as adding a single holding, no price means we can't value it
+            errors.append(ImportRowError(
+                row=row_number,
+                error=f"No price available for {holding_data.coin} in {holding_data.currency}"
+            ))
+            continue
+        rows.append({
+            "user_id": user.id,
+            "coin": holding_data.coin,
+            "coin_symbol": holding_data.coin_symbol,
+            "icon_url": icons.get(holding_data.coin) or (coin_index.get(holding_data.coin) or {}).get("icon_url"),
+            "quantity": holding_data.quantity,
+            "buy_price": holding_data.buy_price,
+            "currency": holding_data.currency,
+            "notes": holding_data.notes,
+        })
+        total_invested += holding_data.quantity * holding_data.buy_price
+        total_current_value += holding_data.quantity * current_price
+    
+    if rows:
+        # one valuation delta per (coin, currency), however many rows it had
+        deltas = {}
+        for row in rows:
+            pair = (row["coin"], row["currency"])
+            quantity, invested, count = deltas.get(pair, (0, 0, 0))
+            deltas[pair] = (quantity + row["quantity"], invested + row["quantity"] * row["buy_price"], count + 1)
+        await begin_holdings_write(user.id)
+        await db.execute(insert(Holding), rows)
+        await db.commit()
+        await apply_holding_deltas(user.id, [
+            (coin, currency, quantity, invested, count, prices[(coin, currency)])
+            for (coin, currency), (quantity, invested, count) in deltas.items()
+        ])
+        await holdings_changed(user.id)
+    
+    errors.sort(key=lambda e: e.row)
+    return ImportSummary(
+        imported=len(rows),
+        failed=len(errors),
+        total_invested=total_invested,
+        total_current_value=total_current_value,
+        errors=errors
+    )
+
+def holding_values(holding, quote) -> dict:
+    # HoldingResponse's fields in its order, from a Holding or a HOLDING_COLUMNS row
+    # if price is unavailable even past its soft ttl, use buy_price (no profit/loss)
+    current_price = quote.price if quote else holding.buy_price
+
+    total_invested = holding.quantity * holding.buy_price
+    current_value = holding.quantity * current_price
+    profit_loss = current_value - total_invested
+    profit_loss_percentage = (profit_loss / total_invested) * 100 if total_invested > 0 else 0
+    
+    return {
+        "id": holding.id,
+        "coin": holding.coin,
+        "coin_symbol": holding.coin_symbol,
+        "icon_url": holding.icon_url,
+        "quantity": holding.quantity,
+        "buy_price": holding.buy_price,
+        "currency": holding.currency,
+        "current_price": current_price,
+        "total_invested": total_invested,
+        "current_value": current_value,
+        "profit_loss": profit_loss,
+        "profit_loss_percentage": profit_loss_percentage,
+        "price_age_seconds": quote.age if quote else None,
+        "price_is_stale": quote.is_stale if quote else True,
+        "notes": holding.notes,
+        "created_at": holding.created_at,
+    }
+
+def value_holding(holding: Holding, quote) -> HoldingResponse:
+    return HoldingResponse(**holding_values(holding, quote))
+
+async def quote_holdings(holdings) -> dict:
+    # every (coin, currency) pair in one cache lookup, whatever mix of currencies the user holds
+    # cache only, the price refresher keeps these warm so we never wait on coingecko here
+    return await CoinGeckoService.get_pair_quotes(
+        [(holding.coin, holding.currency) for holding in holdings]
+    )
+
+async def value_holdings(holdings) -> list[HoldingResponse]:
+    all_quotes = await quote_holdings(holdings)
+    return [value_holding(h, all_quotes.get((h.coin, h.currency))) for h in holdings]
+
+async def holding_dicts(holdings) -> list[dict]:
+    all_quotes = await quote_holdings(holdings)
+    return [holding_values(h, all_quotes.get((h.coin, h.currency))) for h in holdings]
+
 @app.get("/portfolio/", response_model=list[HoldingResponse])
 async def get_my_portfolio(
-    user: User = Depends(fastapi_users.current_user()),
+    request: Request,
+    response: Response,
+    after: Optional[int] = Query(None, description="Keyset cursor, return holdings with id greater than this"),
+    limit: Optional[int] = Query(None, ge=1, le=PORTFOLIO_PAGE_MAX, description="Page size, omit for the full list"),
+    user: TokenUser = Depends(current_token_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # get users holdings
-    result = await db.execute(select(Holding).where(Holding.user_id == user.id))
-    holdings = result.scalars().all()
+    etag = await portfolio_etag(request, user.id)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    set_etag(response, etag)
+    
+    # get users holdings, walks the (user_id, id) index in id order
+    # the fast path reads plain column rows, no orm objects to build
+    query = select(*HOLDING_COLUMNS) if FAST_JSON_RESPONSES else select(Holding)
+    query = query.where(Holding.user_id == user.id).order_by(Holding.id)
+    if after is not None:
+        query = query.where(Holding.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    holdings = result.all() if FAST_JSON_RESPONSES else result.scalars().all()
     
     if not holdings:
         return []
     
-    # group holdings by currency to make efficient api calls
-    currency_groups = {}
-    for holding in holdings:
-        if holding.currency not in currency_groups:
-            currency_groups[holding.currency] = []
-        currency_groups[holding.currency].append(holding.coin)
-    
-    # get current prices for each currency group
-    all_prices = {}
-    for currency, coins in currency_groups.items():
-        prices = await CoinGeckoService.get_multiple_prices(coins, currency)
-        all_prices.update(prices)
+    # a full page means there may be more, the client passes this back as ?after=
+    if limit is not None and len(holdings) == limit:
+        response.headers["X-Next-After"] = str(holdings[-1].id)
     
-    portfolio = []
-    for holding in holdings:
-        current_price = all_prices.get(holding.coin, {}).get(holding.currency, 0)
+    if FAST_JSON_RESPONSES:
+        # returned as is, so the etag and cursor headers are carried over by hand
+        return ORJSONResponse(await holding_dicts(holdings), headers=dict(response.headers))
+    return await value_holdings(holdings)
 
-        # if price is unavailable, use buy_price (no profit/loss)
-        if current_price is None:
-            current_price = holding.buy_price
-
-        total_invested = holding.quantity * holding.buy_price
-        current_value = holding.quantity * current_price
-        profit_loss = current_value - total_invested
-        profit_loss_percentage = (profit_loss / total_invested) * 100 if total_invested > 0 else 0
-        
-        portfolio.append(HoldingResponse(
-            id=holding.id,
-            coin=holding.coin,
-            coin_symbol=holding.coin_symbol,
-            icon_url=holding.icon_url,
-            quantity=holding.quantity,
-            buy_price=holding.buy_price,
-            currency=holding.currency,
-            current_price=current_price,
-            total_invested=total_invested,
-            current_value=current_value,
-            profit_loss=profit_loss,
-            profit_loss_percentage=profit_loss_percentage,
-            notes=holding.notes,
-            created_at=holding.created_at
-        ))
-    
-    return portfolio
+@app.get("/portfolio/ndjson")
+async def stream_my_portfolio(
+    user: TokenUser = Depends(current_token_user)
+):
+    # one valued holding per line, read through a server side cursor in chunks
+    # memory stays bounded by the chunk size and the first lines go out before the last rows are read
+    user_id = user.id
+
+    async def generate():
+        async with async_session_maker() as session:
+            result = await session.stream_scalars(
+                select(Holding)
+                .where(Holding.user_id == user_id)
+                .order_by(Holding.id)
+                .execution_options(yield_per=PORTFOLIO_STREAM_CHUNK)
+            )
+            async for chunk in result.partitions(PORTFOLIO_STREAM_CHUNK):
+                if FAST_JSON_RESPONSES:
+                    for holding in await holding_dicts(chunk):
+                        yield orjson.dumps(holding) + b"\n"
+                else:
+                    for holding in await value_holdings(chunk):
+                        yield holding.model_dump_json() + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.get("/portfolio/stats", response_model=PortfolioStats)
 async def get_portfolio_stats(
-    user: User = Depends(fastapi_users.current_user()),
+    request: Request,
+    response: Response,
+    user: TokenUser = Depends(current_token_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # get users holdings with current prices
-    holdings = await get_my_portfolio(user, db)
+    # materialized totals, kept up to date by the holdings writes and every price write
+    valuation = await get_valuation(user.id)
+    if valuation is None:
+        valuation = await rebuild_valuation(user.id, db)
     
-    if not holdings:
-        return PortfolioStats(
-            total_invested=0,
-            total_current_value=0,
-            total_profit_loss=0,
-            total_profit_loss_percentage=0,
-            coin_count=0
+    # the etag is the version stored with these exact totals, a rebuild that wasn't stored gets none
+    etag = f'W/"{user.id}-{valuation.version}"' if valuation.version is not None else None
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    set_etag(response, etag)
+    
+    total_profit_loss = valuation.value - valuation.invested
+    total_profit_loss_percentage = (total_profit_loss / valuation.invested) * 100 if valuation.invested > 0 else 0
+    
+    return PortfolioStats(
+        total_invested=valuation.invested,
+        total_current_value=valuation.value,
+        total_profit_loss=total_profit_loss,
+        total_profit_loss_percentage=total_profit_loss_percentage,
+        coin_count=valuation.count
+    )
+
+async def rebuild_valuation(user_id: int, db: AsyncSession):
+    # stamp first, so a holdings or price write landing while we read keeps this from being stored
+    stamp = await read_rebuild_stamp(user_id)
+    # aggregate per (coin, currency) in sql, then price those few rows instead of every holding
+    result = await db.execute(
+        select(
+            Holding.coin,
+            Holding.currency,
+            func.sum(Holding.quantity),
+            func.sum(Holding.quantity * Holding.buy_price),
+            func.count(Holding.id)
         )
+        .where(Holding.user_id == user_id)
+        .group_by(Holding.coin, Holding.currency)
+    )
+    rows = result.all()
     
-    total_invested = sum(h.total_invested for h in holdings)
-    total_current_value = sum(h.current_value for h in holdings)
+    all_quotes = await CoinGeckoService.get_pair_quotes([(coin, currency) for coin, currency, *_ in rows])
+    positions = []
+    for coin, currency, quantity, invested, count in rows:
+        quote = all_quotes.get((coin, currency))
+        positions.append((coin, currency, quantity, invested, count, quote.price if quote else None))
+    return await store_valuation(user_id, stamp, positions)
+
+def summarize_valuations(valuations) -> PortfolioStats:
+    # same totals as /portfolio/stats, from holdings the stream has already valued
+    total_invested = sum(v.total_invested for v in valuations)
+    total_current_value = sum(v.current_value for v in valuations)
     total_profit_loss = total_current_value - total_invested
-    total_profit_loss_percentage = (total_profit_loss / total_invested) * 100 if total_invested > 0 else 0
-    
     return PortfolioStats(
         total_invested=total_invested,
         total_current_value=total_current_value,
         total_profit_loss=total_profit_loss,
-        total_profit_loss_percentage=total_profit_loss_percentage,
-        coin_count=len(holdings)
+        total_profit_loss_percentage=(total_profit_loss / total_invested) * 100 if total_invested > 0 else 0,
+        coin_count=len(valuations)
+    )
+
+def sse_event(event: str, holdings, stats: PortfolioStats):
+    data = json.dumps({
+        "holdings": [h.model_dump(mode="json") for h in holdings],
+        "stats": stats.model_dump(mode="json"),
+    })
+    return f"event: {event}\ndata: {data}\n\n"
+
+@app.get("/portfolio/stream")
+async def stream_portfolio_updates(
+    user: TokenUser = Depends(current_token_user)
+):
+    # server sent events instead of polling /portfolio/ and /portfolio/stats
+    # "snapshot" carries every holding, then "prices" carries only the holdings whose price moved
+    # the stream outlives its request, it ends when the token expires or gets revoked and the client reconnects
+    user_id = user.id
+
+    def expired():
+        return user.expires_at is not None and time.time() >= user.expires_at
+
+    def next_wait():
+        if user.expires_at is None:
+            return STREAM_KEEPALIVE
+        return max(0.0, min(STREAM_KEEPALIVE, user.expires_at - time.time()))
+
+    async def still_authorized():
+        # same checks as current_token_user, on every reload and keepalive
+        try:
+            return not expired() and not await is_revoked(user)
+        except HTTPException:
+            return False  # revocation can't be checked, fail closed
+
+    async def generate():
+        subscription = price_broadcaster.subscribe(user_id)
+        try:
+            while await still_authorized():
+                subscription.reload = False
+                async with async_session_maker() as session:
+                    result = await session.execute(
+                        select(Holding).where(Holding.user_id == user_id).order_by(Holding.id)
+                    )
+                    holdings = result.scalars().all()
+                by_pair = {}
+                for holding in holdings:
+                    by_pair.setdefault((holding.coin, holding.currency), []).append(holding)
+                # listen before reading the cache so a tick in between is not lost
+                price_broadcaster.set_pairs(subscription, by_pair)
+                # the stream outlives the request deadline, every snapshot gets its own budget
+                set_deadline()
+                valuations = {v.id: v for v in await value_holdings(holdings)}
+                yield sse_event("snapshot", valuations.values(), summarize_valuations(valuations.values()))
+
+                while not subscription.reload:
+                    changed = await subscription.wait(next_wait())
+                    if expired():
+                        return
+                    if changed is None:
+                        if not await still_authorized():
+                            return
+                        # comment line, keeps proxies from closing an idle connection
+                        yield ": keepalive\n\n"
+                        continue
+                    updated = []
+                    for pair, quote in changed.items():
+                        for holding in by_pair.get(pair, ()):
+                            valuations[holding.id] = value_holding(holding, quote)
+                            updated.append(valuations[holding.id])
+                    if updated:
+                        yield sse_event("prices", updated, summarize_valuations(valuations.values()))
+        finally:
+            price_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/coins/search", response_model=list[CoinSearchResult])
+async def search_coins(
+    response: Response,
+    q: str = Query("", max_length=100, description="Prefix of the coin id, symbol or name"),
+    limit: int = Query(COIN_SEARCH_LIMIT, ge=1, le=COIN_SEARCH_MAX)
+):
+    # in memory prefix index over the whole catalog, best market cap first, no db or upstream call
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return [
+        CoinSearchResult(
+            id=coin["id"],
+            symbol=coin["symbol"],
+            name=coin["name"],
+            thumb_url=coin["thumb_url"],
+            market_cap_rank=coin["market_cap_rank"]
+        )
+        for coin in coin_index.search(q, limit)
+    ]
+
+@app.get("/portfolio/history", response_model=PortfolioHistory)
+async def get_portfolio_history(
+    range: str = "30d",
+    user: TokenUser = Depends(current_token_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # served from the local price rollups only, never calls coingecko
+    if range not in HISTORY_RANGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported range. Use one of: {', '.join(HISTORY_RANGES)}"
+        )
+    
+    resolution, series = await get_value_series(db, user.id, range)
+    
+    return PortfolioHistory(
+        range=range,
+        resolution_seconds=resolution,
+        series={
+            currency: [
+                HistoryPoint(timestamp=datetime.fromtimestamp(ts, tz=timezone.utc), value=value)
+                for ts, value in points
+            ]
+            for currency, points in series.items()
+        }
     )
 
 @app.delete("/portfolio/{holding_id}")
 async def delete_holding(
     holding_id: int,
-    user: User = Depends(fastapi_users.current_user()),
+    user: TokenUser = Depends(current_token_user),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(
@@ -242,10 +775,21 @@ async def delete_holding(
         raise HTTPException(status_code=404, detail="Holding not found")
     
     await db.delete(holding)
+    await begin_holdings_write(user.id)
     await db.commit()
+    await apply_holding_deltas(user.id, [(
+        holding.coin, holding.currency, -holding.quantity, -holding.quantity * holding.buy_price, -1, None
+    )])
+    await holdings_changed(user.id)
     
     return {"message": "Holding deleted successfully"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # prometheus text format, keep it off the public internet
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 async def homepage():
     return {"message": "API running"}
\ No newline at end of file
@@ -0,0 +1,130 @@
+import os
+import time
+from contextvars import ContextVar
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# with several worker processes set PROMETHEUS_MULTIPROC_DIR so /metrics adds up every worker
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# price cache, tier is l1 (in process), redis (l2) or icon
+CACHE_LOOKUPS = Counter(
+    "crypto_portfolio_cache_lookups_total", "Cache lookups by tier and result", ["tier", "result"]
+)
+
+# upstream price apis, status is the http status code or timeout/error
+UPSTREAM_SECONDS = Histogram(
+    "crypto_portfolio_upstream_request_seconds", "Upstream price api latency to response headers",
+    ["endpoint"], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_RESPONSES = Counter(
+    "crypto_portfolio_upstream_responses_total", "Upstream price api responses by status", ["endpoint", "status"]
+)
+
+# price providers, outcome is ok/throttled/breaker_open/unavailable/timeout/error
+PROVIDER_REQUESTS = Counter(
+    "crypto_portfolio_provider_requests_total", "Price provider calls by outcome", ["provider", "outcome"]
+)
+PROVIDER_HEDGES = Counter(
+    "crypto_portfolio_provider_hedges_total", "Hedged requests sent to a backup provider", ["provider"]
+)
+
+# circuit breakers, state is 0 closed, 1 half open, 2 open
+BREAKER_STATE = Gauge(
+    "crypto_portfolio_breaker_state", "Circuit breaker state per upstream", ["breaker"], multiprocess_mode="max"
+)
+BREAKER_OPENS = Counter(
+    "crypto_portfolio_breaker_opens_total", "Times a circuit breaker opened", ["breaker"]
+)
+DEADLINE_EXCEEDED = Counter(
+    "crypto_portfolio_deadline_exceeded_total", "Requests that stopped waiting for upstream prices at their deadline"
+)
+PRICE_BATCH_CALLERS = Histogram(
+    "crypto_portfolio_price_batch_callers", "Callers merged into one upstream price batch",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+
+# token buckets
+THROTTLE_WAIT_SECONDS = Histogram(
+    "crypto_portfolio_throttle_wait_seconds", "Time spent waiting for a throttle token", ["bucket"],
+    buckets=WAIT_BUCKETS
+)
+THROTTLE_WAITING = Gauge(
+    "crypto_portfolio_throttle_waiting", "Callers currently waiting for a throttle token", ["bucket"],
+    multiprocess_mode="livesum"
+)
+THROTTLE_REJECTED = Counter(
+    "crypto_portfolio_throttle_rejected_total", "Non blocking token requests that were refused", ["bucket"]
+)
+
+# database and requests, endpoint is the route template or "background" for the refreshers
+DB_QUERY_SECONDS = Histogram(
+    "crypto_portfolio_db_query_seconds", "SQL statement time per endpoint", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "crypto_portfolio_http_request_seconds", "API request time per route", ["method", "route"],
+    buckets=LATENCY_BUCKETS
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "crypto_portfolio_log_records_dropped_total", "Log records dropped because the log queue was full"
+)
+
+# asgi scope of the request being served, the router fills in the matched route
+current_scope = ContextVar("current_scope", default=None)
+
+
+def current_endpoint():
+    scope = current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """Times every request per route template and exposes the route to the db timing hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(scope["method"], current_endpoint()).observe(time.perf_counter() - started)
+            current_scope.reset(token)
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    # the start time lives on the execution context, so a statement that raises
+    # takes it along instead of leaving it behind on the pooled connection
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is not None:
+            DB_QUERY_SECONDS.labels(current_endpoint()).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    # returns (body, content type) in the prometheus text format
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Float, Boolean, DateTime, func, ForeignKey
+from sqlalchemy import Integer, BigInteger, String, Float, Boolean, DateTime, func, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from database import Base
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable
@@ -26,3 +26,39 @@ class Holding(Base):
     notes: Mapped[str] = mapped_column(String(200), nullable=True) 
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     user: Mapped["User"] = relationship(back_populates="holdings")
+
+# every portfolio query filters by user and walks ids in order (keyset pagination)
+holdings_user_index = Index("ix_holdings_user_id_id", Holding.user_id, Holding.id)
+
+class Coin(Base):
+    # local coin metadata catalog, bulk loaded from /coins/markets (or a json snapshot when offline)
+    __tablename__ = "coins"
+
+    id: Mapped[str] = mapped_column(String(100), primary_key=True)
+    symbol: Mapped[str] = mapped_column(String(30), index=True)
+    name: Mapped[str] = mapped_column(String(150))
+    icon_url: Mapped[str] = mapped_column(String(255), nullable=True)
+    thumb_url: Mapped[str] = mapped_column(String(255), nullable=True)
+    market_cap_rank: Mapped[int] = mapped_column(Integer, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class PricePoint(Base):
+    # append-only raw price history written by the price refresher, pruned after a couple of days
+    __tablename__ = "price_history"
+    __table_args__ = (Index("ix_price_history_coin_currency_ts", "coin", "currency", "ts"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    coin: Mapped[str] = mapped_column(String(100))
+    currency: Mapped[str] = mapped_column(String(10))
+    ts: Mapped[int] = mapped_column(BigInteger)  # unix seconds
+    price: Mapped[float] = mapped_column(Float)
+
+class PriceRollup(Base):
+    # downsampled history, resolution is the bucket size in seconds (60, 3600, 86400)
+    __tablename__ = "price_rollups"
+
+    coin: Mapped[str] = mapped_column(String(100), primary_key=True)
+    currency: Mapped[str] = mapped_column(String(10), primary_key=True)
+    resolution: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # unix seconds at bucket start
+    price: Mapped[float] = mapped_column(Float)
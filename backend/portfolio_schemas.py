@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional
 from datetime import datetime
+from coin_catalog import coin_index
 
 class HoldingCreate(BaseModel):
     coin: str
@@ -10,6 +11,33 @@ class HoldingCreate(BaseModel):
     currency: str = "php"
     notes: Optional[str] = None
 
+    @field_validator("coin")
+    @classmethod
+    def known_coin(cls, coin: str):
+        # checked against the coin search index before add/import spend an upstream call on it
+        # only once the full catalog is in, the bundled snapshot just has the top coins
+        if coin_index.complete and coin not in coin_index:
+            raise ValueError(f"unknown coin id {coin!r}, look it up with /coins/search")
+        return coin
+
+class CoinSearchResult(BaseModel):
+    id: str
+    symbol: str
+    name: str
+    thumb_url: Optional[str] = None
+    market_cap_rank: Optional[int] = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportSummary(BaseModel):
+    imported: int
+    failed: int
+    total_invested: float
+    total_current_value: float
+    errors: list[ImportRowError]
+
 class HoldingResponse(BaseModel):
     id: int
     coin: str
@@ -23,6 +51,9 @@ class HoldingResponse(BaseModel):
     current_value: float
     profit_loss: float
     profit_loss_percentage: float
+    # how old current_price is, stale prices are served while a refresh runs in the background
+    price_age_seconds: Optional[float] = None
+    price_is_stale: bool = False
     notes: Optional[str] = None
     created_at: datetime
 
@@ -31,4 +62,14 @@ class PortfolioStats(BaseModel):
     total_current_value: float
     total_profit_loss: float
     total_profit_loss_percentage: float
-    coin_count: int
\ No newline at end of file
+    coin_count: int
+
+class HistoryPoint(BaseModel):
+    timestamp: datetime
+    value: float
+
+class PortfolioHistory(BaseModel):
+    range: str
+    resolution_seconds: int
+    # one value series per currency, values in different currencies are never summed together
+    series: dict[str, list[HistoryPoint]]
@@ -0,0 +1,247 @@
+import time
+from typing import NamedTuple
+from decouple import config
+from services import redis_client, on_price_change, PRICE_VERSION_KEY
+from app_logging import get_logger
+
+log = get_logger("portfolio_valuation")
+
+# per user totals kept in redis so /portfolio/stats is one HMGET however many holdings the user has
+# - add/delete/import adjust the totals by the changed position only
+# - every price write that moves a (coin, currency) revalues that position for each user holding it
+# - a missing hash is rebuilt from the database on the next read, the ttl bounds float drift
+# - the hash carries its own version, bumped by the same script that changes it, for the stats ETag
+VALUATION_TTL = config("VALUATION_TTL", default=3600, cast=int)
+VALUATION_PREFIX = "crypto_portfolio:valuation:"
+
+
+class Valuation(NamedTuple):
+    invested: float
+    value: float
+    count: int
+    # None when the totals aren't the ones stored in redis (a rebuild that lost a race, or redis is down)
+    version: str | None = None
+
+
+class RebuildStamp(NamedTuple):
+    # read before the database and the prices, the store is skipped if either moved since
+    generation: str
+    price_version: str
+
+
+def valuation_key(user_id: int):
+    return f"{VALUATION_PREFIX}{user_id}"
+
+
+def generation_key(user_id: int):
+    # bumped before and after every holdings write, a rebuild that raced one is thrown away
+    return f"crypto_portfolio:valuation_generation:{user_id}"
+
+
+def holders_key(coin: str, currency: str):
+    # users whose valuation holds this pair, so a tick only touches them
+    return f"crypto_portfolio:valuation_holders:{coin}:{currency}"
+
+
+def position_value(quantity: float, invested: float, price: float | None):
+    # same fallback as the holdings list, no price means valued at buy_price
+    return quantity * price if price is not None else invested
+
+
+# per position the hash keeps q: quantity, i: invested, n: holding count, v: value, p: price used for v
+# plus the totals invested, value, count and version
+# KEYS[1] valuation, KEYS[2] generation, KEYS[3..] holders key per delta
+# ARGV[1] user id, ARGV[2] generation ttl, then per delta: pair, quantity delta, invested delta, count delta, price or ''
+# runs after the commit, the generation bump rejects a rebuild that read the database before it
+APPLY_DELTAS_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[2]))
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for d = 0, (#ARGV - 2) / 5 - 1 do
+    local pair = ARGV[3 + d * 5]
+    local state = redis.call('HMGET', KEYS[1], 'q:' .. pair, 'i:' .. pair, 'n:' .. pair, 'v:' .. pair, 'p:' .. pair)
+    local old_i = tonumber(state[2]) or 0
+    local old_v = tonumber(state[4]) or 0
+    local q = (tonumber(state[1]) or 0) + tonumber(ARGV[4 + d * 5])
+    local i = old_i + tonumber(ARGV[5 + d * 5])
+    local n = (tonumber(state[3]) or 0) + tonumber(ARGV[6 + d * 5])
+    local price = tonumber(ARGV[7 + d * 5]) or tonumber(state[5])
+    local v = 0
+    if n <= 0 then
+        i = 0
+        n = 0
+        redis.call('HDEL', KEYS[1], 'q:' .. pair, 'i:' .. pair, 'n:' .. pair, 'v:' .. pair, 'p:' .. pair)
+        redis.call('SREM', KEYS[3 + d], ARGV[1])
+    else
+        if price then
+            v = q * price
+            redis.call('HSET', KEYS[1], 'p:' .. pair, price)
+        else
+            v = i
+        end
+        redis.call('HSET', KEYS[1], 'q:' .. pair, q, 'i:' .. pair, i, 'n:' .. pair, n, 'v:' .. pair, v)
+        redis.call('SADD', KEYS[3 + d], ARGV[1])
+    end
+    redis.call('HINCRBYFLOAT', KEYS[1], 'invested', i - old_i)
+    redis.call('HINCRBYFLOAT', KEYS[1], 'value', v - old_v)
+    redis.call('HINCRBY', KEYS[1], 'count', tonumber(ARGV[6 + d * 5]))
+end
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+return 1
+"""
+
+# KEYS holders per moved pair, ARGV[1] valuation key prefix, then pair and price per key
+# valuation keys are built here from the holders sets, fine on a single redis, not on a cluster
+REVALUE_SCRIPT = """
+local revalued = 0
+for k = 1, #KEYS do
+    local pair = ARGV[k * 2]
+    local price = tonumber(ARGV[k * 2 + 1])
+    for _, user_id in ipairs(redis.call('SMEMBERS', KEYS[k])) do
+        local key = ARGV[1] .. user_id
+        local state = redis.call('HMGET', key, 'q:' .. pair, 'v:' .. pair, 'p:' .. pair)
+        if state[1] then
+            if tonumber(state[3]) ~= price then
+                local v = tonumber(state[1]) * price
+                redis.call('HSET', key, 'v:' .. pair, v, 'p:' .. pair, price)
+                redis.call('HINCRBYFLOAT', key, 'value', v - (tonumber(state[2]) or 0))
+                redis.call('HINCRBY', key, 'version', 1)
+                revalued = revalued + 1
+            end
+        else
+            -- the valuation expired or dropped the pair
+            redis.call('SREM', KEYS[k], user_id)
+        end
+    end
+end
+return revalued
+"""
+
+# KEYS[1] valuation, KEYS[2] generation, KEYS[3] price version, KEYS[4..] holders key per position
+# ARGV[1] generation and ARGV[2] price version read before the database and the prices,
+# ARGV[3] ttl, ARGV[4] user id, ARGV[5..] hash field/value pairs
+# a price written meanwhile may have found no hash to revalue, so the rebuild is dropped rather than stored stale
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] or (redis.call('GET', KEYS[3]) or '0') ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for f = 5, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[f], ARGV[f + 1])
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+for k = 4, #KEYS do
+    redis.call('SADD', KEYS[k], ARGV[4])
+end
+return 1
+"""
+
+_apply_deltas = redis_client.register_script(APPLY_DELTAS_SCRIPT)
+_revalue = redis_client.register_script(REVALUE_SCRIPT)
+_store = redis_client.register_script(STORE_SCRIPT)
+
+
+async def begin_holdings_write(user_id: int):
+    # call before committing a holdings change, see generation_key, apply_holding_deltas bumps it again after
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(generation_key(user_id))
+        pipe.expire(generation_key(user_id), VALUATION_TTL * 2)
+        await pipe.execute()
+    except Exception as e:
+        log.warning(f"Valuation generation bump failed: {e}")
+
+
+async def apply_holding_deltas(user_id: int, deltas: list):
+    # deltas: [(coin, currency, quantity, invested, count, price or None)], negative for removals
+    # call after the commit, only adjusts an existing valuation, a missing one is rebuilt with the change already in the database
+    if not deltas:
+        return
+    args = [user_id, VALUATION_TTL * 2]
+    for coin, currency, quantity, invested, count, price in deltas:
+        args += [f"{coin}:{currency}", quantity, invested, count, "" if price is None else price]
+    try:
+        await _apply_deltas(
+            keys=[valuation_key(user_id), generation_key(user_id)] + [holders_key(c, cur) for c, cur, *_ in deltas],
+            args=args
+        )
+    except Exception as e:
+        log.warning(f"Valuation update failed, dropping it: {e}")
+        try:
+            await redis_client.delete(valuation_key(user_id))
+        except Exception:
+            pass  # the ttl gets it
+
+
+@on_price_change
+async def revalue_pairs(prices: dict):
+    # prices: {(coin, currency): price} that moved, each user holding a pair gets only that position revalued
+    # runs after every price cache write that changed something, whichever process made it
+    moved = [(coin, currency, price) for (coin, currency), price in prices.items() if price is not None]
+    if not moved:
+        return 0
+    args = [VALUATION_PREFIX]
+    for coin, currency, price in moved:
+        args += [f"{coin}:{currency}", price]
+    try:
+        return await _revalue(keys=[holders_key(coin, currency) for coin, currency, _ in moved], args=args)
+    except Exception as e:
+        log.warning(f"Valuation revalue failed: {e}")
+        return 0
+
+
+async def get_valuation(user_id: int):
+    # returns a Valuation, or None when it has to be rebuilt
+    try:
+        invested, value, count, version = await redis_client.hmget(
+            valuation_key(user_id), "invested", "value", "count", "version"
+        )
+    except Exception as e:
+        log.warning(f"Valuation read failed: {e}")
+        return None
+    if count is None:
+        return None
+    return Valuation(float(invested), float(value), int(count), version)
+
+
+async def read_rebuild_stamp(user_id: int):
+    # call before reading the holdings and their prices, None when redis is down
+    try:
+        generation, price_version = await redis_client.mget(generation_key(user_id), PRICE_VERSION_KEY)
+    except Exception:
+        return None
+    return RebuildStamp(generation or "0", price_version or "0")
+
+
+async def store_valuation(user_id: int, stamp: RebuildStamp | None, positions: list):
+    # positions: [(coin, currency, quantity, invested, count, price or None)] aggregated from the database
+    # returns the Valuation, stored (and versioned) unless a holdings or price write happened since the stamp
+    fields = {}
+    totals = Valuation(0.0, 0.0, 0)
+    for coin, currency, quantity, invested, count, price in positions:
+        pair = f"{coin}:{currency}"
+        value = position_value(quantity, invested, price)
+        fields.update({f"q:{pair}": quantity, f"i:{pair}": invested, f"n:{pair}": count, f"v:{pair}": value})
+        if price is not None:
+            fields[f"p:{pair}"] = price
+        totals = Valuation(totals.invested + invested, totals.value + value, totals.count + count)
+    if stamp is None:
+        return totals
+    # seeded from the clock like the other versions, so an expired and rebuilt hash never repeats one
+    version = str(time.time_ns())
+    fields.update({"invested": totals.invested, "value": totals.value, "count": totals.count, "version": version})
+    args = [stamp.generation, stamp.price_version, VALUATION_TTL, user_id]
+    for field, value in fields.items():
+        args += [field, value]
+    try:
+        stored = await _store(
+            keys=[valuation_key(user_id), generation_key(user_id), PRICE_VERSION_KEY]
+            + [holders_key(coin, currency) for coin, currency, *_ in positions],
+            args=args
+        )
+    except Exception as e:
+        log.warning(f"Valuation store failed: {e}")
+        return totals
+    return totals._replace(version=version) if stored else totals
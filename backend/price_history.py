@@ -0,0 +1,209 @@
+import asyncio
+import time
+from datetime import timezone
+import numpy as np
+from sqlalchemy import select, delete, insert, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from decouple import config
+from database import async_session_maker
+from models import Holding, PricePoint, PriceRollup
+from services import redis_client
+from app_logging import get_logger
+
+log = get_logger("price_history")
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+
+# each resolution is built from the one before it, so raw rows only need to live a couple of days
+# (resolution, source resolution, retention in seconds or None to keep forever)
+ROLLUPS = [
+    (MINUTE, None, 7 * DAY),
+    (HOUR, MINUTE, 180 * DAY),
+    (DAY, HOUR, None),
+]
+RAW_RETENTION = config("PRICE_HISTORY_RAW_RETENTION", default=2 * DAY, cast=int)
+ROLLUP_INTERVAL = config("PRICE_HISTORY_ROLLUP_INTERVAL", default=60, cast=int)
+
+# range -> (seconds covered, resolution used), about a few hundred points per chart
+HISTORY_RANGES = {
+    "1d": (DAY, MINUTE),
+    "7d": (7 * DAY, HOUR),
+    "30d": (30 * DAY, HOUR),
+    "90d": (90 * DAY, DAY),
+    "1y": (365 * DAY, DAY),
+}
+
+
+async def record_prices(prices: dict, interval: int):
+    # prices: {(coin, currency): price} from one refresh cycle
+    # every api worker may run a refresher, only the first one to claim this slot writes it
+    now = int(time.time())
+    slot_key = f"crypto_portfolio:history_slot:{now // interval}"
+    try:
+        if not await redis_client.set(slot_key, 1, nx=True, ex=interval * 2):
+            return 0
+    except Exception as e:
+        log.warning(f"History slot claim failed, recording anyway: {e}")
+
+    rows = [
+        {"coin": coin, "currency": currency, "ts": now, "price": price}
+        for (coin, currency), price in prices.items()
+        if price is not None
+    ]
+    if rows:
+        async with async_session_maker() as session:
+            async with session.begin():
+                await session.execute(insert(PricePoint), rows)
+    return len(rows)
+
+
+def _bucket_of(column, resolution: int):
+    # integer bucket start without relying on dialect specific floor/division
+    return column - column % resolution
+
+
+async def rollup_history(now: int | None = None):
+    # recompute the current and previous bucket of every resolution, older buckets are final
+    now = now or int(time.time())
+    async with async_session_maker() as session:
+        async with session.begin():
+            for resolution, source, retention in ROLLUPS:
+                since = now - now % resolution - resolution
+                if source is None:
+                    model, ts, filters = PricePoint, PricePoint.ts, [PricePoint.ts >= since]
+                else:
+                    model, ts = PriceRollup, PriceRollup.bucket
+                    filters = [PriceRollup.resolution == source, PriceRollup.bucket >= since]
+                bucket = _bucket_of(ts, resolution)
+                await session.execute(
+                    delete(PriceRollup).where(
+                        PriceRollup.resolution == resolution, PriceRollup.bucket >= since
+                    )
+                )
+                await session.execute(
+                    insert(PriceRollup).from_select(
+                        ["coin", "currency", "resolution", "bucket", "price"],
+                        select(model.coin, model.currency, literal(resolution), bucket, func.avg(model.price))
+                        .where(*filters)
+                        .group_by(model.coin, model.currency, bucket)
+                    )
+                )
+                if retention:
+                    await session.execute(
+                        delete(PriceRollup).where(
+                            PriceRollup.resolution == resolution, PriceRollup.bucket < now - retention
+                        )
+                    )
+            await session.execute(delete(PricePoint).where(PricePoint.ts < now - RAW_RETENTION))
+
+
+def _created_ts(created_at):
+    # created_at is stored naive in utc (server_default now())
+    return int(created_at.replace(tzinfo=timezone.utc).timestamp()) if created_at else 0
+
+
+def value_series(positions: dict, buckets, rows, before_range: dict):
+    # positions: {(coin, currency): [(first bucket, quantity)]}, rows: [(pair, bucket, price)] in range,
+    # before_range: {pair: last price before the range}
+    # a buckets x pairs quantity step function times the forward filled price matrix, no per bucket loop
+    pairs = list(positions)
+    column = {pair: i for i, pair in enumerate(pairs)}
+    currencies = sorted({currency for _, currency in pairs})
+    # pairs x currencies, sums the pair columns into their currency
+    per_currency = np.zeros((len(pairs), len(currencies)))
+    per_currency[np.arange(len(pairs)), [currencies.index(currency) for _, currency in pairs]] = 1
+
+    # row 0 is the price from before the range, the in range buckets follow
+    prices = np.full((len(buckets) + 1, len(pairs)), np.nan)
+    for pair, price in before_range.items():
+        prices[0, column[pair]] = price
+    if rows:
+        row_pairs, row_buckets, row_prices = zip(*rows)
+        prices[np.searchsorted(buckets, row_buckets) + 1, [column[pair] for pair in row_pairs]] = row_prices
+    # forward fill, each cell takes the price of the last row at or above it that has one
+    last_known = np.where(np.isnan(prices), 0, np.arange(len(buckets) + 1)[:, None])
+    np.maximum.accumulate(last_known, axis=0, out=last_known)
+    prices = prices[last_known, np.arange(len(pairs))][1:]
+
+    # a holding adds its quantity from the first bucket at or after the one it was added in
+    added = np.zeros((len(buckets) + 1, len(pairs)))
+    holding_columns, first_buckets, quantities = zip(*(
+        (column[pair], first_bucket, quantity)
+        for pair, holdings in positions.items() for first_bucket, quantity in holdings
+    ))
+    np.add.at(added, (np.searchsorted(buckets, first_buckets), holding_columns), quantities)
+    quantity = np.cumsum(added, axis=0)[:-1]
+
+    counted = quantity != 0
+    priced = counted & ~np.isnan(prices)
+    values = np.where(priced, quantity * np.nan_to_num(prices), 0) @ per_currency
+    has_value = priced.astype(float) @ per_currency > 0
+    incomplete = (counted & ~priced).astype(float) @ per_currency > 0
+    keep = has_value & ~incomplete
+
+    series = {}
+    for c, currency in enumerate(currencies):
+        kept = np.flatnonzero(keep[:, c])
+        if kept.size:
+            series[currency] = list(zip(buckets[kept].tolist(), values[kept, c].tolist()))
+    return series
+
+
+async def get_value_series(db: AsyncSession, user_id: int, range_key: str):
+    # value of the user's holdings over time from the rollups
+    # - a holding only counts from the bucket it was added in
+    # - a pair with no rollup in a bucket keeps its last known price, the one from before the range included
+    # - buckets where a counted pair has no price yet are left out rather than drawn as a dip
+    # returns (resolution, {currency: [(bucket, value)]})
+    span, resolution = HISTORY_RANGES[range_key]
+    since = int(time.time()) - span
+
+    result = await db.execute(
+        select(Holding.coin, Holding.currency, Holding.quantity, Holding.created_at)
+        .where(Holding.user_id == user_id)
+    )
+    # (coin, currency) -> [(first bucket, quantity)]
+    positions = {}
+    for coin, currency, quantity, created_at in result.all():
+        created = _created_ts(created_at)
+        positions.setdefault((coin, currency), []).append((created - created % resolution, quantity))
+    if not positions:
+        return resolution, {}
+    coins = {coin for coin, _ in positions}
+
+    in_range = await db.execute(
+        select(PriceRollup.coin, PriceRollup.currency, PriceRollup.bucket, PriceRollup.price)
+        .where(
+            PriceRollup.resolution == resolution,
+            PriceRollup.coin.in_(coins),
+            PriceRollup.bucket >= since
+        )
+    )
+    # last price before the range, so a pair that skips the first buckets still has one to carry
+    latest = (
+        select(PriceRollup.coin, PriceRollup.currency, func.max(PriceRollup.bucket).label("bucket"))
+        .where(
+            PriceRollup.resolution == resolution,
+            PriceRollup.coin.in_(coins),
+            PriceRollup.bucket < since
+        )
+        .group_by(PriceRollup.coin, PriceRollup.currency)
+        .subquery()
+    )
+    before_range = await db.execute(
+        select(PriceRollup.coin, PriceRollup.currency, PriceRollup.price)
+        .join(
+            latest,
+            (PriceRollup.coin == latest.c.coin)
+            & (PriceRollup.currency == latest.c.currency)
+            & (PriceRollup.bucket == latest.c.bucket)
+        )
+        .where(PriceRollup.resolution == resolution)
+    )
+    before_range = {(coin, currency): price for coin, currency, price in before_range.all() if (coin, currency) in positions}
+    rows = [((coin, currency), bucket, price) for coin, currency, bucket, price in in_range.all() if (coin, currency) in positions]
+    if not rows:
+        return resolution, {}
+    buckets = np.unique(np.array([bucket for _, bucket, _ in rows]))
+    # a few hundred buckets by a few thousand pairs is milliseconds of numpy, kept off the event loop anyway
+    return resolution, await asyncio.to_thread(value_series, positions, buckets, rows, before_range)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from sqlalchemy import select
+from decouple import config
+from database import async_session_maker
+from models import Holding
+from services import CoinGeckoService
+from price_history import record_prices, rollup_history, ROLLUP_INTERVAL
+from price_stream import publish_price_ticks
+import portfolio_valuation  # subscribes the materialized valuations to the prices written here
+from app_logging import get_logger, setup_logging
+
+log = get_logger("price_refresher")
+
+# keep this below PRICE_SOFT_TTL so cached prices never go stale between refreshes
+PRICE_REFRESH_INTERVAL = config("PRICE_REFRESH_INTERVAL", default=20, cast=int)
+
+
+async def get_tracked_pairs():
+    # every distinct (coin, currency) pair that someone holds
+    async with async_session_maker() as session:
+        result = await session.execute(select(Holding.coin, Holding.currency).distinct())
+        return [tuple(pair) for pair in result.all()]
+
+
+async def refresh_all_prices():
+    # all currencies go in the same /simple/price calls (coins x currencies)
+    pairs = await get_tracked_pairs()
+    return await CoinGeckoService.refresh_pairs(pairs)
+
+
+class PriceRefresher:
+    """Keeps the redis price cache warm so request handlers never wait on CoinGecko."""
+
+    def __init__(self, interval: int = PRICE_REFRESH_INTERVAL):
+        self.interval = interval
+        self._task = None
+        self._last_rollup = None
+        self._last_published = {}
+
+    async def run_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                prices = await refresh_all_prices()
+                refreshed = sum(1 for price in prices.values() if price is not None)
+                log.info("Price refresher cycle", extra={"fields": {"refreshed": refreshed, "seconds": round(time.monotonic() - started, 3)}})
+                # open dashboards only hear about prices that moved since the last cycle
+                changed = {
+                    pair: price for pair, price in prices.items()
+                    if price is not None and self._last_published.get(pair) != price
+                }
+                if changed:
+                    await publish_price_ticks(changed)
+                    self._last_published.update(changed)
+                # the refresh path also feeds the price history and its rollups
+                await record_prices(prices, self.interval)
+                if self._last_rollup is None or started - self._last_rollup >= ROLLUP_INTERVAL:
+                    await rollup_history()
+                    self._last_rollup = started
+            except Exception as e:
+                log.warning(f"Price refresher failed: {e}")
+            # fixed schedule, a slow refresh eats into the sleep instead of drifting
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+            log.info(f"Price refresher started (every {self.interval}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            log.info("Price refresher stopped.")
+
+
+price_refresher = PriceRefresher()
+
+
+if __name__ == "__main__":
+    # run as its own process: python price_refresher.py
+    # set PRICE_REFRESHER_ENABLED=False for the api workers when doing this
+    setup_logging()
+    asyncio.run(price_refresher.run_forever())
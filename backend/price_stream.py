@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+from decouple import config
+from services import redis_client, PriceQuote
+from app_logging import get_logger
+
+log = get_logger("price_stream")
+
+# the price refresher publishes changed prices here, every api worker listens once and fans out to its clients
+PRICE_TICKS_CHANNEL = "crypto_portfolio:price_ticks"
+# add/delete/import publish the user id here so open streams reload that user's holdings
+HOLDINGS_CHANGED_CHANNEL = "crypto_portfolio:holdings_changed"
+STREAM_KEEPALIVE = config("STREAM_KEEPALIVE", default=15, cast=int)
+STREAM_RECONNECT_DELAY = 2
+
+
+async def publish_price_ticks(prices: dict, fetched_at: float | None = None):
+    # prices: {(coin, currency): price}, published as one message per refresh cycle
+    ticks = {}
+    for (coin, currency), price in prices.items():
+        if price is not None:
+            ticks.setdefault(coin, {})[currency] = price
+    if not ticks:
+        return 0
+    message = json.dumps({"fetched_at": fetched_at or time.time(), "prices": ticks})
+    try:
+        return await redis_client.publish(PRICE_TICKS_CHANNEL, message)
+    except Exception as e:
+        # streams fall behind until the next tick, the refresh itself still counts
+        log.warning(f"Price tick publish failed: {e}")
+        return 0
+
+
+async def publish_holdings_changed(user_id: int):
+    try:
+        await redis_client.publish(HOLDINGS_CHANGED_CHANNEL, str(user_id))
+    except Exception as e:
+        # the stream only misses this change until the client reconnects, never fail the write for it
+        log.warning(f"Holdings change publish failed: {e}")
+
+
+class StreamSubscription:
+    """One connected client: the pairs it holds and the price changes it hasn't sent yet."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.pairs = set()
+        # latest quote per pair, a slow client skips intermediate ticks instead of queueing them
+        self.pending = {}
+        self.reload = False
+        self._event = asyncio.Event()
+
+    def push(self, pair, quote: PriceQuote):
+        self.pending[pair] = quote
+        self._event.set()
+
+    def request_reload(self):
+        self.reload = True
+        self._event.set()
+
+    async def wait(self, timeout: float):
+        # returns the pending {(coin, currency): quote}, or None on timeout
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        changed, self.pending = self.pending, {}
+        return changed
+
+
+class PriceBroadcaster:
+    """Single redis pub/sub subscription per process, indexed by (coin, currency) so a tick touches only its holders."""
+
+    def __init__(self):
+        self._task = None
+        self._by_pair = {}
+        self._by_user = {}
+        # last price sent per pair, refreshers on several workers publish the same change
+        self._last_prices = {}
+
+    def subscribe(self, user_id: int) -> StreamSubscription:
+        subscription = StreamSubscription(user_id)
+        self._by_user.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def set_pairs(self, subscription: StreamSubscription, pairs):
+        for pair in subscription.pairs - set(pairs):
+            self._discard(self._by_pair, pair, subscription)
+        for pair in pairs:
+            self._by_pair.setdefault(pair, set()).add(subscription)
+        subscription.pairs = set(pairs)
+
+    def unsubscribe(self, subscription: StreamSubscription):
+        for pair in subscription.pairs:
+            self._discard(self._by_pair, pair, subscription)
+        self._discard(self._by_user, subscription.user_id, subscription)
+
+    @staticmethod
+    def _discard(index: dict, key, subscription):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del index[key]
+
+    @property
+    def client_count(self):
+        return sum(len(subscribers) for subscribers in self._by_user.values())
+
+    def dispatch_prices(self, message: dict):
+        fetched_at = message.get("fetched_at") or time.time()
+        for coin, currencies in message.get("prices", {}).items():
+            for currency, price in currencies.items():
+                pair = (coin, currency)
+                if self._last_prices.get(pair) == price:
+                    continue
+                self._last_prices[pair] = price
+                subscribers = self._by_pair.get(pair)
+                if not subscribers:
+                    continue
+                # one quote per changed pair, shared by every client holding it
+                quote = PriceQuote(price, fetched_at)
+                for subscription in subscribers:
+                    subscription.push(pair, quote)
+
+    def dispatch_holdings_changed(self, user_id: int):
+        for subscription in self._by_user.get(user_id, ()):
+            subscription.request_reload()
+
+    async def run_forever(self):
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(PRICE_TICKS_CHANNEL, HOLDINGS_CHANGED_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["channel"] == PRICE_TICKS_CHANNEL:
+                        self.dispatch_prices(json.loads(message["data"]))
+                    elif message["channel"] == HOLDINGS_CHANGED_CHANNEL:
+                        self.dispatch_holdings_changed(int(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Price stream subscription failed, reconnecting: {e}")
+                await asyncio.sleep(STREAM_RECONNECT_DELAY)
+            finally:
+                await pubsub.aclose()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+price_broadcaster = PriceBroadcaster()
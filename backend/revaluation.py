@@ -0,0 +1,173 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import numpy as np
+from sqlalchemy import select
+from decouple import config
+from database import async_session_maker
+from models import Holding
+from services import CoinGeckoService
+from app_logging import get_logger, setup_logging, shutdown_logging
+
+log = get_logger("revaluation")
+
+# whole user base valuation for daily snapshots, history backfills and alerts
+# holdings are streamed in user id order as column arrays, priced against a coin x currency matrix
+# and summed per user with reduceat, optionally fanning the chunks out to a process pool
+REVALUATION_CHUNK_SIZE = config("REVALUATION_CHUNK_SIZE", default=100000, cast=int)
+# 0 runs the chunks in this process, the default: a 100k chunk takes a few ms of numpy
+# and shipping it to a worker costs more than that (see test/bench_revaluation.py)
+REVALUATION_WORKERS = config("REVALUATION_WORKERS", default=0, cast=int)
+
+
+class PriceMatrix(NamedTuple):
+    coins: dict  # coin id -> row
+    currencies: dict  # currency -> column
+    prices: np.ndarray  # NaN where there is no price, the last row and column are for unknown coins/currencies
+
+
+class HoldingColumns(NamedTuple):
+    user_ids: np.ndarray
+    coins: np.ndarray
+    currencies: np.ndarray
+    quantities: np.ndarray
+    buy_prices: np.ndarray
+
+
+class UserValuations(NamedTuple):
+    # parallel arrays sorted by user id, same totals as /portfolio/stats
+    user_ids: np.ndarray
+    invested: np.ndarray
+    value: np.ndarray
+    count: np.ndarray
+
+
+def build_price_matrix(quotes: dict) -> PriceMatrix:
+    # quotes: {(coin, currency): PriceQuote or None}
+    coins = {}
+    currencies = {}
+    for coin, currency in quotes:
+        coins.setdefault(coin, len(coins))
+        currencies.setdefault(currency, len(currencies))
+    prices = np.full((len(coins) + 1, len(currencies) + 1), np.nan)
+    for (coin, currency), quote in quotes.items():
+        if quote is not None:
+            prices[coins[coin], currencies[currency]] = quote.price
+    return PriceMatrix(coins, currencies, prices)
+
+
+async def load_price_matrix() -> PriceMatrix:
+    # every held (coin, currency) from the price cache, like the stats endpoint it never waits on upstream
+    async with async_session_maker() as session:
+        result = await session.execute(select(Holding.coin, Holding.currency).distinct())
+        pairs = [tuple(pair) for pair in result.all()]
+    return build_price_matrix(await CoinGeckoService.get_pair_quotes(pairs, revalidate=False))
+
+
+def empty_valuations() -> UserValuations:
+    return UserValuations(
+        np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, np.float64), np.empty(0, np.int64)
+    )
+
+
+def _reduce_per_user(user_ids, invested, value, count) -> UserValuations:
+    # user_ids must be sorted, every run of one user becomes a single row
+    if len(user_ids) == 0:
+        return empty_valuations()
+    starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+    return UserValuations(
+        user_ids[starts],
+        np.add.reduceat(invested, starts),
+        np.add.reduceat(value, starts),
+        np.add.reduceat(count, starts),
+    )
+
+
+def revalue_chunk(columns: HoldingColumns, prices: np.ndarray) -> UserValuations:
+    # runs in the pool workers, so it only takes and returns arrays
+    invested = columns.quantities * columns.buy_prices
+    price = prices[columns.coins, columns.currencies]
+    # same fallback as the holdings list, no price means valued at buy_price
+    value = np.where(np.isnan(price), invested, columns.quantities * price)
+    return _reduce_per_user(columns.user_ids, invested, value, np.ones(len(columns.user_ids), np.int64))
+
+
+def merge_valuations(parts: list) -> UserValuations:
+    # parts in chunk order, a user cut by a chunk boundary shows up at the end of one and the start of the next
+    parts = [p for p in parts if len(p.user_ids)]
+    if not parts:
+        return empty_valuations()
+    return _reduce_per_user(*(np.concatenate(column) for column in zip(*parts)))
+
+
+def to_columns(rows, matrix: PriceMatrix) -> HoldingColumns:
+    # rows: (user_id, coin, currency, quantity, buy_price), unknown pairs land on the all NaN row/column
+    unknown_coin = len(matrix.coins)
+    unknown_currency = len(matrix.currencies)
+    count = len(rows)
+    return HoldingColumns(
+        np.fromiter((r[0] for r in rows), np.int64, count),
+        np.fromiter((matrix.coins.get(r[1], unknown_coin) for r in rows), np.int32, count),
+        np.fromiter((matrix.currencies.get(r[2], unknown_currency) for r in rows), np.int32, count),
+        np.fromiter((r[3] for r in rows), np.float64, count),
+        np.fromiter((r[4] for r in rows), np.float64, count),
+    )
+
+
+async def stream_holding_columns(matrix: PriceMatrix, chunk_size: int = REVALUATION_CHUNK_SIZE):
+    # server side cursor in user id order (the (user_id, id) index), memory stays bounded by the chunk size
+    async with async_session_maker() as session:
+        result = await session.stream(
+            select(Holding.user_id, Holding.coin, Holding.currency, Holding.quantity, Holding.buy_price)
+            .order_by(Holding.user_id, Holding.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for rows in result.partitions(chunk_size):
+            yield to_columns(rows, matrix)
+
+
+async def revalue_chunks(chunks, prices: np.ndarray, workers: int = REVALUATION_WORKERS) -> UserValuations:
+    # chunks: async iterable of HoldingColumns sorted by user id
+    parts = []
+    if workers <= 0:
+        async for columns in chunks:
+            parts.append(revalue_chunk(columns, prices))
+        return merge_valuations(parts)
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        async for columns in chunks:
+            pending.append(loop.run_in_executor(pool, revalue_chunk, columns, prices))
+            # a couple of chunks queued per worker, the reader doesn't run ahead of the pool
+            if len(pending) >= workers * 2:
+                parts.append(await pending.pop(0))
+        parts.extend(await asyncio.gather(*pending))
+    return merge_valuations(parts)
+
+
+async def revalue_all_users(chunk_size: int = REVALUATION_CHUNK_SIZE, workers: int = REVALUATION_WORKERS):
+    matrix = await load_price_matrix()
+    return await revalue_chunks(stream_holding_columns(matrix, chunk_size), matrix.prices, workers)
+
+
+async def main():
+    started = time.perf_counter()
+    valuations = await revalue_all_users()
+    log.info("Revaluation finished", extra={"fields": {
+        "users": len(valuations.user_ids),
+        "holdings": int(valuations.count.sum()),
+        "invested": round(float(valuations.invested.sum()), 2),
+        "value": round(float(valuations.value.sum()), 2),
+        "seconds": round(time.perf_counter() - started, 3),
+    }})
+
+
+if __name__ == "__main__":
+    # python revaluation.py, e.g. from a daily cron
+    setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_logging()
@@ -1,213 +1,1157 @@
 import asyncio
+import json
+import os
 import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import NamedTuple
 import httpx
-import redis
+import redis.asyncio as redis
 from decouple import config
+from sqlalchemy import select
+from database import async_session_maker
+from models import Coin
+from app_logging import get_logger
+from metrics import (
+    CACHE_LOOKUPS, UPSTREAM_SECONDS, UPSTREAM_RESPONSES, THROTTLE_WAIT_SECONDS, THROTTLE_WAITING, THROTTLE_REJECTED,
+    PROVIDER_REQUESTS, PROVIDER_HEDGES, BREAKER_STATE, BREAKER_OPENS, DEADLINE_EXCEEDED, PRICE_BATCH_CALLERS
+)
+
+log = get_logger("services")
 
 REDIS_URL = config('REDIS_URL')
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+REDIS_MAX_CONNECTIONS = config("REDIS_MAX_CONNECTIONS", default=50, cast=int)
+# async client backed by a connection pool, never blocks the event loop
+redis_client = redis.from_url(REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+
+# ==========HTTP CLIENT=======
+COINGECKO_BASE_URL = config("COINGECKO_BASE_URL", default="https://api.coingecko.com/api/v3")
+HTTP_MAX_CONNECTIONS = config("HTTP_MAX_CONNECTIONS", default=20, cast=int)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = config("HTTP_MAX_KEEPALIVE_CONNECTIONS", default=10, cast=int)
+HTTP_KEEPALIVE_EXPIRY = config("HTTP_KEEPALIVE_EXPIRY", default=30.0, cast=float)
+HTTP_CONNECT_TIMEOUT = config("HTTP_CONNECT_TIMEOUT", default=5.0, cast=float)
+HTTP_TIMEOUT = config("HTTP_TIMEOUT", default=10.0, cast=float)
+HTTP2_ENABLED = config("HTTP2_ENABLED", default=True, cast=bool)
+
+_http_client = None
+
+def upstream_endpoint(path: str):
+    # metric label without the coin id, so the label set stays small
+    if path.endswith("/simple/price"):
+        return "/simple/price"
+    if path.endswith("/coins/markets"):
+        return "/coins/markets"
+    if "/coins/" in path:
+        return "/coins/{id}"
+    if path.endswith("/pricemulti"):
+        return "/pricemulti"
+    return "other"
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Records latency and status of every CoinGecko call, whichever code path made it."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        endpoint = upstream_endpoint(request.url.path)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            status = "timeout"
+            raise
+        finally:
+            UPSTREAM_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+            UPSTREAM_RESPONSES.labels(endpoint, status).inc()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+def create_http_client():
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return httpx.AsyncClient(
+        base_url=COINGECKO_BASE_URL,
+        transport=InstrumentedTransport(transport),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+def get_http_client():
+    # one pooled client per process so cache misses reuse warm keep-alive connections
+    # normally created in the app lifespan, created lazily for the standalone refresher
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+# =====END HTTP CLIENT=====
 
 # ==========THROTTLING=======
-class RequestThrottler:
-    def __init__(self, requests_per_minute=25):
+# token bucket shared by every worker and host through redis
+# the lua script refills and takes a token atomically in O(1), using the redis clock so hosts agree on time
+# returns 0 when a token was taken, otherwise how many ms until one is available
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill_per_ms)
+
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_ms = math.ceil((1 - tokens) / refill_per_ms)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_per_ms) * 2)
+return wait_ms
+"""
+
+class RedisTokenBucket:
+    def __init__(self, name, requests_per_minute=25, burst=None):
+        self.name = name
+        self.key = f"crypto_portfolio:throttle:{name}"
         self.requests_per_minute = requests_per_minute
-        self.requests = []
-        print(f"Throttling enabled: {requests_per_minute} requests/minute")
-    
-    async def wait_if_needed(self):
-        now = time.time()
-        # remove requests older than 1 minute
-        self.requests = [t for t in self.requests if now - t < 60]
-        
-        if len(self.requests) >= self.requests_per_minute:
-            # wait until the oldest request is 1 minute old
-            wait_time = 60 - (now - self.requests[0])
-            if wait_time > 0:
-                print(f"Throttling: Waiting {wait_time:.1f}s ({len(self.requests)}/{self.requests_per_minute} requests this minute)")
-                await asyncio.sleep(wait_time)
-            # update time and clean again after waiting
-            now = time.time()
-            self.requests = [t for t in self.requests if now - t < 60]
-        
-        self.requests.append(now)
+        self.capacity = burst or requests_per_minute
+        self.refill_per_ms = requests_per_minute / 60000
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        log.info(f"Throttling enabled for {name}: {requests_per_minute} requests/minute (shared)")
 
-throttler = RequestThrottler(requests_per_minute=25)
+    async def _take(self):
+        try:
+            return await self._script(keys=[self.key], args=[self.capacity, self.refill_per_ms])
+        except Exception as e:
+            # fail open, losing the throttle is better than losing every upstream call
+            log.warning(f"Throttler {self.name} unavailable, allowing request: {e}")
+            return 0
+
+    async def try_acquire(self):
+        # non blocking, callers fall back to the cache when this returns False
+        if await self._take() == 0:
+            return True
+        THROTTLE_REJECTED.labels(self.name).inc()
+        return False
+
+    async def acquire(self):
+        started = time.perf_counter()
+        waiting = False
+        try:
+            while True:
+                wait_ms = await self._take()
+                if wait_ms == 0:
+                    return
+                if not waiting:
+                    THROTTLE_WAITING.labels(self.name).inc()
+                    waiting = True
+                log.debug(f"Throttling {self.name}: waiting {wait_ms / 1000:.1f}s")
+                await asyncio.sleep(wait_ms / 1000)
+        finally:
+            if waiting:
+                THROTTLE_WAITING.labels(self.name).dec()
+            THROTTLE_WAIT_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+# separate budgets for the cheap /simple/price and the heavy /coins/{id} endpoints
+price_throttler = RedisTokenBucket(
+    "simple_price", config("PRICE_REQUESTS_PER_MINUTE", default=20, cast=int)
+)
+coin_throttler = RedisTokenBucket(
+    "coins", config("COIN_REQUESTS_PER_MINUTE", default=5, cast=int)
+)
 # =====END THROTTLING=====
 
+# ==========DEADLINES=======
+# how long an api request may wait on upstream prices before it answers from the cache
+REQUEST_DEADLINE_MS = config("REQUEST_DEADLINE_MS", default=2500, cast=int)
+
+# monotonic time the current request has to answer by, None outside of requests (refreshers, scripts)
+request_deadline = ContextVar("request_deadline", default=None)
+
+def set_deadline(budget_ms: int = REQUEST_DEADLINE_MS):
+    return request_deadline.set(time.monotonic() + budget_ms / 1000)
+
+def time_left():
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+class DeadlineMiddleware:
+    """Gives every api request a budget, upstream waits past it fall back to cached or stale prices."""
+
+    def __init__(self, app, budget_ms: int = REQUEST_DEADLINE_MS):
+        self.app = app
+        self.budget_ms = budget_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = set_deadline(self.budget_ms)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+# =====END DEADLINES=====
+
+# ==========SINGLE FLIGHT=======
+# deletes only the locks we still own, a lock that expired and was taken by another worker is left alone
+RELEASE_LOCKS_SCRIPT = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        released = released + redis.call('DEL', key)
+    end
+end
+return released
+"""
+
+class SingleFlight:
+    """
+    Coalesces concurrent cache misses so each key is fetched upstream once.
+    - in this process, callers asking for a key that is already being fetched await the same task
+    - across workers, a short redis lock per key makes the others wait for the first fetch and read its result
+    """
+
+    def __init__(self, lock_ms=5000, poll_interval=0.05):
+        self.lock_ms = lock_ms
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self._release = redis_client.register_script(RELEASE_LOCKS_SCRIPT)
+
+    async def do(self, keys, fetch, read_cached):
+        # fetch(keys) and read_cached(keys) both return {key: value}, value None when unavailable
+        keys = list(dict.fromkeys(keys))
+        new_keys = [k for k in keys if k not in self._inflight]
+        if new_keys:
+            task = asyncio.create_task(self._fetch_once(new_keys, fetch, read_cached))
+            for key in new_keys:
+                self._inflight[key] = task
+            task.add_done_callback(lambda done, owned=new_keys: self._forget(owned, done))
+
+        waiting = {}
+        for key in keys:
+            waiting.setdefault(self._inflight[key], []).append(key)
+
+        results = {}
+        for task, task_keys in waiting.items():
+            try:
+                # shield so one cancelled or timed out caller doesn't cancel the fetch for everyone else
+                values = await asyncio.wait_for(asyncio.shield(task), time_left())
+            except asyncio.TimeoutError:
+                # out of budget, the fetch keeps going and fills the cache for the next request
+                DEADLINE_EXCEEDED.inc()
+                values = {}
+            for key in task_keys:
+                results[key] = values.get(key)
+        return results
+
+    def _forget(self, keys, task):
+        for key in keys:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    async def _fetch_once(self, keys, fetch, read_cached):
+        # shared by callers with different budgets, so the fetch itself runs to completion
+        request_deadline.set(None)
+        token = uuid.uuid4().hex
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(f"{key}:lock", token, nx=True, px=self.lock_ms)
+            acquired = await pipe.execute()
+        except Exception as e:
+            log.warning(f"Single flight lock unavailable, fetching directly: {e}")
+            acquired = [True] * len(keys)
+
+        mine = [k for k, ok in zip(keys, acquired) if ok]
+        theirs = [k for k, ok in zip(keys, acquired) if not ok]
+
+        results = {}
+        if mine:
+            try:
+                results.update(await fetch(mine))
+            finally:
+                try:
+                    await self._release(keys=[f"{k}:lock" for k in mine], args=[token])
+                except Exception:
+                    pass  # locks expire on their own
+        if theirs:
+            results.update(await self._wait_for_other_worker(theirs, fetch, read_cached))
+        return results
+
+    async def _wait_for_other_worker(self, keys, fetch, read_cached):
+        results = {}
+        pending = keys
+        deadline = asyncio.get_running_loop().time() + self.lock_ms / 1000
+        while pending and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            cached = await read_cached(pending)
+            results.update({k: v for k, v in cached.items() if v is not None})
+            pending = [k for k in pending if k not in results]
+        if pending:
+            # the other worker gave up or died, its lock expired without a result
+            results.update(await fetch(pending))
+        return results
+
+price_flight = SingleFlight()
+# =====END SINGLE FLIGHT=====
+
+# ==========VERSIONS=======
+# cheap validators for conditional GETs, bumped on every write that changes a response
+PRICE_VERSION_KEY = "crypto_portfolio:price_version"
+
+def holdings_version_key(user_id: int):
+    return f"crypto_portfolio:holdings_version:{user_id}"
+
+def _bump_version(pipe, key):
+    # seeded from the clock so a flushed redis never hands out a version a client already saw
+    pipe.set(key, time.time_ns(), nx=True)
+    pipe.incr(key)
+
+async def bump_holdings_version(user_id: int):
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        _bump_version(pipe, holdings_version_key(user_id))
+        await pipe.execute()
+    except Exception as e:
+        log.warning(f"Holdings version bump failed: {e}")
+
+async def get_versions(keys: list):
+    # current value of each version key in one round trip, seeding any that don't exist yet
+    pipe = redis_client.pipeline(transaction=True)
+    for key in keys:
+        pipe.set(key, time.time_ns(), nx=True)
+    pipe.mget(keys)
+    return (await pipe.execute())[-1]
+# =====END VERSIONS=====
+
+# ==========PRICE CACHE=======
+# soft ttl: after this a price is still served but flagged stale and refreshed in the background
+# hard ttl: after this a price is dropped, upstream trouble lowers freshness long before valuations go wrong
+PRICE_SOFT_TTL = config("PRICE_SOFT_TTL", default=30, cast=int)
+PRICE_HARD_TTL = config("PRICE_HARD_TTL", default=900, cast=int)
+PRICE_L1_MAX_ENTRIES = config("PRICE_L1_MAX_ENTRIES", default=5000, cast=int)
+
+class PriceQuote(NamedTuple):
+    price: float
+    fetched_at: float
+
+    @property
+    def age(self):
+        return max(0.0, time.time() - self.fetched_at)
+
+    @property
+    def is_stale(self):
+        return self.age > PRICE_SOFT_TTL
+
+class TwoTierPriceCache:
+    """In-process LRU (L1) in front of redis (L2), both holding (price, fetched_at)."""
+
+    def __init__(self, max_entries=PRICE_L1_MAX_ENTRIES, hard_ttl=PRICE_HARD_TTL):
+        self.max_entries = max_entries
+        self.hard_ttl = hard_ttl
+        self._local = OrderedDict()
+
+    def _remember(self, key, quote):
+        self._local[key] = quote
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def get_many(self, keys):
+        quotes = {}
+        remote_keys = []
+        expired = 0
+        for key in keys:
+            quote = self._local.get(key)
+            if quote is not None and not quote.is_stale:
+                # hot path, a plain dict lookup
+                self._local.move_to_end(key)
+                quotes[key] = quote
+            else:
+                # another worker may have refreshed it, ask redis before calling it stale
+                remote_keys.append(key)
+
+        if remote_keys:
+            try:
+                cached = await redis_client.mget(remote_keys)
+            except Exception as e:
+                log.warning(f"Redis price lookup failed, using local cache only: {e}")
+                cached = [None] * len(remote_keys)
+            for key, raw in zip(remote_keys, cached):
+                quote = self._local.get(key)
+                if raw:
+                    data = json.loads(raw)
+                    remote = PriceQuote(data["price"], data["fetched_at"])
+                    if quote is None or remote.fetched_at > quote.fetched_at:
+                        quote = remote
+                        self._remember(key, quote)
+                if quote is not None and quote.age > self.hard_ttl:
+                    self._local.pop(key, None)
+                    quote = None
+                    expired += 1
+                quotes[key] = quote
+            remote_hits = sum(1 for raw in cached if raw)
+            CACHE_LOOKUPS.labels("redis", "hit").inc(remote_hits)
+            CACHE_LOOKUPS.labels("redis", "miss").inc(len(remote_keys) - remote_hits)
+            if expired:
+                CACHE_LOOKUPS.labels("redis", "expired").inc(expired)
+        CACHE_LOOKUPS.labels("l1", "hit").inc(len(keys) - len(remote_keys))
+        CACHE_LOOKUPS.labels("l1", "miss").inc(len(remote_keys))
+        return quotes
+
+    async def set_many(self, prices, fetched_at=None):
+        # prices: {key: price}, written to L1 and to redis in one pipelined round trip
+        # returns the keys whose price differs from what this worker had
+        fetched_at = fetched_at or time.time()
+        pipe = redis_client.pipeline(transaction=False)
+        changed = []
+        for key, price in prices.items():
+            previous = self._local.get(key)
+            if previous is None or previous.price != price:
+                changed.append(key)
+            self._remember(key, PriceQuote(price, fetched_at))
+            pipe.setex(key, self.hard_ttl, json.dumps({"price": price, "fetched_at": fetched_at}))
+        if changed:
+            # a refresh that returns the same prices keeps the ETags of every portfolio valid
+            _bump_version(pipe, PRICE_VERSION_KEY)
+        await pipe.execute()
+        return changed
+
+    async def delete(self, key):
+        self._local.pop(key, None)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.delete(key)
+        _bump_version(pipe, PRICE_VERSION_KEY)
+        await pipe.execute()
+
+price_cache = TwoTierPriceCache()
+# keeps background revalidation tasks alive until they finish
+_background_tasks = set()
+# async callables taking {(coin, currency): price}, awaited after a fetch moved those prices
+_price_change_listeners = []
+
+def on_price_change(listener):
+    # lets modules that import this one follow every price write, the valuations subscribe here
+    _price_change_listeners.append(listener)
+    return listener
+
+async def notify_price_change(prices: dict):
+    for listener in _price_change_listeners:
+        try:
+            await listener(prices)
+        except Exception as e:
+            log.warning(f"Price change listener {listener.__name__} failed: {e}")
+# =====END PRICE CACHE=====
+
+# ==========PRICE PROVIDERS=======
+# sources in order of preference, the router reorders them by measured latency
+PRICE_PROVIDERS = config("PRICE_PROVIDERS", default="coingecko,cryptocompare").split(",")
+CRYPTOCOMPARE_BASE_URL = config("CRYPTOCOMPARE_BASE_URL", default="https://min-api.cryptocompare.com/data")
+CRYPTOCOMPARE_API_KEY = config("CRYPTOCOMPARE_API_KEY", default="")
+# {coin_id: {currency: price}} json, for tests and offline runs
+PRICE_FILE_PATH = config("PRICE_FILE_PATH", default="")
+# a provider slower than its own p95 gets a second provider racing it
+HEDGE_MIN_DELAY = config("HEDGE_MIN_DELAY", default=0.2, cast=float)
+HEDGE_DEFAULT_DELAY = config("HEDGE_DEFAULT_DELAY", default=1.0, cast=float)
+PROVIDER_LATENCY_WINDOW = 200
+PROVIDER_MIN_SAMPLES = 20
+SYMBOL_CACHE_TTL = 3600
+# circuit breaker per upstream, a 429 opens it for its Retry-After right away
+BREAKER_FAILURE_THRESHOLD = config("BREAKER_FAILURE_THRESHOLD", default=3, cast=int)
+BREAKER_COOLDOWN = config("BREAKER_COOLDOWN", default=10, cast=int)
+BREAKER_MAX_COOLDOWN = config("BREAKER_MAX_COOLDOWN", default=300, cast=int)
+DEFAULT_RETRY_AFTER = 60
+
+class CircuitBreaker:
+    """
+    - closed: calls go through, BREAKER_FAILURE_THRESHOLD failures in a row open it
+    - open: calls fail fast until the cooldown ends, Retry-After when the upstream sent one
+    - half open: a single probe call, success closes it, failure opens it again for twice as long
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+        BREAKER_STATE.labels(name).set(0)
+
+    @property
+    def ready(self):
+        # would a call be let through right now, without claiming the half open probe
+        if self.state == self.OPEN:
+            return time.monotonic() >= self.open_until
+        if self.state == self.HALF_OPEN:
+            return not self._probing
+        return True
+
+    def try_acquire(self):
+        if self.state == self.OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def release(self):
+        # the call ended without telling us anything about the upstream (cancelled, our own throttle)
+        self._probing = False
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self, retry_after: float | None = None):
+        self._probing = False
+        self.failures += 1
+        if retry_after is not None:
+            self._open(min(retry_after, self.max_cooldown))
+        elif self.state == self.HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self._open(self.cooldown)
+        elif self.failures >= self.failure_threshold:
+            self._open(self.cooldown)
+
+    def _open(self, seconds: float):
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+        if self.state != self.OPEN:
+            BREAKER_OPENS.labels(self.name).inc()
+            log.warning(f"Circuit breaker {self.name} open for {seconds:.0f}s")
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set((self.CLOSED, self.HALF_OPEN, self.OPEN).index(state))
+
+# every call to the coingecko api goes through this one, a 429 on icons also stops price calls
+coingecko_breaker = CircuitBreaker("coingecko")
+
+class ProviderUnavailable(Exception):
+    """
+    The provider can't answer right now.
+    failure=False when it isn't the upstream's fault (our own throttle), retry_after when it told us how long to wait.
+    """
+
+    def __init__(self, reason: str, failure: bool = True, retry_after: float | None = None):
+        super().__init__(reason)
+        self.failure = failure
+        self.retry_after = retry_after
+
+def retry_after(response: httpx.Response, default: float = DEFAULT_RETRY_AFTER):
+    # only the delay-seconds form, an http date falls back to the default
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+class PriceProvider(ABC):
+    """
+    A price source, fetch_prices returns {(coin_id, currency): price} for the pairs it knows.
+    acquire takes the rate limit budget first, outside the latency the router measures.
+    """
+
+    name = "provider"
+
+    def __init__(self, breaker: CircuitBreaker | None = None):
+        self.latencies = deque(maxlen=PROVIDER_LATENCY_WINDOW)
+        self.breaker = breaker or CircuitBreaker(self.name)
+
+    async def acquire(self, coin_ids: list, blocking: bool) -> list:
+        # returns the coin ids there is budget for, raises ProviderUnavailable when there is none
+        return coin_ids
+
+    @abstractmethod
+    async def fetch_prices(self, coin_ids: list, currencies: list, blocking: bool) -> dict:
+        ...
+
+    @property
+    def available(self):
+        return self.breaker.ready
+
+    def _percentile(self, fraction: float):
+        if len(self.latencies) < PROVIDER_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    @property
+    def typical_latency(self):
+        median = self._percentile(0.5)
+        return median if median is not None else HEDGE_DEFAULT_DELAY
+
+    @property
+    def hedge_delay(self):
+        p95 = self._percentile(0.95)
+        return max(HEDGE_MIN_DELAY, p95) if p95 is not None else HEDGE_DEFAULT_DELAY
+
+class CoinGeckoProvider(PriceProvider):
+    name = "coingecko"
+    # coingecko accepts many ids per /simple/price call, keep urls at a sane length
+    MAX_IDS_PER_REQUEST = 100
+    MAX_IDS_LENGTH = 1500
+
+    def __init__(self):
+        # shared with the icon lookups, they hit the same rate limit
+        super().__init__(coingecko_breaker)
+
+    def _chunks(self, coin_ids):
+        return chunk_by_limits(coin_ids, self.MAX_IDS_PER_REQUEST, self.MAX_IDS_LENGTH)
+
+    async def acquire(self, coin_ids, blocking):
+        # a token per /simple/price call, without blocking only the chunks that got one are fetched
+        chunks = self._chunks(coin_ids)
+        if blocking:
+            await asyncio.gather(*[price_throttler.acquire() for _ in chunks])
+            return coin_ids
+        granted = await asyncio.gather(*[price_throttler.try_acquire() for _ in chunks])
+        allowed = [coin_id for chunk, ok in zip(chunks, granted) if ok for coin_id in chunk]
+        if not allowed:
+            # our own budget, not a coingecko problem, so the breaker doesn't count it
+            raise ProviderUnavailable("throttled", failure=False)
+        return allowed
+
+    async def fetch_prices(self, coin_ids, currencies, blocking):
+        # vs_currencies takes a list, so one call fills coins x currencies, chunks run concurrently
+        # the token for each chunk was taken by acquire, the granted ids chunk the same way again
+        results = await asyncio.gather(
+            *[self._fetch_chunk(chunk, currencies) for chunk in self._chunks(coin_ids)], return_exceptions=True
+        )
+        return merge_chunk_results(results)
+
+    async def _fetch_chunk(self, chunk, currencies):
+        response = await get_http_client().get(
+            "/simple/price",
+            params={"ids": ",".join(chunk), "vs_currencies": ",".join(currencies)},
+            timeout=HTTP_TIMEOUT
+        )
+        if response.status_code == 429:
+            raise ProviderUnavailable("rate limited", retry_after=retry_after(response))
+        if response.status_code != 200:
+            raise ProviderUnavailable(f"status {response.status_code}")
+
+        data = response.json()
+        return {
+            (coin_id, currency): data[coin_id][currency]
+            for coin_id in chunk for currency in currencies
+            if data.get(coin_id, {}).get(currency) is not None
+        }
+
+class CryptoCompareProvider(PriceProvider):
+    """Prices by ticker symbol, coin ids are mapped through the coin catalog."""
+
+    name = "cryptocompare"
+    # pricemulti caps fsyms at 300 and tsyms at 100 characters
+    MAX_FSYMS_LENGTH = 300
+
+    def __init__(self):
+        super().__init__(CircuitBreaker(self.name))
+        self._symbols = {}
+        self._symbols_loaded_at = 0.0
+
+    async def symbols_for(self, coin_ids: list):
+        # {coin_id: SYMBOL}, only for the coin ranked highest among those sharing its symbol
+        if time.monotonic() - self._symbols_loaded_at > SYMBOL_CACHE_TTL:
+            self._symbols = {}
+            self._symbols_loaded_at = time.monotonic()
+        unknown = [c for c in coin_ids if c not in self._symbols]
+        if unknown:
+            async with async_session_maker() as session:
+                symbols = select(Coin.symbol).where(Coin.id.in_(unknown))
+                result = await session.execute(
+                    select(Coin.id, Coin.symbol, Coin.market_cap_rank).where(Coin.symbol.in_(symbols))
+                )
+                best = {}
+                for coin_id, symbol, rank in result.all():
+                    current = best.get(symbol)
+                    if current is None or (rank or float("inf")) < current[1]:
+                        best[symbol] = (coin_id, rank or float("inf"))
+            winners = {coin_id: symbol.upper() for symbol, (coin_id, _) in best.items() if symbol}
+            for coin_id in unknown:
+                self._symbols[coin_id] = winners.get(coin_id)
+        return {c: self._symbols[c] for c in coin_ids if self._symbols.get(c)}
+
+    async def fetch_prices(self, coin_ids, currencies, blocking):
+        symbols = await self.symbols_for(coin_ids)
+        chunks = chunk_by_limits(list(symbols), max_length=self.MAX_FSYMS_LENGTH, size=lambda c: len(symbols[c]))
+        results = await asyncio.gather(
+            *[self._fetch_chunk({c: symbols[c] for c in chunk}, currencies) for chunk in chunks],
+            return_exceptions=True
+        )
+        return merge_chunk_results(results)
+
+    async def _fetch_chunk(self, symbols: dict, currencies: list):
+        headers = {"authorization": f"Apikey {CRYPTOCOMPARE_API_KEY}"} if CRYPTOCOMPARE_API_KEY else None
+        response = await get_http_client().get(
+            f"{CRYPTOCOMPARE_BASE_URL}/pricemulti",
+            params={"fsyms": ",".join(symbols.values()), "tsyms": ",".join(c.upper() for c in currencies)},
+            headers=headers,
+            timeout=HTTP_TIMEOUT
+        )
+        if response.status_code == 429:
+            raise ProviderUnavailable("rate limited", retry_after=retry_after(response))
+        if response.status_code != 200:
+            raise ProviderUnavailable(f"status {response.status_code}")
+
+        data = response.json()
+        if data.get("Response") == "Error":
+            # errors come back as 200 with a message, rate limits included
+            message = data.get("Message", "")
+            limited = "rate limit" in message.lower()
+            raise ProviderUnavailable(message, retry_after=DEFAULT_RETRY_AFTER if limited else None)
+        return {
+            (coin_id, currency): data[symbol][currency.upper()]
+            for coin_id, symbol in symbols.items() for currency in currencies
+            if data.get(symbol, {}).get(currency.upper()) is not None
+        }
+
+class FilePriceProvider(PriceProvider):
+    """Prices from a local json file, reread when it changes."""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._data = {}
+        self._mtime = None
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                self._data = json.load(f)
+            self._mtime = mtime
+        return self._data
+
+    async def fetch_prices(self, coin_ids, currencies, blocking):
+        try:
+            data = await asyncio.to_thread(self._load)
+        except (OSError, ValueError) as e:
+            raise ProviderUnavailable(f"can't read {self.path}: {e}")
+        return {
+            (coin_id, currency): data[coin_id][currency]
+            for coin_id in coin_ids for currency in currencies
+            if data.get(coin_id, {}).get(currency) is not None
+        }
+
+def chunk_by_limits(items: list, max_count: int | None = None, max_length: int | None = None, size=len):
+    # splits comma separated query values so no request passes the id count or the url length limit
+    chunks, chunk, length = [], [], 0
+    for item in items:
+        item_length = size(item) + 1
+        full = max_count is not None and len(chunk) >= max_count
+        too_long = max_length is not None and length + item_length > max_length
+        if chunk and (full or too_long):
+            chunks.append(chunk)
+            chunk, length = [], 0
+        chunk.append(item)
+        length += item_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def merge_chunk_results(results):
+    # keeps whatever chunks succeeded, only fails when every chunk did
+    prices = {}
+    errors = [r for r in results if isinstance(r, BaseException)]
+    for result in results:
+        if not isinstance(result, BaseException):
+            prices.update(result)
+    if errors and not prices:
+        raise errors[0]
+    return prices
+
+class PriceRouter:
+    """
+    Sends each fetch to the fastest available provider.
+    - providers whose circuit breaker is open are skipped, see CircuitBreaker
+    - if it hasn't answered within its own p95 the next provider gets the same request, first answer wins
+    - pairs the winner didn't know are asked from the remaining providers
+    """
+
+    def __init__(self, providers: list):
+        self.providers = providers
+
+    def candidates(self, exclude=()):
+        available = [p for p in self.providers if p.available and p not in exclude]
+        # stable sort, equal latencies keep the configured preference
+        return sorted(available, key=lambda p: p.typical_latency)
+
+    async def fetch_prices(self, coin_ids: list, currencies: list, blocking: bool = True):
+        prices = {}
+        tried = set()
+        while True:
+            missing = [c for c in coin_ids if any((c, cur) not in prices for cur in currencies)]
+            candidates = self.candidates(exclude=tried)
+            if not missing or not candidates:
+                return prices
+            result, used = await self._hedged(candidates, missing, currencies, blocking)
+            tried.update(used)
+            prices.update(result)
+
+    async def _hedged(self, candidates, coin_ids, currencies, blocking):
+        backups = list(candidates[1:])
+        tasks = {}
+        used = []
+
+        def start(provider):
+            task = asyncio.create_task(self._call(provider, coin_ids, currencies, blocking))
+            tasks[task] = provider
+            used.append(provider)
+
+        start(candidates[0])
+        hedged = False
+        try:
+            while tasks:
+                timeout = candidates[0].hedge_delay if backups and not hedged else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backup = backups.pop(0)
+                    PROVIDER_HEDGES.labels(backup.name).inc()
+                    start(backup)
+                    hedged = True
+                    continue
+                for task in done:
+                    tasks.pop(task)
+                    result = task.result()
+                    if result:
+                        return result, used
+                if not tasks and backups:
+                    # the provider failed outright, go straight to the next one
+                    start(backups.pop(0))
+            return {}, used
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call(self, provider, coin_ids, currencies, blocking):
+        # returns the provider's prices, or None when it failed, answered nothing or its breaker said no
+        breaker = provider.breaker
+        if not breaker.try_acquire():
+            PROVIDER_REQUESTS.labels(provider.name, "breaker_open").inc()
+            return None
+        try:
+            coin_ids = await provider.acquire(coin_ids, blocking)
+            # waiting on our own throttle isn't upstream latency, it would inflate the hedge delay
+            started = time.perf_counter()
+            prices = await provider.fetch_prices(coin_ids, currencies, blocking)
+        except ProviderUnavailable as e:
+            if e.failure:
+                breaker.record_failure(e.retry_after)
+            else:
+                breaker.release()
+            log.warning(f"Price provider {provider.name} unavailable: {e}")
+            PROVIDER_REQUESTS.labels(provider.name, "unavailable" if e.failure else "throttled").inc()
+            return None
+        except httpx.TimeoutException:
+            breaker.record_failure()
+            log.warning(f"Price provider {provider.name} timed out")
+            PROVIDER_REQUESTS.labels(provider.name, "timeout").inc()
+            return None
+        except Exception as e:
+            breaker.record_failure()
+            log.warning(f"Price provider {provider.name} failed: {e}")
+            PROVIDER_REQUESTS.labels(provider.name, "error").inc()
+            return None
+        finally:
+            # a hedge loser is cancelled mid call, that says nothing about the upstream
+            breaker.release()
+        if not prices:
+            # nothing to ask it (no symbols) or it knew none of the coins, not a success and no latency sample
+            PROVIDER_REQUESTS.labels(provider.name, "empty").inc()
+            return None
+        breaker.record_success()
+        provider.latencies.append(time.perf_counter() - started)
+        PROVIDER_REQUESTS.labels(provider.name, "ok").inc()
+        return prices
+
+def create_price_providers(names: list = PRICE_PROVIDERS):
+    providers = []
+    for name in (n.strip() for n in names):
+        if name == "coingecko":
+            providers.append(CoinGeckoProvider())
+        elif name == "cryptocompare":
+            providers.append(CryptoCompareProvider())
+        elif name == "file" and PRICE_FILE_PATH:
+            providers.append(FilePriceProvider(PRICE_FILE_PATH))
+        elif name:
+            log.warning(f"Unknown price provider {name!r} ignored")
+    return providers
+
+price_router = PriceRouter(create_price_providers())
+# =====END PRICE PROVIDERS=====
+
+# ==========PRICE LOADER=======
+# how long the first caller's prices wait for other requests to join the same upstream fetch
+PRICE_BATCH_WINDOW_MS = config("PRICE_BATCH_WINDOW_MS", default=20, cast=int)
+# a batch with this many coins goes right away, it already fills a whole request
+PRICE_BATCH_MAX_IDS = config("PRICE_BATCH_MAX_IDS", default=CoinGeckoProvider.MAX_IDS_PER_REQUEST, cast=int)
+
+class PriceBatch:
+    def __init__(self):
+        # dicts as ordered sets
+        self.coins = {}
+        self.currencies = {}
+        self.callers = 0
+        self.future = asyncio.get_running_loop().create_future()
+        self.timer = None
+
+class PriceLoader:
+    """
+    Dataloader for upstream prices, shared by every request in the process.
+    - pairs asked for within PRICE_BATCH_WINDOW_MS of each other go upstream as one coins x currencies fetch
+    - every caller awaits the batch its pairs landed in, one answer resolves them all
+    - the provider still splits a batch by its own id count and url length limits, see chunk_by_limits
+    """
+
+    def __init__(self, fetch, window_ms: int = PRICE_BATCH_WINDOW_MS, max_ids: int = PRICE_BATCH_MAX_IDS):
+        # fetch(coin_ids, currencies, blocking) returns {(coin_id, currency): price or None}
+        self._fetch = fetch
+        self.window = window_ms / 1000
+        self.max_ids = max_ids
+        # one open batch per blocking flag, the refresher may wait on the throttle but requests never do
+        self._open = {}
+        self._tasks = set()
+
+    async def load(self, pairs: list, blocking: bool = True):
+        # returns {(coin_id, currency): price or None}
+        batches = []
+        for coin_id, currency in pairs:
+            batch = self._open.get(blocking)
+            if batch is not None and coin_id not in batch.coins and len(batch.coins) >= self.max_ids:
+                self._dispatch(blocking, batch)
+                batch = None
+            if batch is None:
+                batch = self._open[blocking] = PriceBatch()
+                batch.timer = asyncio.get_running_loop().call_later(self.window, self._dispatch, blocking, batch)
+            batch.coins[coin_id] = None
+            batch.currencies[currency] = None
+            if batch not in batches:
+                batch.callers += 1
+                batches.append(batch)
+        batch = self._open.get(blocking)
+        if batch is not None and len(batch.coins) >= self.max_ids:
+            self._dispatch(blocking, batch)
+
+        prices = {}
+        for batch in batches:
+            # shield so a cancelled caller doesn't cancel the batch for everyone else in it
+            prices.update(await asyncio.shield(batch.future))
+        return {pair: prices.get(pair) for pair in pairs}
+
+    def _dispatch(self, blocking: bool, batch: PriceBatch):
+        if self._open.get(blocking) is batch:
+            del self._open[blocking]
+        batch.timer.cancel()
+        PRICE_BATCH_CALLERS.observe(batch.callers)
+        task = asyncio.create_task(self._run(blocking, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, blocking: bool, batch: PriceBatch):
+        try:
+            prices = await self._fetch(list(batch.coins), list(batch.currencies), blocking)
+        except Exception as e:
+            batch.future.set_exception(e)
+            # marks it retrieved, asyncio would log it if every caller was cancelled
+            batch.future.exception()
+        else:
+            batch.future.set_result(prices)
+# =====END PRICE LOADER=====
+
 class CoinGeckoService:
-    # NOTE: adjust if necessary based on realtime fast changing value of the coins but for me i think its pretty decent and generous and make performance better 
-    CACHE_DURATION = 30  # 30 seconds
+    # icons practically never change, the coin catalog is the main source and this is the fallback
+    ICON_CACHE_DURATION = 86400  # 1 day
     
     @staticmethod
-    async def get_current_price(coin_id: str, currency: str = "php"):
-        # wait here if users making requests too fast
-        await throttler.wait_if_needed()
+    def price_cache_key(coin_id: str, currency: str):
         # include currency in cache key to support multiple currencies
-        cache_key = f"crypto_portfolio:price:{coin_id}:{currency}"
-        cached_price = redis_client.get(cache_key)
+        return f"crypto_portfolio:price:{coin_id}:{currency}"
+
+    @staticmethod
+    async def get_current_price(coin_id: str, currency: str = "php"):
+        quotes = await CoinGeckoService.get_price_quotes([coin_id], currency)
+        quote = quotes[coin_id]
         
-        if cached_price:
-            print(f"Using REDIS cached price for {coin_id} in {currency.upper()}: {cached_price}")
-            return float(cached_price)
+        if quote is not None:
+            log.debug("Using cached price", extra={"fields": {"coin": coin_id, "currency": currency, "age": round(quote.age)}})
+            return quote.price
         
-        try:
-            print(f"Fetching FRESH price for {coin_id} in {currency.upper()} from CoinGecko...")
-            # support multiple currencies by including the currency parameter
-            url = f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies={currency}"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=10.0)
-                
-                if response.status_code == 429:
-                    print("CoinGecko rate limit exceeded")
-                    return None
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if coin_id in data and currency in data[coin_id]:
-                        price = data[coin_id][currency]
-                        redis_client.setex(
-                            cache_key, 
-                            CoinGeckoService.CACHE_DURATION,
-                            price
-                        )
-                        print(f"Got FRESH price for {coin_id} in {currency.upper()}: {price} (cached in Redis)")
-                        return price
-                
-                print(f"CoinGecko API error: {response.status_code}")
-                return None
-                
-        except Exception as e:
-            print(f"CoinGecko failed: {e}")
-            return None
+        # only cache misses go upstream, and a user request never sleeps on the throttle
+        prices = await CoinGeckoService.refresh_pairs([(coin_id, currency)], blocking=False)
+        return prices[(coin_id, currency)]
+
+    @staticmethod
+    async def get_pair_quotes(pairs: list, revalidate: bool = True):
+        # cache only lookup, never waits on coingecko (prices are kept warm by the price refresher)
+        # pairs are (coin_id, currency) in any mix of currencies, all read in one MGET
+        # returns {(coin_id, currency): PriceQuote or None}, stale quotes are still returned and refreshed in the background
+        pairs = list(dict.fromkeys(pairs))
+        if not pairs:
+            return {}
+        keys = [CoinGeckoService.price_cache_key(coin_id, currency) for coin_id, currency in pairs]
+        cached = await price_cache.get_many(keys)
+        quotes = {pair: cached[key] for pair, key in zip(pairs, keys)}
+
+        stale_pairs = [pair for pair, q in quotes.items() if q is not None and q.is_stale]
+        if revalidate and stale_pairs:
+            task = asyncio.create_task(CoinGeckoService.refresh_pairs(stale_pairs, blocking=False))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        return quotes
+
+    @staticmethod
+    async def get_price_quotes(coin_ids: list, currency: str = "php", revalidate: bool = True):
+        # returns {coin_id: PriceQuote or None}
+        quotes = await CoinGeckoService.get_pair_quotes([(c, currency) for c in coin_ids], revalidate)
+        return {coin_id: quote for (coin_id, _), quote in quotes.items()}
     
     @staticmethod
-    async def get_multiple_prices(coin_ids: list, currency: str = "php"):
-        prices = {}
-        
-        # try to get all from redis first with currency support
-        for coin_id in coin_ids:
-            cache_key = f"crypto_portfolio:price:{coin_id}:{currency}"
-            cached_price = redis_client.get(cache_key)
-            if cached_price:
-                prices[coin_id] = {currency: float(cached_price)}
-        
-        # fetch missing coins from coingecko
-        missing_coins = [c for c in coin_ids if c not in prices]
-        if missing_coins:
+    async def refresh_pairs(pairs: list, blocking: bool = True):
+        # fetch fresh prices from coingecko and write them to the cache, returns {(coin_id, currency): price}
+        # concurrent refreshes of the same (coin, currency) share one upstream fetch
+        key_to_pair = {CoinGeckoService.price_cache_key(c, cur): (c, cur) for c, cur in pairs}
+
+        async def fetch(keys):
+            # the loader merges these with other requests' keys into as few upstream calls as it can
+            prices = await price_loader.load([key_to_pair[k] for k in keys], blocking)
+            return {k: prices.get(key_to_pair[k]) for k in keys}
+
+        async def read_cached(keys):
+            # only a fresh value means the other worker finished its fetch
+            quotes = await price_cache.get_many(keys)
+            return {k: q.price if q and not q.is_stale else None for k, q in quotes.items()}
+
+        results = await price_flight.do(list(key_to_pair), fetch, read_cached)
+        return {key_to_pair[k]: price for k, price in results.items()}
+
+    @staticmethod
+    async def _fetch_price_matrix(coin_ids: list, currencies: list, blocking: bool = True):
+        # the price router picks the provider, see PRICE PROVIDERS, and every answer lands in the cache
+        prices = {(coin_id, currency): None for coin_id in coin_ids for currency in currencies}
+        label = ",".join(c.upper() for c in currencies)
+        log.debug(f"Fetching fresh prices for {len(coin_ids)} coins in {label}")
+        fresh = await price_router.fetch_prices(coin_ids, currencies, blocking)
+        fresh = {pair: price for pair, price in fresh.items() if pair in prices}
+        if fresh:
+            key_to_pair = {CoinGeckoService.price_cache_key(coin_id, currency): (coin_id, currency) for coin_id, currency in fresh}
             try:
-                await throttler.wait_if_needed()
-                
-                ids = ",".join(missing_coins)
-                # include currency parameter for batch requests
-                url = f"https://api.coingecko.com/api/v3/simple/price?ids={ids}&vs_currencies={currency}"
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(url)
-                    
-                    if response.status_code == 429:
-                        print("CoinGecko rate limit exceeded in batch request")
-                        for coin_id in missing_coins:
-                            prices[coin_id] = {currency: None}
-                        return prices
-                    
-                    if response.status_code == 200:
-                        fresh_data = response.json()
-                        for coin_id in missing_coins:
-                            if coin_id in fresh_data and currency in fresh_data[coin_id]:
-                                price = fresh_data[coin_id][currency]
-                                redis_client.setex(
-                                    f"crypto_portfolio:price:{coin_id}:{currency}",
-                                    CoinGeckoService.CACHE_DURATION,
-                                    price
-                                )
-                                prices[coin_id] = {currency: price}
-                            else:
-                                prices[coin_id] = {currency: None}
+                # the whole matrix goes back in one pipelined round trip
+                changed = await price_cache.set_many({key: fresh[pair] for key, pair in key_to_pair.items()})
             except Exception as e:
-                print(f"Batch fetch failed: {e}")
-                for coin_id in missing_coins:
-                    prices[coin_id] = {currency: None}
-        
+                log.warning(f"Price cache write failed: {e}")
+            else:
+                if changed:
+                    # every price write moves the materialized portfolio totals, not only the refresher's
+                    await notify_price_change({key_to_pair[key]: fresh[key_to_pair[key]] for key in changed})
+        prices.update(fresh)
         return prices
 
     @staticmethod
     async def get_coin_icon_url(coin_id: str):
-        print(f"DEBUG: Fetching icon for coin_id: '{coin_id}'")
-        
         cache_key = f"crypto_portfolio:icon:{coin_id}"
-        cached_icon = redis_client.get(cache_key)
+        cached_icon = await redis_client.get(cache_key)
         
         if cached_icon:
-            print(f"Using REDIS cached icon for {coin_id}: {cached_icon}")
+            CACHE_LOOKUPS.labels("icon", "hit").inc()
             return cached_icon
-        
+        CACHE_LOOKUPS.labels("icon", "miss").inc()
+
+        # same budget as the prices, see SingleFlight.do, so add_holding never waits on an icon past it
+        task = asyncio.create_task(CoinGeckoService._fetch_coin_icon(coin_id, cache_key))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), time_left())
+        except asyncio.TimeoutError:
+            # the fetch keeps going and caches the icon for the next request
+            DEADLINE_EXCEEDED.inc()
+            return None
+
+    @staticmethod
+    async def _fetch_coin_icon(coin_id: str, cache_key: str):
+        if not coingecko_breaker.try_acquire():
+            # coingecko is down or rate limiting us, the icon can wait for the next page load
+            return None
         try:
-            await throttler.wait_if_needed()
+            if not await coin_throttler.try_acquire():
+                log.debug(f"Throttled, skipping icon for {coin_id}")
+                return None
             
-            url = f"https://api.coingecko.com/api/v3/coins/{coin_id}"
-            print(f"DEBUG: Making request to: {url}")
+            response = await get_http_client().get(f"/coins/{coin_id}", timeout=HTTP_TIMEOUT)
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=10.0)
-                
-                print(f"DEBUG: Response status: {response.status_code}")
-                
-                if response.status_code == 429:
-                    print("CoinGecko rate limit exceeded for icon")
-                    return None
+            if response.status_code == 429:
+                log.warning("CoinGecko rate limit exceeded for icon")
+                coingecko_breaker.record_failure(retry_after(response))
+                return None
+            if response.status_code >= 500:
+                log.warning(f"CoinGecko API error for icon: {response.status_code}")
+                coingecko_breaker.record_failure()
+                return None
+            coingecko_breaker.record_success()
+            
+            if response.status_code == 200:
+                data = response.json()
+                image_data = data.get('image', {})
+                icon_url = image_data.get('large')
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"DEBUG: Found image data: {data.get('image', {})}")
-
-                    image_data = data.get('image', {})
-                    icon_url = image_data.get('large')
-                    
-                    if icon_url:
-                        print(f"Found icon URL: {icon_url}")
-                        redis_client.setex(
-                            cache_key,
-                            CoinGeckoService.CACHE_DURATION * 2,
-                            icon_url
-                        )
-                        print(f"Cached icon for {coin_id}: {icon_url}")
-                        return icon_url
-                    else:
-                        print(f"No icon URL found in response")
-                        return None
+                if icon_url:
+                    await redis_client.setex(
+                        cache_key,
+                        CoinGeckoService.ICON_CACHE_DURATION,
+                        icon_url
+                    )
+                    return icon_url
                 else:
-                    print(f"CoinGecko API error for icon: {response.status_code}")
-                    print(f"Response text: {response.text}")
+                    log.info(f"No icon URL found for {coin_id}")
                     return None
+            else:
+                log.warning(f"CoinGecko API error for icon: {response.status_code}")
+                return None
                     
         except Exception as e:
-            print(f"CoinGecko icon fetch failed: {e}")
+            log.warning(f"CoinGecko icon fetch failed: {e}")
+            coingecko_breaker.record_failure()
             return None
+        finally:
+            coingecko_breaker.release()
 
-    @staticmethod
-    async def get_multiple_icons(coin_ids: list):
-        icons = {}
-        
-        # try to get all from redis first
-        for coin_id in coin_ids:
-            cache_key = f"crypto_portfolio:icon:{coin_id}"
-            cached_icon = redis_client.get(cache_key)
-            if cached_icon:
-                icons[coin_id] = cached_icon
-        
-        # fetch missing icons from coingecko
-        missing_coins = [c for c in coin_ids if c not in icons]
-        if missing_coins:
-            try:
-                await throttler.wait_if_needed()
-                
-                for coin_id in missing_coins:
-                    icon_url = await CoinGeckoService.get_coin_icon_url(coin_id)
-                    icons[coin_id] = icon_url
-                    
-            except Exception as e:
-                print(f"Batch icon fetch failed: {e}")
-                for coin_id in missing_coins:
-                    if coin_id not in icons:
-                        icons[coin_id] = None
-        
-        return icons
\ No newline at end of file
+price_loader = PriceLoader(CoinGeckoService._fetch_price_matrix)
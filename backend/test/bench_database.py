@@ -0,0 +1,140 @@
+"""
+Portfolio read/write throughput across storage modes:
+- sqlite with default journaling (the old setup)
+- sqlite with WAL, synchronous=NORMAL, busy timeout and mmap
+- postgresql through asyncpg, when BENCH_POSTGRES_URL is set
+
+    python -m test.bench_database [users] [holdings_per_user] [seconds]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from sqlalchemy import select, insert, delete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from decouple import config
+from database import Base, create_database_engine
+from models import User, Holding
+
+BENCH_POSTGRES_URL = config("BENCH_POSTGRES_URL", default="")
+CONCURRENCY = config("BENCH_CONCURRENCY", default=32, cast=int)
+COINS = ["bitcoin", "ethereum", "solana", "cardano", "ripple", "dogecoin", "polkadot", "chainlink"]
+
+
+async def seed(session_maker, users, holdings_per_user):
+    async with session_maker() as session:
+        await session.execute(insert(User), [
+            {
+                "id": user_id,
+                "email": f"bench{user_id}@example.com",
+                "username": f"bench{user_id}",
+                "hashed_password": "x",
+                "is_active": True,
+                "is_superuser": False,
+                "is_verified": True,
+            }
+            for user_id in range(1, users + 1)
+        ])
+        await session.execute(insert(Holding), [
+            {
+                "user_id": user_id,
+                "coin": random.choice(COINS),
+                "coin_symbol": "X",
+                "quantity": random.uniform(0.1, 10),
+                "buy_price": random.uniform(1, 1000),
+                "currency": "php",
+            }
+            for user_id in range(1, users + 1)
+            for _ in range(holdings_per_user)
+        ])
+        await session.commit()
+
+
+async def read_portfolio(session_maker, users):
+    async with session_maker() as session:
+        result = await session.execute(
+            select(Holding).where(Holding.user_id == random.randint(1, users)).order_by(Holding.id)
+        )
+        result.scalars().all()
+
+
+async def write_holding(session_maker, users):
+    # add then delete, like add_holding followed by delete_holding
+    async with session_maker() as session:
+        holding = Holding(
+            user_id=random.randint(1, users), coin="bitcoin", coin_symbol="BTC",
+            quantity=1.0, buy_price=100.0, currency="php"
+        )
+        session.add(holding)
+        await session.commit()
+        await session.execute(delete(Holding).where(Holding.id == holding.id))
+        await session.commit()
+
+
+async def run_for(seconds, operation):
+    done = 0
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal done, errors
+        while time.perf_counter() < deadline:
+            try:
+                await operation()
+                done += 1
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    return done / seconds, errors
+
+
+async def bench_mode(label, url, tune_sqlite, users, holdings_per_user, seconds):
+    engine = create_database_engine(url, tune_sqlite=tune_sqlite)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    await seed(session_maker, users, holdings_per_user)
+
+    reads, read_errors = await run_for(seconds, lambda: read_portfolio(session_maker, users))
+    writes, write_errors = await run_for(seconds, lambda: write_holding(session_maker, users))
+
+    async def mixed():
+        # 9 dashboard polls for every holding change
+        if random.random() < 0.9:
+            await read_portfolio(session_maker, users)
+        else:
+            await write_holding(session_maker, users)
+
+    mixed_ops, mixed_errors = await run_for(seconds, mixed)
+    await engine.dispose()
+    print(
+        f"{label:<22} reads {reads:8.1f}/s   writes {writes:7.1f}/s   mixed 90/10 {mixed_ops:8.1f}/s"
+        f"   errors {read_errors + write_errors + mixed_errors}"
+    )
+
+
+async def main(users, holdings_per_user, seconds):
+    print(f"{users} users x {holdings_per_user} holdings, {CONCURRENCY} concurrent sessions, {seconds}s per phase")
+    with tempfile.TemporaryDirectory() as tmp:
+        await bench_mode(
+            "sqlite default", f"sqlite+aiosqlite:///{os.path.join(tmp, 'default.db')}",
+            False, users, holdings_per_user, seconds
+        )
+        await bench_mode(
+            "sqlite wal tuned", f"sqlite+aiosqlite:///{os.path.join(tmp, 'wal.db')}",
+            True, users, holdings_per_user, seconds
+        )
+    if BENCH_POSTGRES_URL:
+        # drops and recreates every table, point it at a throwaway database
+        await bench_mode("postgresql asyncpg", BENCH_POSTGRES_URL, False, users, holdings_per_user, seconds)
+    else:
+        print("postgresql asyncpg      skipped, set BENCH_POSTGRES_URL=postgresql+asyncpg://... to include it")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(main(*(args + [200, 50, 5][len(args):])))
@@ -0,0 +1,85 @@
+"""
+Cold-miss latency: fresh httpx.AsyncClient per call (old behaviour) vs the shared pooled client.
+
+Starts the local CoinGecko stub on a free port and runs both modes against it:
+    python -m test.bench_http_client [requests]
+"""
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+# services reads these at import, the benchmark never talks to redis
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("JWT_SIGNING_KEY", "bench-signing-key-not-for-production-use")
+
+
+def start_stub_server():
+    # separate process so the stub doesn't share the gil/event loop with the client being measured
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "test.stub_coingecko:stub_app", "--port", str(port), "--log-level", "warning"]
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"stub server exited with {server.returncode}")
+            try:
+                httpx.get(f"{base_url}/docs")
+                return server, base_url
+            except httpx.TransportError:
+                time.sleep(0.1)
+    except BaseException:
+        server.terminate()
+        raise
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<28} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+async def fresh_client_per_call(base_url, n):
+    samples = []
+    for i in range(n):
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            await client.get(f"{base_url}/simple/price?ids=coin{i}&vs_currencies=php", timeout=10.0)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def shared_client(base_url, n):
+    import services
+    services.COINGECKO_BASE_URL = base_url
+    client = services.get_http_client()
+    samples = []
+    for i in range(n):
+        started = time.perf_counter()
+        await client.get("/simple/price", params={"ids": f"coin{i}", "vs_currencies": "php"}, timeout=services.HTTP_TIMEOUT)
+        samples.append((time.perf_counter() - started) * 1000)
+    await services.close_http_client()
+    return samples
+
+
+async def main(n):
+    server, base_url = start_stub_server()
+    try:
+        print(f"{n} cold-miss requests against {base_url}")
+        summarize("fresh AsyncClient per call", await fresh_client_per_call(base_url, n))
+        summarize("shared pooled client", await shared_client(base_url, n))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,228 @@
+"""
+Offline load test for the portfolio endpoints, no CoinGecko and no real redis needed:
+- the local CoinGecko stub (latency and 429 injection, see stub_coingecko.py)
+- fakeredis inside the api process, or a real redis with BENCH_REDIS_URL
+- a throwaway sqlite db seeded with N users x M holdings
+
+Reports p50/p95/p99 latency and throughput for GET /portfolio/, GET /portfolio/stats
+and POST /portfolio/ under BENCH_CONCURRENCY concurrent clients:
+
+    python -m test.bench_load [users] [holdings_per_user] [seconds]
+
+fakeredis needs the lua extra for the token bucket: pip install "fakeredis[lua]"
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from decouple import config
+
+BENCH_REDIS_URL = config("BENCH_REDIS_URL", default="")
+CONCURRENCY = config("BENCH_CONCURRENCY", default=32, cast=int)
+STUB_LATENCY_MS = config("STUB_LATENCY_MS", default=50, cast=int)
+STUB_RATE_LIMIT_PERCENT = config("STUB_RATE_LIMIT_PERCENT", default=0.0, cast=float)
+BENCH_JWT_SIGNING_KEY = "bench-signing-key-not-for-production-use"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process):
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+
+def start_process(args, env):
+    # separate processes so the load generator doesn't share the gil/event loop with what it measures
+    return subprocess.Popen(
+        [sys.executable, *args], cwd=BACKEND_DIR, env={**os.environ, **env}, stdout=subprocess.DEVNULL
+    )
+
+
+def seed_database(database_url, users, holdings_per_user):
+    # returns {user_id: bearer token}, tokens are minted directly instead of logging in N times
+    from sqlalchemy import insert
+    from database import Base, create_database_engine
+    from models import User, Holding
+    from coin_catalog import read_snapshot
+    from auth import get_jwt_strategy
+
+    coins = [coin["id"] for coin in read_snapshot()]
+
+    async def seed():
+        engine = create_database_engine(database_url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(User), [
+                {
+                    "id": user_id,
+                    "email": f"bench{user_id}@example.com",
+                    "username": f"bench{user_id}",
+                    "hashed_password": "x",
+                    "is_active": True,
+                    "is_superuser": False,
+                    "is_verified": True,
+                }
+                for user_id in range(1, users + 1)
+            ])
+            await conn.execute(insert(Holding), [
+                {
+                    "user_id": user_id,
+                    "coin": random.choice(coins),
+                    "coin_symbol": "X",
+                    "quantity": random.uniform(0.1, 10),
+                    "buy_price": random.uniform(1, 1000),
+                    "currency": random.choice(["php", "php", "php", "usd"]),
+                }
+                for user_id in range(1, users + 1)
+                for _ in range(holdings_per_user)
+            ])
+        await engine.dispose()
+        strategy = get_jwt_strategy()
+        return {
+            user_id: await strategy.write_token(User(id=user_id, is_active=True, is_verified=True))
+            for user_id in range(1, users + 1)
+        }
+
+    return coins, asyncio.run(seed())
+
+
+def serve(port):
+    # api process entry point: python -m test.bench_load --serve PORT
+    if not BENCH_REDIS_URL:
+        import fakeredis
+        import redis.asyncio
+        server = fakeredis.FakeServer()
+        redis.asyncio.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(
+            server=server, decode_responses=kwargs.get("decode_responses", False)
+        )
+    import uvicorn
+    uvicorn.run("main:app", port=port, log_level="warning")
+
+
+def percentile_line(label, samples, seconds, statuses):
+    if len(samples) < 2:
+        print(f"{label:<22} not enough samples   statuses {statuses}")
+        return
+    cuts = statistics.quantiles(samples, n=100)
+    print(
+        f"{label:<22} {len(samples) / seconds:8.1f} req/s   p50 {cuts[49]:7.2f} ms   p95 {cuts[94]:7.2f} ms"
+        f"   p99 {cuts[98]:7.2f} ms   statuses {statuses}"
+    )
+
+
+async def run_scenario(client, label, seconds, make_request):
+    samples = []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await make_request()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    percentile_line(label, samples, seconds, statuses)
+
+
+async def load(api_url, stub_url, tokens, coins, seconds):
+    user_ids = list(tokens)
+
+    def headers():
+        return {"Authorization": f"Bearer {tokens[random.choice(user_ids)]}"}
+
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=30.0) as client:
+        # wait for the price refresher's first pass so every scenario runs against a warm cache
+        while True:
+            response = await client.get("/portfolio/", headers=headers())
+            if response.status_code == 200 and not any(h["price_is_stale"] for h in response.json()):
+                break
+            await asyncio.sleep(0.5)
+        await client.post(f"{stub_url}/stub/reset")
+
+        await run_scenario(client, "GET /portfolio/", seconds, lambda: client.get("/portfolio/", headers=headers()))
+        await run_scenario(client, "GET /portfolio/stats", seconds, lambda: client.get("/portfolio/stats", headers=headers()))
+        await run_scenario(client, "POST /portfolio/", seconds, lambda: client.post(
+            "/portfolio/",
+            headers=headers(),
+            json={
+                "coin": random.choice(coins),
+                "coin_symbol": "X",
+                "quantity": 1.0,
+                "buy_price": 100.0,
+                "currency": random.choice(["php", "usd"]),
+            },
+        ))
+        upstream = (await client.get(f"{stub_url}/stub/stats")).json()
+        print(f"upstream calls during the run: {json.dumps(upstream)}")
+
+
+def main(users, holdings_per_user, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        stub_port, api_port = free_port(), free_port()
+        stub_url, api_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{api_port}"
+        env = {
+            "DATABASE_URL": database_url,
+            "REDIS_URL": BENCH_REDIS_URL or "redis://fakeredis",
+            "JWT_SIGNING_KEY": BENCH_JWT_SIGNING_KEY,
+            "COINGECKO_BASE_URL": stub_url,
+            "CRYPTOCOMPARE_BASE_URL": f"{stub_url}/data",
+            "CATALOG_REFRESHER_ENABLED": "False",
+            "COIN_SNAPSHOT_PATH": os.path.join(tmp, "coins_snapshot.json"),
+            "STUB_LATENCY_MS": str(STUB_LATENCY_MS),
+            "STUB_RATE_LIMIT_PERCENT": str(STUB_RATE_LIMIT_PERCENT),
+        }
+        os.environ.update(env)
+        coins, tokens = seed_database(database_url, users, holdings_per_user)
+
+        stub = start_process(
+            ["-m", "uvicorn", "test.stub_coingecko:stub_app", "--port", str(stub_port), "--log-level", "warning"], env
+        )
+        api = start_process(["-m", "test.bench_load", "--serve", str(api_port)], env)
+        try:
+            wait_until_up(f"{stub_url}/docs", stub)
+            wait_until_up(f"{api_url}/", api)
+            print(
+                f"{users} users x {holdings_per_user} holdings, {CONCURRENCY} concurrent clients, {seconds}s per scenario"
+                f", redis: {BENCH_REDIS_URL or 'fakeredis'}, stub latency {STUB_LATENCY_MS} ms"
+                f", stub 429 rate {STUB_RATE_LIMIT_PERCENT}%"
+            )
+            asyncio.run(load(api_url, stub_url, tokens, coins, seconds))
+        finally:
+            api.terminate()
+            stub.terminate()
+            api.wait()
+            stub.wait()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]))
+    else:
+        args = [int(a) for a in sys.argv[1:]]
+        main(*(args + [100, 20, 10][len(args):]))
@@ -0,0 +1,173 @@
+"""
+Whole user base revaluation throughput:
+- the per row python loop the endpoints use, on in memory columns
+- to_columns, turning fetched rows into the column arrays
+- the numpy engine on in memory columns, in this process and on a pool of 2 and 4 workers
+- revalue_all_users end to end: a seeded sqlite db streamed in chunks, to_columns and the numpy engine
+
+The db is a throwaway sqlite file and redis is fakeredis unless BENCH_REDIS_URL is set:
+
+    python -m test.bench_revaluation [holdings] [users] [chunk_size]
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_revaluation_")
+# always a scratch database, the holdings table gets seeded
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ.setdefault("REDIS_URL", os.environ.get("BENCH_REDIS_URL") or "redis://localhost:6379/0")
+os.environ.setdefault("JWT_SIGNING_KEY", "bench-signing-key-not-for-production-use")
+
+if not os.environ.get("BENCH_REDIS_URL"):
+    import fakeredis
+    import redis.asyncio
+    server = fakeredis.FakeServer()
+    redis.asyncio.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(
+        server=server, decode_responses=kwargs.get("decode_responses", False)
+    )
+
+import numpy as np
+from sqlalchemy import insert
+from database import Base, engine
+from models import Holding
+from revaluation import HoldingColumns, build_price_matrix, revalue_chunks, revalue_all_users, to_columns
+from services import CoinGeckoService, price_cache
+
+COINS = 2000
+CURRENCIES = ["php", "usd", "eur"]
+# share of (coin, currency) pairs without a cached price, valued at buy_price
+MISSING_PRICE_SHARE = 0.05
+SEED_BATCH = 50000
+
+
+def make_holdings(holdings, users, seed=7):
+    rng = np.random.default_rng(seed)
+    columns = HoldingColumns(
+        np.sort(rng.integers(1, users + 1, holdings)),
+        rng.integers(0, COINS, holdings, dtype=np.int32),
+        rng.integers(0, len(CURRENCIES), holdings, dtype=np.int32),
+        rng.uniform(0.1, 10, holdings),
+        rng.uniform(1, 1000, holdings),
+    )
+    prices = rng.uniform(1, 1000, (COINS + 1, len(CURRENCIES) + 1))
+    prices[rng.random(prices.shape) < MISSING_PRICE_SHARE] = np.nan
+    return columns, prices
+
+
+def as_rows(columns):
+    # what the server side cursor yields, (user_id, coin, currency, quantity, buy_price)
+    return [
+        (user_id, f"coin-{coin}", CURRENCIES[currency], quantity, buy_price)
+        for user_id, coin, currency, quantity, buy_price in zip(*(column.tolist() for column in columns))
+    ]
+
+
+def cached_prices(prices):
+    # {(coin, currency): price} for every pair that has one
+    return {
+        (f"coin-{coin}", currency): float(prices[coin, column])
+        for coin in range(COINS)
+        for column, currency in enumerate(CURRENCIES)
+        if not np.isnan(prices[coin, column])
+    }
+
+
+async def as_chunks(columns, chunk_size):
+    for start in range(0, len(columns.user_ids), chunk_size):
+        yield HoldingColumns(*(column[start:start + chunk_size] for column in columns))
+
+
+def python_loop(columns, prices):
+    # what value_holding does per row, accumulated per user in a dict
+    rows = zip(*(column.tolist() for column in columns))
+    price_rows = prices.tolist()
+    totals = {}
+    for user_id, coin, currency, quantity, buy_price in rows:
+        invested = quantity * buy_price
+        price = price_rows[coin][currency]
+        value = invested if price != price else quantity * price
+        total = totals.setdefault(user_id, [0.0, 0.0, 0])
+        total[0] += invested
+        total[1] += value
+        total[2] += 1
+    return totals
+
+
+def check(result, expected):
+    # same totals as the loop, per user
+    assert len(result.user_ids) == len(expected)
+    values = np.array([expected[u][1] for u in result.user_ids.tolist()])
+    assert np.allclose(result.value, values)
+
+
+def report(label, holdings, seconds):
+    print(f"{label:<32} {seconds * 1000:9.1f} ms   {holdings / seconds / 1e6:7.2f} M holdings/s")
+
+
+async def seed_database(rows, prices):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    keys = ("user_id", "coin", "currency", "quantity", "buy_price")
+    for start in range(0, len(rows), SEED_BATCH):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Holding), [
+                {**dict(zip(keys, row)), "coin_symbol": "X"} for row in rows[start:start + SEED_BATCH]
+            ])
+    await price_cache.set_many({
+        CoinGeckoService.price_cache_key(coin, currency): price
+        for (coin, currency), price in cached_prices(prices).items()
+    })
+
+
+async def end_to_end(holdings, chunk_size, expected):
+    for workers in (0, 2):
+        started = time.perf_counter()
+        result = await revalue_all_users(chunk_size, workers)
+        label = "end to end in process" if workers == 0 else f"end to end, {workers} pool workers"
+        report(label, holdings, time.perf_counter() - started)
+        check(result, expected)
+
+
+def main(holdings, users, chunk_size):
+    columns, prices = make_holdings(holdings, users)
+    print(
+        f"{holdings} holdings, {users} users, {COINS} coins x {len(CURRENCIES)} currencies, chunks of {chunk_size}"
+    )
+
+    started = time.perf_counter()
+    expected = python_loop(columns, prices)
+    report("python loop", holdings, time.perf_counter() - started)
+
+    rows = as_rows(columns)
+    matrix = build_price_matrix({pair: None for pair in cached_prices(prices)})
+    started = time.perf_counter()
+    to_columns(rows, matrix)
+    report("to_columns", holdings, time.perf_counter() - started)
+
+    for workers in (0, 2, 4):
+        started = time.perf_counter()
+        result = asyncio.run(revalue_chunks(as_chunks(columns, chunk_size), prices, workers))
+        label = "numpy in process" if workers == 0 else f"numpy, {workers} pool workers"
+        report(label, holdings, time.perf_counter() - started)
+        check(result, expected)
+
+    async def database_run():
+        started = time.perf_counter()
+        await seed_database(rows, prices)
+        print(f"{'(seeding the db)':<32} {(time.perf_counter() - started) * 1000:9.1f} ms")
+        await end_to_end(holdings, chunk_size, expected)
+        await engine.dispose()
+
+    asyncio.run(database_run())
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    try:
+        main(*(args + [1_000_000, 100_000, 100_000][len(args):]))
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
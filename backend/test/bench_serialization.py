@@ -0,0 +1,94 @@
+"""
+CPU per GET /portfolio/ response, pydantic models vs the FAST_JSON_RESPONSES path:
+- models: a HoldingResponse per orm Holding, validated again against response_model and json encoded
+- fast: plain dicts from column rows, encoded by ORJSONResponse
+
+Both go through a real FastAPI route in process (httpx ASGI transport), no database or redis,
+so the numbers are valuation plus serialization only:
+
+    python -m test.bench_serialization [requests_per_size]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("JWT_SIGNING_KEY", "bench-signing-key-not-for-production-use")
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from main import value_holding, holding_values, HOLDING_COLUMNS
+from models import Holding
+from portfolio_schemas import HoldingResponse
+from services import PriceQuote
+
+SIZES = (10, 1000, 10000)
+COINS = ["bitcoin", "ethereum", "solana", "cardano", "ripple", "dogecoin", "polkadot", "chainlink"]
+HoldingRow = namedtuple("HoldingRow", [column.key for column in HOLDING_COLUMNS])
+
+
+def make_holdings(count):
+    rows = [
+        HoldingRow(
+            id=holding_id,
+            coin=random.choice(COINS),
+            coin_symbol="X",
+            icon_url="https://coin-images.coingecko.com/coins/images/1/large/bitcoin.png",
+            quantity=random.uniform(0.1, 10),
+            buy_price=random.uniform(1, 1000),
+            currency=random.choice(["php", "usd"]),
+            notes=None,
+            created_at=datetime(2025, 1, 1, 12, 0, 0),
+        )
+        for holding_id in range(1, count + 1)
+    ]
+    entities = [Holding(user_id=1, **row._asdict()) for row in rows]
+    quotes = {(coin, currency): PriceQuote(random.uniform(1, 1000), time.time()) for coin in COINS for currency in ("php", "usd")}
+    return rows, entities, quotes
+
+
+def build_app(rows, entities, quotes):
+    app = FastAPI()
+
+    @app.get("/models", response_model=list[HoldingResponse])
+    async def models():
+        return [value_holding(h, quotes.get((h.coin, h.currency))) for h in entities]
+
+    @app.get("/fast")
+    async def fast():
+        return ORJSONResponse([holding_values(h, quotes.get((h.coin, h.currency))) for h in rows])
+
+    return app
+
+
+async def measure(client, path, requests):
+    await client.get(path)  # warm up
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path)
+    return (time.process_time() - started_cpu) / requests, (time.perf_counter() - started) / requests, len(response.content)
+
+
+async def main(requests):
+    print(f"{'holdings':>9} {'path':>7} {'cpu/request':>14} {'wall/request':>14} {'body':>10}")
+    for size in SIZES:
+        app = build_app(*make_holdings(size))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # fewer rounds for the big portfolios, the cpu time per request is what we compare
+            rounds = max(3, requests * 10 // size)
+            results = {path: await measure(client, f"/{path}", rounds) for path in ("models", "fast")}
+        for path, (cpu, wall, body) in results.items():
+            print(f"{size:>9} {path:>7} {cpu * 1000:11.3f} ms {wall * 1000:11.3f} ms {body:>10}")
+        print(f"{'':>9} speedup {results['models'][0] / results['fast'][0]:10.1f}x cpu")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(main(*(args + [1000][len(args):])))
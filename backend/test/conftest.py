@@ -0,0 +1,103 @@
+"""
+Shared setup for the pytest suite: a scratch sqlite db and fakeredis, no network needed.
+
+    cd backend && python -m pytest test
+
+the test tools are pinned in requirements.txt, fakeredis needs its lua extra for the scripts
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="crypto_portfolio_test_")
+
+# before anything imports services or database, both connect at import time
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["REDIS_URL"] = "redis://fakeredis"
+os.environ["JWT_SIGNING_KEY"] = "test-signing-key-not-for-production-use"
+os.environ["COIN_SNAPSHOT_PATH"] = os.path.join(TEST_DIR, "coins_snapshot.json")
+os.environ["PRICE_REFRESHER_ENABLED"] = "False"
+
+import fakeredis
+import redis.asyncio
+
+fake_server = fakeredis.FakeServer()
+redis.asyncio.from_url = lambda url, **kwargs: fakeredis.FakeAsyncRedis(
+    server=fake_server, decode_responses=kwargs.get("decode_responses", False)
+)
+
+import asyncio
+import httpx
+import pytest
+from sqlalchemy import delete, insert
+from database import Base, engine
+from models import User, Holding
+from auth import get_jwt_strategy
+from services import CoinGeckoService, price_cache, price_router, redis_client
+from main import app
+
+# test_endpoints.py is the /test router of the api, not a test module
+collect_ignore = ["test_endpoints.py"]
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+async def clean_caches(anyio_backend):
+    # every test starts from an empty redis and L1
+    await redis_client.flushall()
+    price_cache._local.clear()
+    yield
+
+
+class FakeUpstream:
+    """Stands in for price_router.fetch_prices, every coin is priced the same and every call is recorded."""
+
+    def __init__(self, price=42.0, delay=0.05):
+        self.price = price
+        self.delay = delay
+        self.calls = []
+
+    async def fetch_prices(self, coin_ids, currencies, blocking=True):
+        self.calls.append((list(coin_ids), list(currencies)))
+        await asyncio.sleep(self.delay)
+        return {(coin_id, currency): self.price for coin_id in coin_ids for currency in currencies}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(price_router, "fetch_prices", fake.fetch_prices)
+    return fake
+
+
+async def make_token(user_id=1, is_active=True, is_verified=True):
+    return await get_jwt_strategy().write_token(User(id=user_id, is_active=is_active, is_verified=is_verified))
+
+
+@pytest.fixture
+async def client():
+    # user 1 with one bitcoin holding, priced at 50 usd, and an api client logged in as them
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(delete(Holding))
+        await conn.execute(delete(User))
+        await conn.execute(insert(User), [{
+            "id": 1, "email": "test@example.com", "username": "test", "hashed_password": "x",
+            "is_active": True, "is_superuser": False, "is_verified": True,
+        }])
+        await conn.execute(insert(Holding), [{
+            "user_id": 1, "coin": "bitcoin", "coin_symbol": "btc", "quantity": 2.0, "buy_price": 10.0, "currency": "usd",
+        }])
+    await price_cache.set_many({CoinGeckoService.price_cache_key("bitcoin", "usd"): 50.0})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test", headers={"Authorization": f"Bearer {await make_token()}"}
+    ) as client:
+        yield client
@@ -0,0 +1,107 @@
+"""
+Local stand-in for the CoinGecko (and CryptoCompare) endpoints we use, for benchmarks only.
+
+Run it with:  uvicorn test.stub_coingecko:stub_app --port 8900
+and point the backend at it with COINGECKO_BASE_URL=http://127.0.0.1:8900
+(and CRYPTOCOMPARE_BASE_URL=http://127.0.0.1:8900/data for the second price provider)
+
+STUB_RATE_LIMIT_PERCENT answers that share of requests with a 429 and a Retry-After
+header, like the public api does once you go over its per minute limit.
+"""
+import asyncio
+import random
+import zlib
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from decouple import config
+
+STUB_LATENCY_MS = config("STUB_LATENCY_MS", default=50, cast=int)
+STUB_RATE_LIMIT_PERCENT = config("STUB_RATE_LIMIT_PERCENT", default=0.0, cast=float)
+STUB_RETRY_AFTER = config("STUB_RETRY_AFTER", default=30, cast=int)
+
+stub_app = FastAPI(title="CoinGecko stub")
+# requests seen and 429s sent per path, read by the benchmarks through /stub/stats
+stub_stats = {}
+
+
+@stub_app.middleware("http")
+async def latency_and_rate_limit(request: Request, call_next):
+    path = request.url.path
+    if path.startswith("/stub/") or path in ("/docs", "/openapi.json"):
+        return await call_next(request)
+    route = "/coins/{id}" if path.startswith("/coins/") and path != "/coins/markets" else path
+    counts = stub_stats.setdefault(route, {"requests": 0, "rate_limited": 0})
+    counts["requests"] += 1
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    if random.random() * 100 < STUB_RATE_LIMIT_PERCENT:
+        counts["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"status": {"error_code": 429, "error_message": "You've exceeded the Rate Limit."}},
+            headers={"Retry-After": str(STUB_RETRY_AFTER)},
+        )
+    return await call_next(request)
+
+
+def fake_price(coin_id: str, currency: str):
+    # deterministic per (coin, currency) so runs are comparable
+    return round(zlib.crc32(f"{coin_id}:{currency}".encode()) % 100000 / 7.0, 4)
+
+
+@stub_app.get("/simple/price")
+async def simple_price(ids: str, vs_currencies: str):
+    currencies = vs_currencies.split(",")
+    return {
+        coin_id: {currency: fake_price(coin_id, currency) for currency in currencies}
+        for coin_id in ids.split(",")
+    }
+
+
+@stub_app.get("/data/pricemulti")
+async def cryptocompare_pricemulti(fsyms: str, tsyms: str):
+    # cryptocompare shaped, so the failover provider can run against the same stub
+    # CRYPTOCOMPARE_BASE_URL=http://127.0.0.1:8900/data
+    currencies = tsyms.split(",")
+    return {
+        symbol: {currency: fake_price(symbol.lower(), currency.lower()) for currency in currencies}
+        for symbol in fsyms.split(",")
+    }
+
+
+@stub_app.get("/coins/markets")
+async def coins_markets(vs_currency: str = "usd", per_page: int = 250, page: int = 1):
+    # a small fixed market, enough for the coin catalog to load
+    start = (page - 1) * per_page
+    return [
+        {
+            "id": f"stubcoin-{rank}",
+            "symbol": f"sc{rank}",
+            "name": f"Stub Coin {rank}",
+            "image": f"https://stub.local/stubcoin-{rank}/large.png",
+            "market_cap_rank": rank,
+        }
+        for rank in range(start + 1, min(start + per_page, 500) + 1)
+    ]
+
+
+@stub_app.get("/coins/{coin_id}")
+async def coin_detail(coin_id: str):
+    return {
+        "id": coin_id,
+        "image": {
+            "thumb": f"https://stub.local/{coin_id}/thumb.png",
+            "small": f"https://stub.local/{coin_id}/small.png",
+            "large": f"https://stub.local/{coin_id}/large.png",
+        },
+    }
+
+
+@stub_app.get("/stub/stats")
+async def get_stub_stats():
+    return stub_stats
+
+
+@stub_app.post("/stub/reset")
+async def reset_stub_stats():
+    stub_stats.clear()
+    return stub_stats
@@ -0,0 +1,88 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+import auth
+from auth import current_token_user, get_jwt_strategy, revoke_user_tokens
+from models import User
+from services import redis_client
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def empty_revocation_cache():
+    auth._revocations.clear()
+    yield
+    auth._revocations.clear()
+
+
+async def token_for(user_id=1, is_active=True):
+    return await get_jwt_strategy().write_token(User(id=user_id, is_active=is_active, is_verified=True))
+
+
+async def status_of(token):
+    try:
+        await current_token_user(token)
+    except HTTPException as e:
+        return e.status_code
+    return 200
+
+
+@pytest.fixture
+def redis_down(monkeypatch):
+    async def get(key):
+        raise ConnectionError("redis is down")
+    monkeypatch.setattr(redis_client, "get", get)
+
+
+async def test_a_valid_token_gives_the_user_from_its_claims():
+    user = await current_token_user(await token_for(7))
+
+    assert (user.id, user.is_active, user.is_verified) == (7, True, True)
+
+
+async def test_missing_malformed_and_inactive_tokens_are_rejected():
+    assert await status_of(None) == 401
+    assert await status_of("not-a-jwt") == 401
+    assert await status_of(await token_for(is_active=False)) == 401
+
+
+async def test_revocation_rejects_tokens_issued_before_it():
+    old_token = await token_for()
+    await asyncio.sleep(0.01)
+    await revoke_user_tokens(1)
+    await asyncio.sleep(0.01)
+
+    assert await status_of(old_token) == 401
+    assert await status_of(await token_for()) == 200
+
+
+async def test_revocation_lookup_fails_closed_without_a_cached_answer(redis_down):
+    assert await status_of(await token_for()) == 503
+
+
+async def test_a_recent_cached_answer_rides_out_a_redis_outage(monkeypatch):
+    token = await token_for()
+    assert await status_of(token) == 200
+    # past the cache ttl but within the stale limit, redis gets asked and fails
+    auth._revocations[1] = (None, time.monotonic() - auth.REVOCATION_CACHE_TTL - 1)
+
+    async def get(key):
+        raise ConnectionError("redis is down")
+    monkeypatch.setattr(redis_client, "get", get)
+
+    assert await status_of(token) == 200
+    auth._revocations[1] = (None, time.monotonic() - auth.REVOCATION_MAX_STALE - 1)
+    assert await status_of(token) == 503
+    assert 1 not in auth._revocations
+
+
+async def test_the_revocation_cache_keeps_the_most_recently_used_users(monkeypatch):
+    monkeypatch.setattr(auth, "REVOCATION_CACHE_MAX_ENTRIES", 3)
+    for user_id in (1, 2, 3):
+        await auth._revoked_at(user_id)
+    await auth._revoked_at(1)
+    await auth._revoked_at(4)
+
+    assert list(auth._revocations) == [3, 1, 4]
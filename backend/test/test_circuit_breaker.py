@@ -0,0 +1,89 @@
+import time
+from services import CircuitBreaker
+
+
+def end_cooldown(breaker):
+    breaker.open_until = time.monotonic() - 0.001
+
+
+def opened_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=10, max_cooldown=40)
+    for _ in range(3):
+        assert breaker.try_acquire()
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_the_failure_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=10, max_cooldown=40)
+    for _ in range(2):
+        assert breaker.try_acquire()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    assert breaker.try_acquire()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.ready
+    assert not breaker.try_acquire()
+
+
+def test_breaker_lets_a_single_probe_through_once_the_cooldown_ends():
+    breaker = opened_breaker()
+    end_cooldown(breaker)
+
+    assert breaker.ready
+    assert breaker.try_acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.ready
+    assert not breaker.try_acquire()
+
+
+def test_breaker_closes_when_the_probe_succeeds():
+    breaker = opened_breaker()
+    end_cooldown(breaker)
+    breaker.try_acquire()
+
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.try_acquire() and breaker.try_acquire()
+
+
+def test_breaker_doubles_the_cooldown_on_a_failed_probe_up_to_the_max():
+    breaker = opened_breaker()
+    for cooldown in (20, 40, 40):
+        end_cooldown(breaker)
+        assert breaker.try_acquire()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.cooldown == cooldown
+        assert cooldown - 1 < breaker.open_until - time.monotonic() <= cooldown
+
+    end_cooldown(breaker)
+    breaker.try_acquire()
+    breaker.record_success()
+    assert breaker.cooldown == 10
+
+
+def test_breaker_released_probe_frees_the_half_open_slot():
+    breaker = opened_breaker()
+    end_cooldown(breaker)
+    breaker.try_acquire()
+
+    breaker.release()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.try_acquire()
+
+
+def test_breaker_opens_right_away_on_retry_after_capped_at_the_max():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=10, max_cooldown=40)
+    assert breaker.try_acquire()
+
+    breaker.record_failure(retry_after=600)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert 39 < breaker.open_until - time.monotonic() <= 40
@@ -0,0 +1,73 @@
+from coin_catalog import CoinSearchIndex, to_catalog_row
+
+MARKET_COINS = [
+    {"id": "wrapped-bitcoin", "symbol": "WBTC", "name": "Wrapped Bitcoin", "image": None, "market_cap_rank": 17},
+    {"id": "bitcoin", "symbol": "BTC", "name": "Bitcoin", "image": None, "market_cap_rank": 1},
+    {"id": "bitcoin-cash", "symbol": "BCH", "name": "Bitcoin Cash", "image": None, "market_cap_rank": 19},
+    {"id": "ethereum", "symbol": "ETH", "name": "Ethereum", "image": None, "market_cap_rank": 2},
+    {"id": "unranked-coin", "symbol": "unr", "name": "Unranked", "image": None, "market_cap_rank": None},
+    {"id": "binancecoin", "symbol": "bnb", "name": "BNB", "image": None, "market_cap_rank": 4},
+]
+
+
+def built_index(coins=MARKET_COINS):
+    index = CoinSearchIndex()
+    index.build(coins)
+    return index
+
+
+def ids(results):
+    return [coin["id"] for coin in results]
+
+
+def test_a_prefix_matches_id_symbol_and_name_best_rank_first():
+    index = built_index()
+
+    assert ids(index.search("bit", 10)) == ["bitcoin", "wrapped-bitcoin", "bitcoin-cash"]
+    assert ids(index.search("ETH", 10)) == ["ethereum"]
+    assert ids(index.search("bn", 10)) == ["binancecoin"]
+
+
+def test_later_words_of_the_name_match_too():
+    assert ids(built_index().search("cash", 10)) == ["bitcoin-cash"]
+
+
+def test_an_empty_query_lists_the_top_coins_and_unranked_coins_come_last():
+    assert ids(built_index().search("  ", 10)) == [
+        "bitcoin", "ethereum", "binancecoin", "wrapped-bitcoin", "bitcoin-cash", "unranked-coin"
+    ]
+
+
+def test_short_prefix_results_are_kept_but_still_honour_the_limit():
+    index = built_index()
+
+    assert ids(index.search("b", 2)) == ["bitcoin", "binancecoin"]
+    assert ids(index.search("b", 10)) == ["bitcoin", "binancecoin", "wrapped-bitcoin", "bitcoin-cash"]
+    assert "b" in index._short
+
+
+def test_lookup_by_id_and_duplicate_ids_collapse():
+    index = built_index(MARKET_COINS + [dict(MARKET_COINS[1], name="Bitcoin again")])
+
+    assert len(index) == len(MARKET_COINS)
+    assert "ethereum" in index and "dogecoin" not in index
+    assert index.get("bitcoin")["name"] == "Bitcoin again"
+    assert index.get("dogecoin") is None
+
+
+def test_a_rebuild_replaces_the_previous_index():
+    index = built_index()
+    index.build(MARKET_COINS[3:4], complete=True)
+
+    assert ids(index.search("bit", 10)) == []
+    assert index.complete
+
+
+def test_catalog_rows_use_the_thumb_size_icon():
+    row = to_catalog_row({
+        "id": "bitcoin", "symbol": "BTC", "name": "Bitcoin",
+        "image": "https://example.com/coins/images/1/large/bitcoin.png", "market_cap_rank": 1,
+    })
+
+    assert row["symbol"] == "btc"
+    assert row["thumb_url"] == "https://example.com/coins/images/1/thumb/bitcoin.png"
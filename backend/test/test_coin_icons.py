@@ -0,0 +1,40 @@
+import asyncio
+import time
+import httpx
+import pytest
+import services
+from services import CoinGeckoService, redis_client, request_deadline, set_deadline
+
+pytestmark = pytest.mark.anyio
+
+ICON = "https://example.com/coins/images/1/large/bitcoin.png"
+
+
+@pytest.fixture
+def slow_coingecko(monkeypatch):
+    async def handler(request):
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json={"image": {"large": ICON}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://coingecko.test")
+    monkeypatch.setattr(services, "get_http_client", lambda: client)
+    return client
+
+
+async def test_an_icon_lookup_gives_up_at_the_request_deadline_and_caches_later(slow_coingecko):
+    token = set_deadline(50)
+    try:
+        started = time.perf_counter()
+        assert await CoinGeckoService.get_coin_icon_url("bitcoin") is None
+        assert time.perf_counter() - started < 0.2
+    finally:
+        request_deadline.reset(token)
+
+    # the lookup carried on in the background
+    await asyncio.sleep(0.4)
+    assert await redis_client.get("crypto_portfolio:icon:bitcoin") == ICON
+    assert await CoinGeckoService.get_coin_icon_url("bitcoin") == ICON
+
+
+async def test_without_a_deadline_the_lookup_waits_for_the_icon(slow_coingecko):
+    assert await CoinGeckoService.get_coin_icon_url("bitcoin") == ICON
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from services import CoinGeckoService, redis_client
+from services import CoinGeckoService, price_cache
 import time
 
 test_router = APIRouter(tags=["testing"], prefix="/test")
@@ -46,7 +46,7 @@ async def test_force_rate_limit():
     # clear cache for specific coins with currency
     cleared_coins = ["bitcoin", "ethereum"]
     for coin in cleared_coins:
-        redis_client.delete(f"crypto_portfolio:price:{coin}:php")
+        await price_cache.delete(CoinGeckoService.price_cache_key(coin, "php"))
     
     start_time = time.time()
     results = []
@@ -124,7 +124,7 @@ async def test_cache_performance():
     results = []
     
     # clear cache first with currency
-    redis_client.delete(f"crypto_portfolio:price:{test_coin}:php")
+    await price_cache.delete(CoinGeckoService.price_cache_key(test_coin, "php"))
     
     for i in range(5):
         start_time = time.time()
@@ -0,0 +1,47 @@
+import pytest
+from services import CoinGeckoService, bump_holdings_version, price_cache
+
+pytestmark = pytest.mark.anyio
+
+BTC = CoinGeckoService.price_cache_key("bitcoin", "usd")
+
+
+async def test_portfolio_answers_304_until_holdings_or_prices_change(client):
+    response = await client.get("/portfolio/")
+    etag = response.headers["etag"]
+    assert response.status_code == 200
+    assert response.json()[0]["current_value"] == 100.0
+
+    response = await client.get("/portfolio/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    await price_cache.set_many({BTC: 60.0})
+    response = await client.get("/portfolio/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["current_value"] == 120.0
+    etag = response.headers["etag"]
+
+    await bump_holdings_version(1)
+    response = await client.get("/portfolio/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+async def test_stats_etag_follows_the_revalued_totals(client, upstream):
+    response = await client.get("/portfolio/stats")
+    etag = response.headers["etag"]
+    assert response.json()["total_current_value"] == 100.0
+
+    response = await client.get("/portfolio/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # a price write revalues the materialized totals and moves their version with them
+    upstream.price = 70.0
+    await CoinGeckoService.refresh_pairs([("bitcoin", "usd")], blocking=False)
+
+    response = await client.get("/portfolio/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["total_current_value"] == 140.0
+    assert response.headers["etag"] != etag
@@ -0,0 +1,134 @@
+import json
+import pytest
+import main
+
+pytestmark = pytest.mark.anyio
+
+CSV_HEADER = "coin,coin_symbol,quantity,buy_price,currency,notes"
+
+
+def holding(coin="ethereum", quantity=1.5, notes=None):
+    return {"coin": coin, "coin_symbol": coin[:3], "quantity": quantity, "buy_price": 10.0, "currency": "usd", "notes": notes}
+
+
+async def in_pieces(body: bytes, size: int):
+    # a chunked upload, every piece reaches the parser on its own
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def post_import(client, body: str, content_type="application/json", piece_size=None):
+    data = body.encode()
+    content = in_pieces(data, piece_size) if piece_size else data
+    return await client.post("/portfolio/import", content=content, headers={"Content-Type": content_type})
+
+
+async def imported_notes(client):
+    return {h["coin"]: h["notes"] for h in (await client.get("/portfolio/")).json()}
+
+
+@pytest.mark.parametrize("piece_size", [None, 1, 7])
+async def test_csv_quoted_fields_span_lines_and_escape_quotes(client, upstream, piece_size):
+    body = (
+        f"{CSV_HEADER}\n"
+        'ethereum,eth,1.5,10,usd,"bought on ""dip""\nsecond line"\n'
+        "solana,sol,2,10,usd,\n"
+        'cardano,ada,3,10,usd,"a, b"'  # no trailing newline
+    )
+
+    response = await post_import(client, body, "text/csv", piece_size)
+
+    assert response.status_code == 200
+    assert (response.json()["imported"], response.json()["failed"]) == (3, 0)
+    notes = await imported_notes(client)
+    assert notes["ethereum"] == 'bought on "dip"\nsecond line'
+    assert notes["solana"] is None
+    assert notes["cardano"] == "a, b"
+
+
+async def test_csv_with_crlf_line_endings(client, upstream):
+    body = f"{CSV_HEADER}\r\nethereum,eth,1.5,10,usd,\"one\r\ntwo\"\r\nsolana,sol,2,10,usd,x\r\n"
+
+    response = await post_import(client, body, "text/csv", piece_size=5)
+
+    assert (response.json()["imported"], response.json()["failed"]) == (2, 0)
+    notes = await imported_notes(client)
+    assert notes["ethereum"] == "one\r\ntwo"
+    assert notes["solana"] == "x"
+
+
+async def test_csv_rows_that_fail_validation_are_reported_by_number(client, upstream):
+    body = f"{CSV_HEADER}\nethereum,eth,lots,10,usd,\nsolana,sol,2,10,usd,\n"
+
+    summary = (await post_import(client, body, "text/csv")).json()
+
+    assert (summary["imported"], summary["failed"]) == (1, 1)
+    assert summary["errors"][0]["row"] == 1
+    assert summary["errors"][0]["error"].startswith("quantity:")
+
+
+@pytest.mark.parametrize("piece_size", [1, 3, 11])
+async def test_json_pieces_may_split_elements_strings_and_numbers(client, upstream, piece_size):
+    body = json.dumps([holding("ethereum", 12345.678, notes="a [tricky], \"note\""), holding("solana", 2)])
+    body += "  \n"
+
+    summary = (await post_import(client, body, piece_size=piece_size)).json()
+
+    assert (summary["imported"], summary["failed"]) == (2, 0)
+    assert summary["total_invested"] == pytest.approx((12345.678 + 2) * 10)
+    assert (await imported_notes(client))["ethereum"] == 'a [tricky], "note"'
+
+
+async def test_a_top_level_number_split_across_pieces_stays_one_element(client, upstream):
+    body = "[" + json.dumps(holding()) + ", 12345]"
+
+    response = await post_import(client, body, piece_size=len(body) - 3)
+
+    # one invalid row, not a parse error on a number cut in two
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["imported"], summary["failed"]) == (1, 1)
+    assert summary["errors"][0]["row"] == 2
+
+
+@pytest.mark.parametrize("body, detail", [
+    ("[" + json.dumps(holding()) + ",]", "Could not parse import file"),
+    (json.dumps(holding()), "expected a JSON list of holdings"),
+    ("[" + json.dumps(holding()), "incomplete JSON list"),
+    ("[] []", "extra data after the JSON list"),
+    ("[" + json.dumps(holding()) + " " + json.dumps(holding()) + "]", "expected ',' or ']'"),
+])
+async def test_malformed_json_is_a_400(client, upstream, body, detail):
+    response = await post_import(client, body, piece_size=4)
+
+    assert response.status_code == 400
+    assert detail in response.json()["detail"]
+
+
+async def test_an_empty_list_imports_nothing(client, upstream):
+    summary = (await post_import(client, " [ ] ")).json()
+
+    assert (summary["imported"], summary["failed"]) == (0, 0)
+
+
+@pytest.mark.parametrize("piece_size", [None, 16])
+async def test_uploads_over_the_byte_limit_are_a_413(client, upstream, monkeypatch, piece_size):
+    # with and without a Content-Length, a chunked upload is counted as it streams in
+    monkeypatch.setattr(main, "IMPORT_MAX_BYTES", 100)
+    body = json.dumps([holding() for _ in range(5)])
+
+    response = await post_import(client, body, piece_size=piece_size)
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Import file is too large"
+
+
+async def test_uploads_over_the_row_limit_are_a_413(client, upstream, monkeypatch):
+    monkeypatch.setattr(main, "IMPORT_MAX_ROWS", 2)
+    body = "\n".join([CSV_HEADER] + ["ethereum,eth,1,10,usd,"] * 3)
+
+    response = await post_import(client, body, "text/csv")
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Import is limited to 2 rows"
+    assert len((await client.get("/portfolio/")).json()) == 1
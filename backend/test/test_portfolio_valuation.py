@@ -0,0 +1,58 @@
+import pytest
+import services
+from portfolio_valuation import (
+    apply_holding_deltas, begin_holdings_write, get_valuation, read_rebuild_stamp, revalue_pairs, store_valuation
+)
+
+pytestmark = pytest.mark.anyio
+
+BTC_POSITION = ("bitcoin", "usd", 2.0, 20.0, 1, 50.0)
+
+
+async def test_a_rebuild_that_read_the_database_before_the_commit_is_not_stored():
+    await begin_holdings_write(1)
+    # the rebuild starts here, after the first bump, and reads the holdings before the commit
+    stamp = await read_rebuild_stamp(1)
+    # the commit, then the deltas, with no stored valuation to adjust yet
+    await apply_holding_deltas(1, [("ethereum", "usd", 1.0, 5.0, 1, 10.0)])
+
+    totals = await store_valuation(1, stamp, [BTC_POSITION])
+
+    assert totals.version is None
+    assert await get_valuation(1) is None
+
+
+async def test_deltas_adjust_a_stored_valuation_and_move_its_version():
+    stored = await store_valuation(1, await read_rebuild_stamp(1), [BTC_POSITION])
+
+    await begin_holdings_write(1)
+    await apply_holding_deltas(1, [("bitcoin", "usd", 1.0, 30.0, 1, None)])
+    valuation = await get_valuation(1)
+
+    assert (valuation.invested, valuation.value, valuation.count) == (50.0, 150.0, 2)
+    assert valuation.version != stored.version
+
+
+async def test_price_writes_reach_the_valuations_through_the_change_hook(upstream):
+    await store_valuation(1, await read_rebuild_stamp(1), [BTC_POSITION])
+    assert revalue_pairs in services._price_change_listeners
+
+    upstream.price = 70.0
+    await services.CoinGeckoService.refresh_pairs([("bitcoin", "usd")], blocking=False)
+
+    assert (await get_valuation(1)).value == 140.0
+
+
+async def test_a_failing_listener_does_not_stop_the_others(monkeypatch):
+    seen = []
+
+    async def broken(prices):
+        raise RuntimeError("boom")
+
+    async def recording(prices):
+        seen.append(prices)
+
+    monkeypatch.setattr(services, "_price_change_listeners", [broken, recording])
+    await services.notify_price_change({("bitcoin", "usd"): 1.0})
+
+    assert seen == [{("bitcoin", "usd"): 1.0}]
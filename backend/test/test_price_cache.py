@@ -0,0 +1,78 @@
+import json
+import time
+import pytest
+from services import CoinGeckoService, price_cache, redis_client, PRICE_HARD_TTL, PRICE_SOFT_TTL, PRICE_VERSION_KEY
+
+pytestmark = pytest.mark.anyio
+
+BTC = CoinGeckoService.price_cache_key("bitcoin", "usd")
+ETH = CoinGeckoService.price_cache_key("ethereum", "usd")
+SOL = CoinGeckoService.price_cache_key("solana", "usd")
+
+
+async def test_set_many_writes_l1_and_redis_with_the_hard_ttl():
+    changed = await price_cache.set_many({BTC: 100.0, ETH: 10.0})
+
+    assert sorted(changed) == sorted([BTC, ETH])
+    assert price_cache._local[BTC].price == 100.0
+    assert json.loads(await redis_client.get(BTC))["price"] == 100.0
+    assert 0 < await redis_client.ttl(ETH) <= PRICE_HARD_TTL
+
+
+async def test_set_many_bumps_the_price_version_only_when_a_price_moves():
+    await price_cache.set_many({BTC: 100.0})
+    version = await redis_client.get(PRICE_VERSION_KEY)
+
+    assert await price_cache.set_many({BTC: 100.0}) == []
+    assert await redis_client.get(PRICE_VERSION_KEY) == version
+
+    assert await price_cache.set_many({BTC: 101.0}) == [BTC]
+    assert int(await redis_client.get(PRICE_VERSION_KEY)) > int(version)
+
+
+async def test_get_many_reads_every_l1_miss_in_one_mget(monkeypatch):
+    await price_cache.set_many({BTC: 100.0, ETH: 10.0})
+    price_cache._local.clear()
+    calls = []
+    mget = redis_client.mget
+
+    async def counting_mget(keys):
+        calls.append(list(keys))
+        return await mget(keys)
+
+    monkeypatch.setattr(redis_client, "mget", counting_mget)
+    quotes = await price_cache.get_many([BTC, ETH, SOL])
+
+    assert calls == [[BTC, ETH, SOL]]
+    assert quotes[BTC].price == 100.0 and quotes[ETH].price == 10.0 and quotes[SOL] is None
+    # redis hits went back into L1, fresh ones are answered without redis
+    await price_cache.get_many([BTC, ETH])
+    assert len(calls) == 1
+
+
+async def test_past_the_soft_ttl_a_quote_is_served_stale():
+    await price_cache.set_many({BTC: 100.0}, fetched_at=time.time() - PRICE_SOFT_TTL - 1)
+
+    quote = (await price_cache.get_many([BTC]))[BTC]
+
+    assert quote.price == 100.0
+    assert quote.is_stale
+
+
+async def test_past_the_hard_ttl_a_quote_is_dropped():
+    await price_cache.set_many({BTC: 100.0}, fetched_at=time.time() - PRICE_HARD_TTL - 1)
+
+    assert (await price_cache.get_many([BTC]))[BTC] is None
+    assert BTC not in price_cache._local
+
+
+async def test_a_newer_quote_from_another_worker_replaces_a_stale_l1_entry():
+    await price_cache.set_many({BTC: 100.0}, fetched_at=time.time() - PRICE_SOFT_TTL - 1)
+    # another worker refreshed it in redis
+    await redis_client.set(BTC, json.dumps({"price": 105.0, "fetched_at": time.time()}))
+
+    quote = (await price_cache.get_many([BTC]))[BTC]
+
+    assert quote.price == 105.0
+    assert not quote.is_stale
+    assert price_cache._local[BTC].price == 105.0
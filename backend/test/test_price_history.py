@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from sqlalchemy import delete, insert
+from database import engine
+from models import Holding, PriceRollup
+from price_history import DAY, MINUTE, value_series
+
+pytestmark = pytest.mark.anyio
+
+BTC, ETH, BTC_PHP = ("bitcoin", "usd"), ("ethereum", "usd"), ("bitcoin", "php")
+
+
+def series_of(positions, rows, before_range=None):
+    buckets = np.unique(np.array([bucket for _, bucket, _ in rows]))
+    return value_series(positions, buckets, rows, before_range or {})
+
+
+def test_a_holding_counts_from_the_bucket_it_was_added_in():
+    positions = {BTC: [(0, 1.0), (120, 2.0)]}
+    rows = [(BTC, 0, 10.0), (BTC, 60, 11.0), (BTC, 120, 12.0)]
+
+    assert series_of(positions, rows) == {"usd": [(0, 10.0), (60, 11.0), (120, 36.0)]}
+
+
+def test_the_last_price_is_carried_including_the_one_before_the_range():
+    positions = {BTC: [(0, 1.0)], ETH: [(0, 2.0)]}
+    rows = [(BTC, 60, 10.0), (ETH, 120, 5.0), (BTC, 180, 20.0)]
+
+    assert series_of(positions, rows, {ETH: 4.0}) == {"usd": [(60, 18.0), (120, 20.0), (180, 30.0)]}
+
+
+def test_buckets_where_a_counted_pair_has_no_price_yet_are_left_out():
+    positions = {BTC: [(0, 1.0)], ETH: [(0, 1.0)], BTC_PHP: [(0, 1.0)]}
+    rows = [(BTC, 60, 10.0), (BTC_PHP, 60, 500.0), (ETH, 120, 5.0)]
+
+    series = series_of(positions, rows)
+
+    # usd waits for ethereum's first price, php doesn't depend on it
+    assert series == {"usd": [(120, 15.0)], "php": [(60, 500.0), (120, 500.0)]}
+
+
+def test_a_pair_not_held_yet_does_not_hold_its_currency_back():
+    positions = {BTC: [(0, 1.0)], ETH: [(120, 1.0)]}
+    rows = [(BTC, 60, 10.0), (ETH, 120, 5.0)]
+
+    assert series_of(positions, rows) == {"usd": [(60, 10.0), (120, 15.0)]}
+
+
+async def test_history_endpoint_serves_the_rollups(client):
+    now = int(time.time())
+    bucket = now - now % MINUTE
+    added = datetime.fromtimestamp(bucket - 10 * MINUTE, tz=timezone.utc).replace(tzinfo=None)
+    async with engine.begin() as conn:
+        await conn.execute(delete(Holding))
+        await conn.execute(delete(PriceRollup))
+        await conn.execute(insert(Holding), [{
+            "user_id": 1, "coin": "bitcoin", "coin_symbol": "btc", "quantity": 2.0, "buy_price": 10.0,
+            "currency": "usd", "created_at": added,
+        }])
+        await conn.execute(insert(PriceRollup), [
+            {"coin": "bitcoin", "currency": "usd", "resolution": MINUTE, "bucket": bucket - 2 * DAY, "price": 5.0},
+            {"coin": "bitcoin", "currency": "usd", "resolution": MINUTE, "bucket": bucket - 20 * MINUTE, "price": 6.0},
+            {"coin": "bitcoin", "currency": "usd", "resolution": MINUTE, "bucket": bucket - 10 * MINUTE, "price": 7.0},
+            {"coin": "bitcoin", "currency": "usd", "resolution": MINUTE, "bucket": bucket, "price": 8.0},
+        ])
+
+    response = await client.get("/portfolio/history", params={"range": "1d"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["resolution_seconds"] == MINUTE
+    assert [point["value"] for point in body["series"]["usd"]] == [14.0, 16.0]
+    assert (await client.get("/portfolio/history", params={"range": "2w"})).status_code == 400
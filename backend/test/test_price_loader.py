@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from services import CoinGeckoService, PriceLoader, SingleFlight, price_cache, redis_client
+
+pytestmark = pytest.mark.anyio
+
+BTC = CoinGeckoService.price_cache_key("bitcoin", "usd")
+
+
+async def test_concurrent_misses_make_one_upstream_call(upstream):
+
+    results = await asyncio.gather(*(
+        CoinGeckoService.refresh_pairs([("bitcoin", "usd")], blocking=False) for _ in range(500)
+    ))
+
+    assert len(upstream.calls) == 1
+    assert all(result == {("bitcoin", "usd"): 42.0} for result in results)
+    assert (await price_cache.get_many([BTC]))[BTC].price == 42.0
+
+
+async def test_price_loader_merges_concurrent_callers_into_one_fetch(upstream):
+    loader = PriceLoader(upstream.fetch_prices, window_ms=20, max_ids=1000)
+
+    results = await asyncio.gather(*(loader.load([(f"coin-{i}", "usd")]) for i in range(500)))
+
+    assert len(upstream.calls) == 1
+    assert len(upstream.calls[0][0]) == 500
+    assert results[7] == {("coin-7", "usd"): 42.0}
+
+
+async def test_price_loader_splits_batches_at_max_ids(upstream):
+    loader = PriceLoader(upstream.fetch_prices, window_ms=20, max_ids=100)
+
+    await asyncio.gather(*(loader.load([(f"coin-{i}", "usd")]) for i in range(500)))
+
+    assert sorted(len(coin_ids) for coin_ids, _ in upstream.calls) == [100] * 5
+
+
+async def test_single_flight_waits_for_a_fetch_another_worker_holds_the_lock_for():
+    flight = SingleFlight(lock_ms=1000, poll_interval=0.01)
+    await redis_client.set("key:lock", "other-worker", px=1000)
+    fetched = []
+    cache = {}
+
+    async def fetch(keys):
+        fetched.append(keys)
+        return {key: 1.0 for key in keys}
+
+    async def read_cached(keys):
+        return {key: cache.get(key) for key in keys}
+
+    async def other_worker():
+        await asyncio.sleep(0.03)
+        cache["key"] = 7.0
+
+    result, _ = await asyncio.gather(flight.do(["key"], fetch, read_cached), other_worker())
+
+    assert result == {"key": 7.0}
+    assert fetched == []
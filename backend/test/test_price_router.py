@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from sqlalchemy import delete
+from coin_catalog import ensure_catalog
+from database import Base, engine
+from models import Coin
+from services import CryptoCompareProvider, PriceProvider, PriceRouter
+
+pytestmark = pytest.mark.anyio
+
+
+class StubProvider(PriceProvider):
+    def __init__(self, name, prices, throttle_wait=0.0):
+        self.name = name
+        super().__init__()
+        self.prices = prices
+        self.throttle_wait = throttle_wait
+        self.calls = 0
+
+    async def acquire(self, coin_ids, blocking):
+        await asyncio.sleep(self.throttle_wait)
+        return coin_ids
+
+    async def fetch_prices(self, coin_ids, currencies, blocking):
+        self.calls += 1
+        return {pair: price for pair, price in self.prices.items() if pair[0] in coin_ids}
+
+
+async def test_an_empty_answer_is_no_success_and_the_next_provider_is_asked():
+    empty = StubProvider("empty", {})
+    backup = StubProvider("backup", {("bitcoin", "usd"): 50.0})
+
+    prices = await PriceRouter([empty, backup]).fetch_prices(["bitcoin"], ["usd"])
+
+    assert prices == {("bitcoin", "usd"): 50.0}
+    assert backup.calls == 1
+    assert len(empty.latencies) == 0 and len(backup.latencies) == 1
+
+
+async def test_waiting_on_the_throttle_is_not_measured_as_latency():
+    throttled = StubProvider("throttled", {("bitcoin", "usd"): 50.0}, throttle_wait=0.2)
+
+    await PriceRouter([throttled]).fetch_prices(["bitcoin"], ["usd"])
+
+    assert throttled.latencies[0] < 0.1
+
+
+async def test_cryptocompare_finds_symbols_without_the_catalog_refresher():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(delete(Coin))
+    # what the api lifespan does, from the bundled snapshot
+    await ensure_catalog()
+
+    symbols = await CryptoCompareProvider().symbols_for(["bitcoin", "ethereum", "not-a-coin"])
+
+    assert symbols == {"bitcoin": "BTC", "ethereum": "ETH"}
@@ -0,0 +1,45 @@
+import asyncio
+import time
+import pytest
+import auth
+import main
+from auth import ClaimsJWTStrategy, JWT_SIGNING_KEY, revoke_user_tokens
+from models import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def fast_keepalive(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_KEEPALIVE", 0.05)
+    auth._revocations.clear()
+
+
+async def test_the_stream_ends_when_the_token_expires(client):
+    token = await ClaimsJWTStrategy(secret=JWT_SIGNING_KEY, lifetime_seconds=1).write_token(
+        User(id=1, is_active=True, is_verified=True)
+    )
+    started = time.time()
+
+    response = await asyncio.wait_for(
+        client.get("/portfolio/stream", headers={"Authorization": f"Bearer {token}"}), timeout=5
+    )
+
+    assert response.status_code == 200
+    assert response.text.startswith("event: snapshot\n")
+    assert time.time() - started < 3
+
+
+async def test_the_stream_ends_once_the_token_is_revoked(client, monkeypatch):
+    # no cached answer, so the next keepalive sees the revocation
+    monkeypatch.setattr(auth, "REVOCATION_CACHE_TTL", 0)
+    request = asyncio.create_task(client.get("/portfolio/stream"))
+    await asyncio.sleep(0.2)
+    assert not request.done()
+
+    await revoke_user_tokens(1)
+    response = await asyncio.wait_for(request, timeout=5)
+
+    assert response.status_code == 200
+    assert response.text.count("event: snapshot") == 1
+    assert ": keepalive" in response.text
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from services import RedisTokenBucket
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_token_bucket_allows_the_burst_then_refuses():
+    bucket = RedisTokenBucket("test", requests_per_minute=60, burst=3)
+
+    assert [await bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    # one token a second
+    assert 0 < await bucket._take() <= 1000
+
+
+async def test_token_bucket_refills_over_time():
+    # one token every 100 ms
+    bucket = RedisTokenBucket("test", requests_per_minute=600, burst=1)
+
+    assert await bucket.try_acquire()
+    assert not await bucket.try_acquire()
+    await asyncio.sleep(0.15)
+    assert await bucket.try_acquire()
+
+
+async def test_token_bucket_is_shared_through_redis():
+    # two workers with their own instance draw from the same bucket
+    first = RedisTokenBucket("test", requests_per_minute=60, burst=2)
+    second = RedisTokenBucket("test", requests_per_minute=60, burst=2)
+
+    assert await first.try_acquire()
+    assert await second.try_acquire()
+    assert not await first.try_acquire()
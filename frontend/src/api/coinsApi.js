@@ -0,0 +1,16 @@
+import api from './axiosConfig';
+
+export const coinsApi = {
+  // prefix search over the whole coin catalog, best market cap first
+  searchCoins: async (query, limit = 8, signal) => {
+    const response = await api.get('/coins/search', {
+      params: { q: query, limit },
+      signal,
+    });
+    return response.data.map((coin) => ({
+      id: coin.id,
+      name: coin.name,
+      symbol: coin.symbol.toUpperCase(),
+    }));
+  },
+};
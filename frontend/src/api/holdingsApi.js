@@ -1,4 +1,4 @@
-import api from './axiosConfig';
+import api, { API_BASE } from './axiosConfig';
 
 export const holdingsApi = {
   getMyPortfolio: async () => {
@@ -20,4 +20,41 @@ export const holdingsApi = {
     const response = await api.get('/portfolio/stats');
     return response.data;
   },
+
+  // server sent events over fetch, EventSource can't send the bearer token
+  streamPortfolio: async (onEvent, signal) => {
+    const response = await fetch(`${API_BASE}/portfolio/stream`, {
+      headers: {
+        Authorization: `Bearer ${localStorage.getItem('access_token')}`,
+      },
+      signal,
+    });
+    if (!response.ok) {
+      throw new Error(`Portfolio stream failed with ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) {
+        return;
+      }
+      buffer += decoder.decode(value, { stream: true });
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop();
+      for (const message of messages) {
+        let event = 'message';
+        let data = '';
+        for (const line of message.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (data) {
+          onEvent(event, JSON.parse(data));
+        }
+      }
+    }
+  },
 };
@@ -4,6 +4,20 @@ import { TbCoins } from 'react-icons/tb';
 import { FaCoins } from 'react-icons/fa6';
 import { FaMoneyBills } from 'react-icons/fa6';
 import { CRYPTO_COINS } from '../../data/cryptoCoins';
+import { coinsApi } from '../../api/coinsApi';
+
+// wait for a pause in typing before asking the server
+const SEARCH_DEBOUNCE_MS = 150;
+
+const filterLocalCoins = (query) => {
+  if (query === '') return CRYPTO_COINS.slice(0, 10);
+  return CRYPTO_COINS.filter(
+    (coin) =>
+      coin.name.toLowerCase().includes(query) ||
+      coin.symbol.toLowerCase().includes(query) ||
+      coin.id.toLowerCase().includes(query)
+  ).slice(0, 8);
+};
 
 const AddHoldingModal = ({
   isOpen = false,
@@ -25,7 +39,8 @@ const AddHoldingModal = ({
   const [errors, setErrors] = useState({});
   const [searchQuery, setSearchQuery] = useState('');
   const [showDropdown, setShowDropdown] = useState(false);
-  const [filteredCoins, setFilteredCoins] = useState(CRYPTO_COINS);
+  const [filteredCoins, setFilteredCoins] = useState(CRYPTO_COINS.slice(0, 10));
+  const [selectedCoinName, setSelectedCoinName] = useState('');
 
   useEffect(() => {
     const quantity = parseFloat(formData.quantity) || 0;
@@ -53,18 +68,28 @@ const AddHoldingModal = ({
   const inputRef = useRef(null);
 
   useEffect(() => {
-    if (searchQuery.trim() === '') {
-      setFilteredCoins(CRYPTO_COINS.slice(0, 10));
-    } else {
-      const query = searchQuery.toLowerCase();
-      const filtered = CRYPTO_COINS.filter(
-        (coin) =>
-          coin.name.toLowerCase().includes(query) ||
-          coin.symbol.toLowerCase().includes(query) ||
-          coin.id.toLowerCase().includes(query)
-      ).slice(0, 8);
-      setFilteredCoins(filtered);
-    }
+    const query = searchQuery.trim().toLowerCase();
+    // the server searches the whole catalog, the bundled list is only a fallback when it can't be reached
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const coins = await coinsApi.searchCoins(
+          query,
+          query === '' ? 10 : 8,
+          controller.signal
+        );
+        setFilteredCoins(coins);
+      } catch (error) {
+        if (!controller.signal.aborted) {
+          setFilteredCoins(filterLocalCoins(query));
+        }
+      }
+    }, SEARCH_DEBOUNCE_MS);
+
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
   }, [searchQuery]);
 
   useEffect(() => {
@@ -91,6 +116,7 @@ const AddHoldingModal = ({
       coin: coin.id,
       coin_symbol: coin.symbol,
     });
+    setSelectedCoinName(coin.name);
     setSearchQuery(`${coin.name} (${coin.symbol})`);
     setShowDropdown(false);
     if (errors.coin) {
@@ -207,6 +233,7 @@ const AddHoldingModal = ({
     });
     setInputMode('perCoin');
     setSearchQuery('');
+    setSelectedCoinName('');
     setErrors({});
     setShowDropdown(false);
     onClose();
@@ -312,7 +339,7 @@ const AddHoldingModal = ({
               >
                 <div className="text-sm text-foreground">
                   <span className="font-medium">Selected:</span>{' '}
-                  {CRYPTO_COINS.find((c) => c.id === formData.coin)?.name} (
+                  {selectedCoinName} (
                   {formData.coin_symbol})
                 </div>
                 <div className="text-xs text-muted mt-1">
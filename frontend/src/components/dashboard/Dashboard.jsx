@@ -14,6 +14,7 @@ import Button from '../ui/Button';
 import Modal from '../ui/Modal';
 import AddHoldingModal from './AddHoldingModal';
 import { usePolling } from '../../hooks/usePolling';
+import { usePortfolioStream } from '../../hooks/usePortfolioStream';
 import CoinDetailModal from './CoinDetailModal';
 import { useToast } from '../../hooks/useToast';
 import Toast from '../ui/Toast';
@@ -27,6 +28,7 @@ const Dashboard = () => {
     fetchPortfolioData,
     deleteHolding,
     addHolding,
+    applyStreamEvent,
   } = useHoldings();
 
   const [deleteModal, setDeleteModal] = useState({
@@ -45,10 +47,13 @@ const Dashboard = () => {
     fetchPortfolioData();
   }, []);
 
+  // prices are pushed while the stream is up, polling is only the fallback
+  const streamConnected = usePortfolioStream(applyStreamEvent);
+
   usePolling(() => {
     console.log('POLLING: Auto-refreshing portfolio data...');
     fetchPortfolioData();
-  }, 40000);
+  }, streamConnected ? null : 40000);
 
   const handleRefresh = async () => {
     setIsRefreshing(true);
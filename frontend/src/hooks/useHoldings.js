@@ -115,6 +115,17 @@ export const useHoldings = () => {
     }
   };
 
+  // "snapshot" replaces the list, "prices" only carries the holdings whose price moved
+  const applyStreamEvent = (event, data) => {
+    if (event === 'snapshot') {
+      setHoldings(data.holdings);
+    } else if (event === 'prices') {
+      const updated = new Map(data.holdings.map((h) => [h.id, h]));
+      setHoldings((prev) => prev.map((h) => updated.get(h.id) || h));
+    }
+    setPortfolioStats(data.stats);
+  };
+
   const clearError = () => {
     setError(null);
   };
@@ -129,6 +140,7 @@ export const useHoldings = () => {
     addHolding,
     deleteHolding,
     fetchPortfolioData,
+    applyStreamEvent,
     clearError,
   };
 };
@@ -0,0 +1,41 @@
+import { useEffect, useRef, useState } from 'react';
+import { holdingsApi } from '../api/holdingsApi';
+
+const RECONNECT_DELAY = 5000;
+
+// live holdings and stats pushed by the server, reconnects after a dropped connection
+export const usePortfolioStream = (onEvent) => {
+  const [connected, setConnected] = useState(false);
+  const savedOnEvent = useRef();
+
+  useEffect(() => {
+    savedOnEvent.current = onEvent;
+  }, [onEvent]);
+
+  useEffect(() => {
+    const controller = new AbortController();
+    let timeoutId;
+
+    const connect = async () => {
+      try {
+        await holdingsApi.streamPortfolio((event, data) => {
+          setConnected(true);
+          savedOnEvent.current(event, data);
+        }, controller.signal);
+      } catch (error) {
+        if (controller.signal.aborted) return;
+        console.log('STREAM: connection failed', error);
+      }
+      setConnected(false);
+      timeoutId = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    connect();
+    return () => {
+      controller.abort();
+      clearTimeout(timeoutId);
+    };
+  }, []);
+
+  return connected;
+};